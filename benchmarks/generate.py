@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generates synthetic MOPST inputs: landcover polygons with a Main_habit
+field, sensitivity and seasonality tables, pressure and opportunity
+rasters and factor rasters, together with factor and scenario weights.
+
+    python generate.py OUTPUT_DIR --size 2048 --factors 20 --scenarios 3
+"""
+
+import os
+import csv
+import json
+import argparse
+
+import numpy
+from osgeo import gdal, ogr, osr
+
+# British National Grid, like the demo data
+EPSG = 27700
+ORIGIN = (500000, 200000)
+PIXEL_SIZE = 10
+
+SENSITIVITY_FIELD = "Sensitivity"
+
+
+def writeRaster(path, data, srs):
+    ds = gdal.GetDriverByName("GTiff").Create(path, data.shape[1], data.shape[0], 1, gdal.GDT_Byte,
+                                              ["TILED=YES", "COMPRESS=DEFLATE"])
+    ds.SetGeoTransform((ORIGIN[0], PIXEL_SIZE, 0, ORIGIN[1] + data.shape[0] * PIXEL_SIZE, 0, -PIXEL_SIZE))
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).WriteArray(data)
+    ds.FlushCache()
+
+
+def patches(rng, size, density):
+    # 0/1 raster of square patches covering roughly the given share of pixels
+    coarse = (rng.random((size // 16 + 1, size // 16 + 1)) < density).astype(numpy.uint8)
+    return numpy.kron(coarse, numpy.ones((16, 16), numpy.uint8))[:size, :size]
+
+
+def writeLandcover(path, size, cellSize, habitats, rng, srs):
+    # grid of square polygons, each with a random habitat
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    layer = ds.CreateLayer("landcover", srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("Main_habit", ogr.OFTString))
+
+    top = ORIGIN[1] + size * PIXEL_SIZE
+    step = cellSize * PIXEL_SIZE
+    for row in range(0, size, cellSize):
+        for col in range(0, size, cellSize):
+            x = ORIGIN[0] + col * PIXEL_SIZE
+            y = top - row * PIXEL_SIZE
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for px, py in ((x, y), (x + step, y), (x + step, y - step), (x, y - step), (x, y)):
+                ring.AddPoint_2D(px, py)
+            polygon = ogr.Geometry(ogr.wkbPolygon)
+            polygon.AddGeometry(ring)
+
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField("Main_habit", habitats[rng.integers(len(habitats))])
+            feature.SetGeometry(polygon)
+            layer.CreateFeature(feature)
+
+    ds = None
+
+
+def writeTable(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate(directory, size=1024, factors=10, scenarios=3, habitats=20, cellSize=32, seed=0):
+    """
+    Writes a synthetic study area of size x size pixels to the directory
+    and returns the MopstAlgorithm parameters for it.
+    """
+    os.makedirs(os.path.join(directory, "factor-rasters"), exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+
+    names = [f"Habitat {i + 1}" for i in range(habitats)]
+    landcover = os.path.join(directory, "landcover.shp")
+    writeLandcover(landcover, size, cellSize, names, rng, srs)
+
+    sensitivity = os.path.join(directory, "land-cover-sensitivity.csv")
+    writeTable(sensitivity, ["Habitat_environment_type", SENSITIVITY_FIELD],
+               [[n, int(rng.integers(1, 6))] for n in names])
+    seasonality = os.path.join(directory, "seasonality.csv")
+    writeTable(seasonality, ["Habitat_environment_type", "Summer", "Winter"],
+               [[n, int(rng.integers(1, 3)), int(rng.integers(1, 3))] for n in names])
+
+    pressure = os.path.join(directory, "pressures.tif")
+    writeRaster(pressure, patches(rng, size, 0.5), srs)
+    opportunity = os.path.join(directory, "opportunity.tif")
+    writeRaster(opportunity, patches(rng, size, 0.5), srs)
+
+    factorFiles = []
+    factorWeights = []
+    for i in range(factors):
+        name = f"factor-{i + 1:03}.tif"
+        path = os.path.join(directory, "factor-rasters", name)
+        writeRaster(path, patches(rng, size, rng.uniform(0.05, 0.5)), srs)
+        factorFiles.append(path)
+        factorWeights += [name, round(float(rng.uniform(-3, 7)), 1), round(float(rng.uniform(-3, 7)), 1)]
+
+    scenarioWeights = []
+    for s in range(scenarios):
+        for i in range(factors):
+            scenarioWeights += [f"Scenario {s + 1}", f"factor-{i + 1:03}.tif",
+                                round(float(rng.uniform(0.3, 3)), 2), round(float(rng.uniform(0.3, 3)), 2)]
+
+    parameters = {"LAND_COVER": landcover,
+                  "LANDCOVER_SENSITIVITY": sensitivity,
+                  "SENSITIVITY_SCORE_FIELD": SENSITIVITY_FIELD,
+                  "SEASONALITY_SCORE": seasonality,
+                  "PRESSURE_AREAS": pressure,
+                  "OPPORTUNITY_AREAS": opportunity,
+                  "FACTORS": factorFiles,
+                  "FACTOR_WEIGHTS": factorWeights,
+                  "SCENARIO_WEIGHTS": scenarioWeights,
+                 }
+    with open(os.path.join(directory, "parameters.json"), "w", encoding="utf-8") as f:
+        json.dump(parameters, f, indent=2)
+
+    return parameters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic MOPST inputs.")
+    parser.add_argument("directory")
+    parser.add_argument("--size", type=int, default=1024, help="raster width and height in pixels")
+    parser.add_argument("--factors", type=int, default=10)
+    parser.add_argument("--scenarios", type=int, default=3)
+    parser.add_argument("--habitats", type=int, default=20)
+    parser.add_argument("--cell-size", type=int, default=32, help="landcover polygon size in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.directory, args.size, args.factors, args.scenarios, args.habitats, args.cell_size, args.seed)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs MopstAlgorithm headlessly over a grid of study area sizes, factor
+counts, scenario counts and scoring engines, and writes wall time, CPU
+time, peak memory and I/O of every run to a JSON file.
+
+    python run.py --sizes 512 2048 --factors 5 20 --scenarios 1 3 --engines 0 1 2
+
+Every run happens in a fresh Python process, so memory and I/O figures
+are not mixed between runs. Inputs are generated once per size, factor
+and scenario count and reused.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import itertools
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate import generate
+from mopst.profiler import IO_COUNTERS, ioCounters
+
+
+def directorySize(directory):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(directory) for f in files)
+
+
+def runCase(parameters, output):
+    # runs the algorithm once in this process and returns its measurements
+    import resource
+
+    from qgis.core import QgsApplication, QgsProcessingFeedback
+
+    QgsApplication.setPrefixPath(os.environ.get("QGIS_PREFIX_PATH", "/usr"), True)
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    import processing
+
+    from mopst.provider import MopstProvider
+    provider = MopstProvider()
+    QgsApplication.processingRegistry().addProvider(provider)
+
+    parameters = dict(parameters, OUTPUT=output)
+    readBefore, writeBefore = ioCounters()
+    start = time.perf_counter()
+    processing.run("mopst:mopst", parameters, feedback=QgsProcessingFeedback())
+    wall = time.perf_counter() - start
+    readAfter, writeAfter = ioCounters()
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {"wallTime": wall,
+              "cpuTime": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+              # kilobytes on Linux
+              "peakRss": own.ru_maxrss * 1024,
+              "peakRssChildren": children.ru_maxrss * 1024,
+              "readBytes": None if readBefore is None else readAfter - readBefore,
+              "writeBytes": None if writeBefore is None else writeAfter - writeBefore,
+              "outputBytes": directorySize(output),
+             }
+
+    QgsApplication.processingRegistry().removeProvider(provider)
+    app.exitQgis()
+    return result
+
+
+def environment():
+    from osgeo import gdal
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "processors": os.cpu_count(),
+            "gdal": gdal.__version__,
+            # counters readBytes and writeBytes are taken from, the same as
+            # in profile.json
+            "ioCounters": list(IO_COUNTERS),
+           }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MOPST on synthetic inputs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048], help="raster width and height in pixels")
+    parser.add_argument("--factors", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--scenarios", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--engines", type=int, nargs="+", default=[0, 1, 2],
+                        help="0 raster calculator, 1 block engine, 2 folded raster calculator")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workdir", default="benchmark-data")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # single run started by the harness below
+        case = json.loads(args.case)
+        print(json.dumps(runCase(case["parameters"], case["output"])))
+        return
+
+    results = []
+    for size, factors, scenarios in itertools.product(args.sizes, args.factors, args.scenarios):
+        inputs = os.path.join(args.workdir, f"size{size}-factors{factors}-scenarios{scenarios}")
+        if os.path.exists(os.path.join(inputs, "parameters.json")):
+            with open(os.path.join(inputs, "parameters.json"), encoding="utf-8") as f:
+                parameters = json.load(f)
+        else:
+            parameters = generate(inputs, size, factors, scenarios)
+
+        for engine, repeat in itertools.product(args.engines, range(args.repeat)):
+            output = os.path.join(args.workdir, "output")
+            shutil.rmtree(output, ignore_errors=True)
+            case = {"parameters": dict(parameters, ENGINE=engine), "output": output}
+            row = {"size": size, "factors": factors, "scenarios": scenarios, "engine": engine, "repeat": repeat}
+            print(f"size {size}, {factors} factors, {scenarios} scenarios, engine {engine}, run {repeat + 1}", flush=True)
+
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                                     capture_output=True, text=True)
+            if process.returncode == 0:
+                row.update(json.loads(process.stdout.strip().splitlines()[-1]), status="ok")
+            else:
+                row.update(status="failed", error="\n".join(process.stderr.strip().splitlines()[-5:]))
+            results.append(row)
+
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
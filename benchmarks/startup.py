@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures how much the Plugin adds to the start of a headless QGIS
+process: importing it, registering its Processing provider and creating
+the algorithm, and which heavy modules are loaded by then.
+
+    python startup.py --repeat 10 --output startup-results.json
+
+Every measurement runs in a fresh Python process, median times are
+reported in milliseconds.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# modules only needed once the algorithm runs
+HEAVY_MODULES = ("processing", "numpy", "osgeo.gdal", "mopst.engine", "mopst.landcover", "mopst.parallel")
+
+
+def measure():
+    # one start of QGIS with the Plugin, in this process
+    from qgis.core import QgsApplication
+
+    start = time.perf_counter()
+    QgsApplication.setPrefixPath(os.environ.get("QGIS_PREFIX_PATH", "/usr"), True)
+    app = QgsApplication([], False)
+    app.initQgis()
+    qgisStarted = time.perf_counter()
+
+    import mopst
+    plugin = mopst.classFactory(None)
+    imported = time.perf_counter()
+
+    plugin.initProcessing()
+    registered = time.perf_counter()
+
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    QgsApplication.processingRegistry().algorithmById("mopst:mopst").create()
+    created = time.perf_counter()
+
+    plugin.unload()
+    app.exitQgis()
+    return {"qgis": (qgisStarted - start) * 1000,
+            "import": (imported - qgisStarted) * 1000,
+            "register": (registered - imported) * 1000,
+            "plugin": (registered - qgisStarted) * 1000,
+            "createAlgorithm": (created - registered) * 1000,
+            "heavyModulesAtStartup": loaded,
+           }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the start up cost of the MOPST Plugin.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", default="startup-results.json")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        print(json.dumps(measure()))
+        return
+
+    runs = []
+    for i in range(args.repeat):
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--single"],
+                                 capture_output=True, text=True, check=True)
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    result = {key: statistics.median(r[key] for r in runs)
+              for key in ("qgis", "import", "register", "plugin", "createAlgorithm")}
+    result["heavyModulesAtStartup"] = runs[-1]["heavyModulesAtStartup"]
+    result["runs"] = runs
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"QGIS start {result['qgis']:.1f} ms, Plugin import {result['import']:.1f} ms, "
+          f"provider registration {result['register']:.1f} ms, first algorithm instance {result['createAlgorithm']:.1f} ms")
+    print(f"Heavy modules loaded at start up: {', '.join(result['heavyModulesAtStartup']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
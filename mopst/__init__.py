@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from mopst.plugin import MopstPlugin
-
 
 def classFactory(iface):
+    # the plugin is only imported when QGIS loads it
+    from mopst.plugin import MopstPlugin
     return MopstPlugin()
@@ -17,24 +17,51 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingUtils,
                        QgsProcessingMultiStepFeedback,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterField,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterMultipleLayers,
                        QgsProcessingParameterMatrix,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterFile,
                        QgsProcessingParameterFolderDestination,
                        QgsProcessingOutputMultipleLayers,
+                       QgsProviderRegistry,
                       )
-import processing
 
 from mopst.tables import (FACTOR_WEIGHTS_HEADER,
                           FACTOR_WEIGHTS_DATA,
                           SCENARIO_WEIGHTS_HEADER,
                           SCENARIO_WEIGHTS_DATA,
                          )
+from mopst.cache import RasterCache, inputsKey
+from mopst.manifest import RunManifest
+from mopst.paths import partialPath
+from mopst.planner import ScoringPlan
+from mopst.preflight import inputProblems
+from mopst.profiler import Profiler
+from mopst.scratch import ScratchSpace
+from mopst.weights import WeightModel, readFactorWeights, readScenarioWeights
 
 pluginPath = os.path.dirname(__file__)
 
+# rasterized landcover and its file names
+LANDCOVER_FILES = (("LANDCOVER_BASE", "base_landcover.tif"),
+                   ("LANDCOVER_SUMMER", "summer_landcover.tif"),
+                   ("LANDCOVER_WINTER", "winter_landcover.tif"),
+                  )
+
+# accumulated outputs and their file names
+OUTPUT_FILES = (("PRESSURE_SUMMER", "pressure-summer.tif"),
+                ("OPPORTUNITY_SUMMER", "opportunity-summer.tif"),
+                ("PRESSURE_WINTER", "pressure-winter.tif"),
+                ("OPPORTUNITY_WINTER", "opportunity-winter.tif"),
+               )
+
 
 class MopstAlgorithm(QgsProcessingAlgorithm):
 
@@ -47,9 +74,42 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
     FACTORS = "FACTORS"
     FACTOR_WEIGHTS = "FACTOR_WEIGHTS"
     SCENARIO_WEIGHTS = "SCENARIO_WEIGHTS"
+    FACTOR_WEIGHTS_FILE = "FACTOR_WEIGHTS_FILE"
+    SCENARIO_WEIGHTS_FILE = "SCENARIO_WEIGHTS_FILE"
+    ENGINE = "ENGINE"
+    BLOCK_SIZE = "BLOCK_SIZE"
+    MEMORY_BUDGET = "MEMORY_BUDGET"
+    WORKERS = "WORKERS"
+    THREADS = "THREADS"
+    CACHE_DIR = "CACHE_DIR"
+    CACHE_SIZE = "CACHE_SIZE"
+    LANDCOVER_CLASSES = "LANDCOVER_CLASSES"
+    OUTPUT_FORMAT = "OUTPUT_FORMAT"
+    SCENARIO_CUBES = "SCENARIO_CUBES"
+    SCRATCH_BUDGET = "SCRATCH_BUDGET"
+    PROFILE_SUMMARY = "PROFILE_SUMMARY"
+    SPARSE = "SPARSE"
+    FACTOR_VALUES = "FACTOR_VALUES"
+    ENSEMBLE_SIZE = "ENSEMBLE_SIZE"
+    WEIGHT_UNCERTAINTY = "WEIGHT_UNCERTAINTY"
+    UNCERTAINTY_DISTRIBUTION = "UNCERTAINTY_DISTRIBUTION"
+    ENSEMBLE_PERCENTILES = "ENSEMBLE_PERCENTILES"
+    SUMMARY_STATISTICS = "SUMMARY_STATISTICS"
+    INTERMEDIATE_STORAGE = "INTERMEDIATE_STORAGE"
+    CHECKPOINT_INTERVAL = "CHECKPOINT_INTERVAL"
+    RESUME = "RESUME"
     OUTPUT = "OUTPUT"
     OUTPUT_LAYERS = "OUTPUT_LAYERS"
 
+    ENGINE_CALCULATOR = 0
+    ENGINE_BLOCK = 1
+    ENGINE_FOLDED = 2
+
+    FORMAT_GTIFF = 0
+
+    STORAGE_FILES = 0
+    STORAGE_MEMORY = 1
+
     def name(self):
         return "mopst"
 
@@ -93,41 +153,414 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterRasterLayer(self.OPPORTUNITY_AREAS, "Opportunity areas"))
         self.addParameter(QgsProcessingParameterMultipleLayers(self.FACTORS, "Factor rasters",
                                                                QgsProcessing.TypeRaster))
-        self.addParameter(QgsProcessingParameterMatrix(self.FACTOR_WEIGHTS, "Factor weights", 9, False,
+        self.addParameter(QgsProcessingParameterMatrix(self.FACTOR_WEIGHTS, "Factor weights",
+                                                       len(FACTOR_WEIGHTS_DATA) // len(FACTOR_WEIGHTS_HEADER), False,
                                                        FACTOR_WEIGHTS_HEADER, FACTOR_WEIGHTS_DATA))
-        self.addParameter(QgsProcessingParameterMatrix(self.SCENARIO_WEIGHTS, "Scenario weights", 69, False,
+        self.addParameter(QgsProcessingParameterMatrix(self.SCENARIO_WEIGHTS, "Scenario weights",
+                                                       len(SCENARIO_WEIGHTS_DATA) // len(SCENARIO_WEIGHTS_HEADER), False,
                                                        SCENARIO_WEIGHTS_HEADER, SCENARIO_WEIGHTS_DATA))
+        self.addParameter(QgsProcessingParameterFile(self.FACTOR_WEIGHTS_FILE, "Factor weights file (replaces factor weights)",
+                                                     QgsProcessingParameterFile.File, "csv", None, True))
+        self.addParameter(QgsProcessingParameterFile(self.SCENARIO_WEIGHTS_FILE, "Scenario weights file (replaces scenario weights)",
+                                                     QgsProcessingParameterFile.File, "csv", None, True))
+
+        self.engines = ["GDAL raster calculator",
+                        "NumPy block engine",
+                        "GDAL raster calculator, folded weights",
+                       ]
+        param = QgsProcessingParameterBoolean(self.LANDCOVER_CLASSES, "Rasterize landcover classes once and look up scores", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(self.ENGINE, "Scoring engine", self.engines, False, self.ENGINE_CALCULATOR)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.BLOCK_SIZE, "Block size (pixels)",
+                                             QgsProcessingParameterNumber.Integer, 512, False, 16)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.MEMORY_BUDGET, "Memory budget (MB)",
+                                             QgsProcessingParameterNumber.Integer, 512, False, 64)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.WORKERS, "Worker processes",
+                                             QgsProcessingParameterNumber.Integer, 1, False, 1, os.cpu_count() or 1)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.THREADS, "Threads (0 to use all processors)",
+                                             QgsProcessingParameterNumber.Integer, 0, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterFile(self.CACHE_DIR, "Cache directory",
+                                           QgsProcessingParameterFile.Folder, "", None, True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.CACHE_SIZE, "Cache size limit (MB)",
+                                             QgsProcessingParameterNumber.Integer, 2048, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.formats = ["GeoTIFF",
+                        "Cloud optimized GeoTIFF, DEFLATE compression",
+                        "Cloud optimized GeoTIFF, ZSTD compression",
+                       ]
+        param = QgsProcessingParameterEnum(self.OUTPUT_FORMAT, "Output format", self.formats, False, self.FORMAT_GTIFF)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.SCENARIO_CUBES, "Write one multi-band raster per scenario", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.SCRATCH_BUDGET, "Scratch space budget (MB, 0 for no limit)",
+                                             QgsProcessingParameterNumber.Integer, 0, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.PROFILE_SUMMARY, "Show profile summary in the log", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.SPARSE, "Only score pressure and opportunity areas", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.FACTOR_VALUES, "Multiply weights by factor raster values", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.ENSEMBLE_SIZE, "Weight ensemble size (0 for none)",
+                                             QgsProcessingParameterNumber.Integer, 0, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.WEIGHT_UNCERTAINTY, "Weight uncertainty (%)",
+                                             QgsProcessingParameterNumber.Double, 10, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.distributions = ["Normal", "Uniform"]
+        param = QgsProcessingParameterEnum(self.UNCERTAINTY_DISTRIBUTION, "Weight uncertainty distribution", self.distributions, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterString(self.ENSEMBLE_PERCENTILES, "Ensemble percentiles", "5, 50, 95")
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.SUMMARY_STATISTICS, "Write summary statistics of the outputs", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.storages = ["Temporary GeoTIFF files",
+                         "In memory, memory-mapped beyond the memory budget",
+                        ]
+        param = QgsProcessingParameterEnum(self.INTERMEDIATE_STORAGE, "Intermediate rasters", self.storages, False, self.STORAGE_FILES)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(self.CHECKPOINT_INTERVAL, "Checkpoint interval (minutes, 0 for no checkpoints)",
+                                             QgsProcessingParameterNumber.Double, 0, False, 0)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(self.RESUME, "Resume from checkpoint", False)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
         self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT, "Output directory"))
         self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUT_LAYERS, "Output layers"))
 
     def processAlgorithm(self, parameters, context, feedback):
-        fieldName = self.parameterAsString(parameters, self.SENSITIVITY_SCORE_FIELD, context)
-        layer = self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context)
+        # intermediate rasters and the partial files of outputs which were
+        # not completed are removed however the run ends, a canceled or
+        # failed run first saves what it completed since the last checkpoint
+        self.scratch = None
+        self.outputDir = None
+        self.destinations = {}
+        self.checkpoint = None
+        self.chainState = None
+        try:
+            results = self.runModel(parameters, context, feedback)
+            if feedback.isCanceled():
+                self.saveCheckpoint(feedback)
+            return results
+        except Exception:
+            self.saveCheckpoint(feedback)
+            raise
+        finally:
+            for path in self.partialFiles():
+                if os.path.exists(path):
+                    os.remove(path)
+            if self.scratch is not None:
+                self.scratch.cleanup()
+
+    def partialFiles(self):
+        # partial files written by child algorithms and the raster calculator
+        # chain, renamed into place once complete
+        paths = list(self.destinations.values())
+        if self.outputDir:
+            paths += [partialPath(os.path.join(self.outputDir, name))
+                      for name in [name for key, name in LANDCOVER_FILES] + ["landcover_classes.tif"]]
+        return paths
+
+    def runModel(self, parameters, context, feedback):
+        # processing and the NumPy/GDAL based modules are imported where
+        # they are used, so they are not loaded when QGIS registers the
+        # algorithm but only once it runs
+        from mopst.cog import CogWriter, supportsCompression, COMPRESSIONS
+        from mopst.engine import BlockEngine
+
+        self.profiler = Profiler()
+        self.classNames = None
+        self.aligned = {}
+        self.gridSize = (None, None)
+        self.calculator = None
+        self.checkpoint = None
+        self.chainState = None
         factorLayers = self.parameterAsFileList(parameters, self.FACTORS, context)
-        factorTable = self.parameterAsMatrix(parameters, self.FACTOR_WEIGHTS, context)
-        scenarioTable = self.parameterAsMatrix(parameters, self.SCENARIO_WEIGHTS, context)
+        factorFile = self.parameterAsFile(parameters, self.FACTOR_WEIGHTS_FILE, context)
+        scenarioFile = self.parameterAsFile(parameters, self.SCENARIO_WEIGHTS_FILE, context)
+        engine = self.parameterAsEnum(parameters, self.ENGINE, context)
+        self.blockSize = self.parameterAsInt(parameters, self.BLOCK_SIZE, context)
+        self.memoryBudget = self.parameterAsInt(parameters, self.MEMORY_BUDGET, context) * 1024 * 1024
+        self.workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        self.threads = self.parameterAsInt(parameters, self.THREADS, context) or os.cpu_count() or 1
         self.outputDir = self.parameterAsString(parameters, self.OUTPUT, context)
-
-        # convert lists into matrices (lists of lists)
-        factorData = [factorTable[i:i + 3] for i in range(0, len(factorTable), 3)]
-        scenarioData = [scenarioTable[i:i + 4] for i in range(0, len(scenarioTable), 4)]
+        outputFormat = self.parameterAsEnum(parameters, self.OUTPUT_FORMAT, context)
+        cubes = self.parameterAsBool(parameters, self.SCENARIO_CUBES, context)
+        ensembleSize = self.parameterAsInt(parameters, self.ENSEMBLE_SIZE, context)
+        percentiles = self.ensemblePercentiles(parameters, context) if ensembleSize else []
+        sparse = self.parameterAsBool(parameters, self.SPARSE, context)
+        factorValues = self.parameterAsBool(parameters, self.FACTOR_VALUES, context)
+        if factorValues and engine != self.ENGINE_BLOCK:
+            feedback.pushInfo("Factor raster values are read by the block engine, which is used instead.")
+            engine = self.ENGINE_BLOCK
+        if sparse and engine != self.ENGINE_BLOCK:
+            feedback.pushWarning("Only the block engine can limit scoring to pressure and opportunity areas, all pixels are scored.")
+            sparse = False
+        summarize = self.parameterAsBool(parameters, self.SUMMARY_STATISTICS, context)
+        self.inMemory = self.parameterAsEnum(parameters, self.INTERMEDIATE_STORAGE, context) == self.STORAGE_MEMORY
+        if summarize and engine != self.ENGINE_BLOCK:
+            feedback.pushWarning("Only the block engine collects summary statistics while scoring, none are written.")
+            summarize = False
+
+        # finished rasters are converted to cloud optimized GeoTIFFs instead
+        # of being copied into the output directory
+        cogWriter = None
+        if outputFormat != self.FORMAT_GTIFF:
+            compression = COMPRESSIONS[outputFormat - 1]
+            if not supportsCompression(compression):
+                feedback.pushWarning(f"GDAL does not support {compression} compression, DEFLATE is used instead.")
+                compression = "DEFLATE"
+            cogWriter = CogWriter(compression, self.blockSize, self.threads)
+
+        # weights indexed by factor file and scenario, read from the CSV
+        # files when given instead of the matrices
+        if factorFile:
+            factorTable = readFactorWeights(factorFile)
+        else:
+            factorTable = self.parameterAsMatrix(parameters, self.FACTOR_WEIGHTS, context)
+        if scenarioFile:
+            scenarioTable = readScenarioWeights(scenarioFile)
+        else:
+            scenarioTable = self.parameterAsMatrix(parameters, self.SCENARIO_WEIGHTS, context)
+        weights = WeightModel(factorTable, scenarioTable)
+
+        # check factor files, weights and raster alignment before any raster
+        # is processed, all problems are reported at once
+        misaligned = []
+        with self.profiler.stage("Preflight"):
+            problems = inputProblems(self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context),
+                                     self.parameterAsRasterLayer(parameters, self.OPPORTUNITY_AREAS, context),
+                                     factorLayers, weights, misaligned)
+        if problems:
+            raise QgsProcessingException("Inputs failed the preflight check:\n" + "\n".join(problems))
+        feedback.pushInfo(f"Preflight check passed for {len(factorLayers)} factor files and {len(weights.scenarios)} scenarios.")
+
+        # rasters off the pressure raster grid are read through warped
+        # virtual rasters, kept with the cache or in the output directory.
+        # Only the rasters the block and ensemble engines read window by
+        # window need them, the raster calculator chain only uses the factor
+        # file names
+        read = []
+        if sparse or summarize:
+            read.append(self.parameterAsRasterLayer(parameters, self.OPPORTUNITY_AREAS, context).source())
+        if factorValues:
+            read.extend(factorLayers)
+        misaligned = [path for path in misaligned if path in read]
+        self.aligned = {}
+        if misaligned:
+            from mopst.align import GridAligner
+
+            with self.profiler.stage("Align rasters"):
+                aligner = GridAligner(self.maskFiles(parameters, context)[0],
+                                      self.parameterAsString(parameters, self.CACHE_DIR, context) or self.outputDir)
+                for path in misaligned:
+                    self.aligned[path], reused = aligner.aligned(path)
+                    feedback.pushInfo(f"{path} is not on the pressure raster grid, "
+                                      f"{'reuse' if reused else 'create'} aligned virtual raster {self.aligned[path]}.")
 
         # create output directory if not exists
         os.makedirs(self.outputDir, exist_ok=True)
 
         self.layersToAdd = {"BASELINE":[]}
 
-        # get names of the selected self.scenarios to avoid iterating
-        # over the all self.scenarios every time. Also create output directories
-        self.scenarios = []
-        for i in scenarioData:
-            if i[0] not in self.scenarios:
-                self.scenarios.append(i[0])
-                os.makedirs(os.path.join(self.outputDir, f"scenario-{i[0]}"), exist_ok=True)
-                self.layersToAdd[i[0]] = []
-
-        factorSteps = 4 + 8 * (len(factorLayers) - 1)
-        nSteps = 8 + factorSteps + factorSteps * len(self.scenarios)
+        # create output directories of the scenarios
+        self.scenarios = list(weights.scenarios)
+        for s in self.scenarios:
+            os.makedirs(os.path.join(self.outputDir, f"scenario-{s}"), exist_ok=True)
+            self.layersToAdd[s] = []
+
+        # fold weights and multipliers into per output coefficients
+        terms = self.scoringTerms(factorLayers, weights)
+        plan = None
+        if engine != self.ENGINE_CALCULATOR:
+            plan = ScoringPlan(terms, len(factorLayers), factorValues)
+
+        # the block engine streams windows of the template grid, so landcover
+        # rasters are tiled with the same block size to keep reads aligned
+        rasterOptions = ""
+        if engine == self.ENGINE_BLOCK:
+            rasterOptions = "|".join(BlockEngine(self.blockSize).creationOptions())
+
+        # digest of everything the rasterized landcover depends on, None if
+        # some inputs are not local files
+        manifest = RunManifest(self.outputDir)
+        landcoverInputs = self.landcoverInputs(parameters, context)
+        landcoverParams = {"field": self.parameterAsString(parameters, self.SENSITIVITY_SCORE_FIELD, context),
+                           "options": rasterOptions}
+        cache = None
+        cacheDir = self.parameterAsString(parameters, self.CACHE_DIR, context)
+        with self.profiler.stage("Hash landcover inputs"):
+            if cacheDir:
+                cache = RasterCache(cacheDir, self.parameterAsInt(parameters, self.CACHE_SIZE, context) * 1024 * 1024)
+                landcoverKey = cache.key(landcoverInputs, landcoverParams)
+            else:
+                landcoverKey = inputsKey(landcoverInputs, landcoverParams, manifest.digests)
+        if landcoverKey is None:
+            feedback.pushInfo("Landcover inputs are not local files, cache and previous outputs are not used.")
+
+        # find outputs of a previous run into the same directory which are
+        # still up to date
+        fileNames = [os.path.split(f)[1] for f in factorLayers]
+        landcoverFiles = {name: os.path.join(self.outputDir, name) for key, name in LANDCOVER_FILES}
+        landcoverDependencies = {"inputs": landcoverKey, "format": outputFormat}
+        landcoverCurrent = landcoverKey is not None and all(manifest.isCurrent(path, landcoverDependencies)
+                                                            for path in landcoverFiles.values())
+        # with factor values the outputs also depend on the factor rasters
+        factorKey = None
+        if factorValues:
+            with self.profiler.stage("Hash factor rasters"):
+                factorKey = inputsKey(factorLayers, {}, manifest.digests)
+        # masked outputs and the statistics by area also depend on the
+        # pressure and opportunity rasters
+        maskKey = None
+        if sparse or summarize:
+            with self.profiler.stage("Hash pressure and opportunity areas"):
+                maskKey = inputsKey(self.maskSources(parameters, context), {}, manifest.digests)
+        unhashed = (landcoverKey is None or (factorValues and factorKey is None)
+                    or ((sparse or summarize) and maskKey is None))
+        dependencies = {}
+        stale = set()
+        for s in self.scenarios + ["BASELINE"]:
+            for key, name in OUTPUT_FILES:
+                metric = key.split("_")[0]
+                path = self.outputPath(s, name)
+                dependencies[path] = {"landcover": landcoverKey,
+                                      "factors": fileNames,
+                                      "terms": [[float(m) for m in term] for term in terms[(s, metric)]],
+                                      "engine": engine,
+                                      "format": outputFormat}
+                if sparse:
+                    dependencies[path]["sparse"] = True
+                if factorValues:
+                    dependencies[path]["factorRasters"] = factorKey
+                if sparse or summarize:
+                    dependencies[path]["masks"] = maskKey
+                if not cubes and (unhashed or not manifest.isCurrent(path, dependencies[path])):
+                    stale.add((s, key))
+                    manifest.forget(path)
+
+            # a cube is rewritten as a whole when any of its bands is out of date
+            if cubes:
+                path = self.cubePath(s)
+                dependencies[path] = {key: dependencies[self.outputPath(s, name)] for key, name in OUTPUT_FILES}
+                if unhashed or not manifest.isCurrent(path, dependencies[path]):
+                    stale.update((s, key) for key, name in OUTPUT_FILES)
+                    manifest.forget(path)
+        if not landcoverCurrent:
+            for path in landcoverFiles.values():
+                manifest.forget(path)
+
+        # outputs being rewritten must not look up to date if the run fails
+        manifest.save()
+
+        chainScenarios = [s for s in self.scenarios if any((s, key) in stale for key, name in OUTPUT_FILES)]
+
+        # progress is saved to a checkpoint in the output directory under a
+        # key of all dependencies, a resumed run continues after the stages
+        # completed by a run with the same key
+        checkpointInterval = self.parameterAsDouble(parameters, self.CHECKPOINT_INTERVAL, context)
+        resume = self.parameterAsBool(parameters, self.RESUME, context)
+        if (checkpointInterval or resume) and landcoverKey is None:
+            feedback.pushWarning("Landcover inputs are not local files, so a checkpoint can not be validated and none is used.")
+        elif checkpointInterval or resume:
+            from mopst.checkpoint import Checkpoint
+
+            self.checkpoint = Checkpoint(self.outputDir,
+                                         {"landcover": landcoverDependencies,
+                                          "outputs": {manifest.name(path): d for path, d in dependencies.items()},
+                                          "stale": sorted(f"{s}_{key}" for s, key in stale)},
+                                         checkpointInterval * 60)
+            if not resume:
+                self.checkpoint.remove()
+            elif self.checkpoint.load():
+                feedback.pushInfo(f"Resume after {', '.join(self.checkpoint.stages) or 'no'} stages of the checkpoint.")
+            elif self.checkpoint.exists():
+                feedback.pushWarning("The checkpoint was saved for other inputs, weights or options, the run starts over.")
+                self.checkpoint.remove()
+            else:
+                feedback.pushInfo("There is no checkpoint to resume from, the run starts over.")
+
+        # the raster calculator engines write the last step of every out of
+        # date output to a partial file next to its final path, renamed once
+        # all outputs are complete. Cubes and cloud optimized GeoTIFFs are
+        # written from temporary files instead
+        self.destinations = {}
+        if not cubes and cogWriter is None:
+            for s, key in stale:
+                self.destinations[f"{s}_{key}"] = partialPath(self.outputPath(s, dict(OUTPUT_FILES)[key]))
+
+        if plan is not None:
+            plan.restrict(stale)
+            with open(os.path.join(self.outputDir, "execution-plan.txt"), "w", encoding="utf-8") as f:
+                f.write(plan.describe())
+            feedback.pushInfo(f"Scoring plan needs {len(plan.operations)} raster passes instead of {plan.chainPasses()}.")
+
+        # intermediate rasters of the raster calculator engines live in a run
+        # scoped scratch folder, or in memory up to the memory budget, fail
+        # now if the most rasters alive at once can not fit the scratch budget
+        layer = self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context)
+        self.gridSize = (layer.width(), layer.height())
+        self.gridTemplate = self.maskFiles(parameters, context)[0]
+        self.scratch = ScratchSpace(QgsProcessingUtils.tempFolder(),
+                                    self.parameterAsInt(parameters, self.SCRATCH_BUDGET, context) * 1024 * 1024,
+                                    layer.width() * layer.height() * 4,
+                                    self.memoryBudget if self.inMemory else 0)
+        if not stale or engine == self.ENGINE_BLOCK:
+            self.scratch.reserve(0)
+        elif engine == self.ENGINE_FOLDED:
+            self.scratch.reserve(len(plan.operations))
+        else:
+            # accumulated outputs, factor and scenario factor rasters and
+            # the accumulation being written, with checkpoints the outputs
+            # accumulated over the last factor completed
+            accumulated = 4 * (len(chainScenarios) + 1)
+            if self.checkpoint is not None and self.checkpoint.interval:
+                accumulated *= 2
+            self.scratch.reserve(accumulated + 4 + 4 + 1)
+
+        if not stale:
+            nSteps = 8
+        elif engine == self.ENGINE_BLOCK:
+            nSteps = 8 + 1
+        elif engine == self.ENGINE_FOLDED:
+            nSteps = 8 + len(plan.operations)
+        else:
+            factorSteps = 4 + 8 * (len(factorLayers) - 1)
+            nSteps = 8 + factorSteps + factorSteps * len(chainScenarios)
+        if cogWriter is not None:
+            nSteps += 1
+        if ensembleSize:
+            nSteps += 1
+        if cubes and stale and engine != self.ENGINE_BLOCK:
+            nSteps += 1
 
         multistepFeedback = QgsProcessingMultiStepFeedback(nSteps, feedback)
         step = 0
@@ -135,96 +568,216 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
         outputs = {}
         self.outputLayers = []
 
-        # convert landcover sensitivity score field to float
-        feedback.pushInfo("Convert sensitivity score field to float.")
-        params = {"INPUT": parameters[self.LANDCOVER_SENSITIVITY],
-                  "FIELD": parameters[self.SENSITIVITY_SCORE_FIELD],
-                  "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-        outputs["LCS_FLOAT"] = processing.run("qgis:texttofloat", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+        # reuse rasterized landcover from a previous run or from the cache if
+        # none of its inputs changed
+        if landcoverCurrent:
+            feedback.pushInfo("Reuse rasterized landcover from previous run.")
+            for key, name in LANDCOVER_FILES:
+                outputs[key] = {"OUTPUT": landcoverFiles[name]}
 
-        step += 1
-        multistepFeedback.setCurrentStep(step)
-        if feedback.isCanceled():
-            return {}
-
-        # join landcover layer with lancover sensitivity table
-        feedback.pushInfo("Join landcover sensitivity table.")
-        params = {"INPUT": parameters[self.LANDCOVER],
-                  "FIELD": "Main_habit",
-                  "INPUT_2": outputs["LCS_FLOAT"]["OUTPUT"],
-                  "FIELD_2": "Habitat_environment_type",
-                  "FIELDS_TO_COPY": [],
-                  "METHOD": 1,
-                  "DISCARD_NONMATCHING": False,
-                  "PREFIX": "",
-                  "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-                  "NON_MATCHING": QgsProcessing.TEMPORARY_OUTPUT}
-        outputs["JOIN_SENSITIVITY"] = processing.run("native:joinattributestable", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-
-        # TODO: check join errors
+            step += 7
+            multistepFeedback.setCurrentStep(step)
+        elif landcoverKey is not None and cache is not None and self.restoreLandcover(cache, landcoverKey, landcoverFiles):
+            feedback.pushInfo("Reuse rasterized landcover from cache.")
+            for key, name in LANDCOVER_FILES:
+                outputs[key] = {"OUTPUT": landcoverFiles[name]}
 
-        step += 1
-        multistepFeedback.setCurrentStep(step)
-        if feedback.isCanceled():
-            return {}
-
-        # join seasonality table
-        feedback.pushInfo("Join seasonality table.")
-        params = {"INPUT": outputs["JOIN_SENSITIVITY"]["OUTPUT"],
-                  "FIELD": "Main_habit",
-                  "INPUT_2": parameters[self.SEASONALITY_SCORE],
-                  "FIELD_2": "Habitat_environment_type",
-                  "FIELDS_TO_COPY": [],
-                  "METHOD": 1,
-                  "DISCARD_NONMATCHING": False,
-                  "PREFIX": "",
-                  "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
-                  "NON_MATCHING": QgsProcessing.TEMPORARY_OUTPUT}
-        outputs["JOIN_SEASONALITY"] = processing.run("native:joinattributestable", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-
-        # TODO: check join errors
+            step += 7
+            multistepFeedback.setCurrentStep(step)
+        elif (self.checkpoint is not None and self.checkpoint.stage("landcover") is not None
+              and all(os.path.isfile(path) for path in landcoverFiles.values())):
+            feedback.pushInfo("Reuse rasterized landcover from checkpoint.")
+            for key, name in LANDCOVER_FILES:
+                outputs[key] = {"OUTPUT": landcoverFiles[name]}
 
-        step += 1
-        multistepFeedback.setCurrentStep(step)
-        if feedback.isCanceled():
-            return {}
-
-        # calculate summer sensitivity score
-        feedback.pushInfo("Calculate summer sensitivity score.")
-        params = {"INPUT": outputs["JOIN_SEASONALITY"]["OUTPUT"],
-                  "FIELD_NAME": "summer_score",
-                  "FIELD_TYPE": 0,
-                  "FIELD_LENGTH": 18,
-                  "FIELD_PRECISION": 11,
-                  "FORMULA": f'"{fieldName}" * to_real("Summer")',
-                  "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-        outputs["SUMMER_SCORE"] = processing.run("native:fieldcalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+            step += 7
+            multistepFeedback.setCurrentStep(step)
+        else:
+            step = self.rasterizeLandcover(parameters, outputs, rasterOptions, context, feedback, multistepFeedback, step)
+            if step is None:
+                return {}
 
-        step += 1
-        multistepFeedback.setCurrentStep(step)
-        if feedback.isCanceled():
-            return {}
-
-        # calculate winter sensitivity score
-        feedback.pushInfo("Calculate winter sensitivity score.")
-        params = {"INPUT": outputs["SUMMER_SCORE"]["OUTPUT"],
-                  "FIELD_NAME": "winter_score",
-                  "FIELD_TYPE": 0,
-                  "FIELD_LENGTH": 18,
-                  "FIELD_PRECISION": 11,
-                  "FORMULA": f'"{fieldName}" * to_real("Winter")',
-                  "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-        outputs["WINTER_SCORE"] = processing.run("native:fieldcalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+            if landcoverKey is not None and cache is not None:
+                with self.profiler.stage("Store landcover in cache"):
+                    cache.store(landcoverKey, {name: outputs[key]["OUTPUT"] for key, name in LANDCOVER_FILES})
+            if self.checkpoint is not None and self.checkpoint.interval:
+                self.checkpoint.save("landcover", {})
+
+        for key, name in LANDCOVER_FILES:
+            self.outputLayers.append(outputs[key]["OUTPUT"])
+            self.layersToAdd["BASELINE"].append(outputs[key]["OUTPUT"])
+
+        if not stale:
+            feedback.pushInfo("All outputs are up to date.")
+        elif engine == self.ENGINE_BLOCK:
+            feedback.pushInfo("Calculate pressure and opportunity with block engine.")
+            with self.profiler.stage("Block engine", *self.gridSize):
+                completed = self.runBlockEngine(plan, cubes, self.maskFiles(parameters, context) if sparse else [],
+                                                self.alignedFiles(factorLayers) if factorValues else [],
+                                                self.zoneFiles(parameters, outputs, context) if summarize else None,
+                                                outputs, multistepFeedback)
+            if not completed:
+                return {}
 
-        step += 1
+            step += 1
+            multistepFeedback.setCurrentStep(step)
+        elif engine == self.ENGINE_FOLDED:
+            feedback.pushInfo("Calculate pressure and opportunity with folded raster calculator plan.")
+            step = self.runPlannedCalculator(plan, outputs, context, feedback, multistepFeedback, step)
+            if step is None:
+                return {}
+        else:
+            start = 0
+            if self.checkpoint is not None and self.checkpoint.stage("chain") is not None:
+                start = self.restoreChain(outputs)
+                feedback.pushInfo(f"Continue after {start} factors accumulated in the checkpoint.")
+                step += (4 + 8 * (start - 1)) * (len(chainScenarios) + 1)
+                multistepFeedback.setCurrentStep(step)
+            step = self.runCalculatorChain(factorLayers, weights, chainScenarios, outputs, context, feedback, multistepFeedback, step, start)
+            if step is None:
+                return {}
+
+        # statistics of the outputs under random variations of the weights,
+        # always calculated as they depend on random draws
+        ensembleFiles = []
+        if ensembleSize:
+            feedback.pushInfo(f"Calculate statistics of {ensembleSize} weight draws.")
+            with self.profiler.stage("Weight ensemble", *self.gridSize):
+                ensembleFiles = self.runEnsemble(weights, factorLayers, factorValues,
+                                                 self.maskFiles(parameters, context) if sparse else [], outputs,
+                                                 ensembleSize, self.parameterAsDouble(parameters, self.WEIGHT_UNCERTAINTY, context) / 100,
+                                                 self.parameterAsEnum(parameters, self.UNCERTAINTY_DISTRIBUTION, context),
+                                                 percentiles, multistepFeedback)
+            if ensembleFiles is None:
+                return {}
+
+            step += 1
+            multistepFeedback.setCurrentStep(step)
+
+        # the raster calculator engines write separate rasters, which are
+        # stacked into the cubes
+        self.scenarios.append("BASELINE")
+        if cubes and stale and engine != self.ENGINE_BLOCK:
+            feedback.pushInfo("Write scenario cubes.")
+            with self.profiler.stage("Write scenario cubes", *self.gridSize):
+                completed = self.writeCubes(stale, outputs, multistepFeedback)
+            if not completed:
+                return {}
+
+            step += 1
+            multistepFeedback.setCurrentStep(step)
+
+        # copy results to the output directory, or collect them for the
+        # conversion to cloud optimized GeoTIFFs
+        reused = 0
+        convert = []
+        if cogWriter is not None and not landcoverCurrent:
+            convert += [(outputs[key]["OUTPUT"], outputs[key]["OUTPUT"]) for key, name in LANDCOVER_FILES]
+        for s in self.scenarios:
+            if cubes:
+                r = self.cubePath(s)
+                if (s, OUTPUT_FILES[0][0]) not in stale:
+                    feedback.pushInfo(f"Reuse up to date output {manifest.name(r)}.")
+                    reused += len(OUTPUT_FILES)
+                elif cogWriter is not None:
+                    convert.append((r, r))
+                self.outputLayers.append(r)
+                self.layersToAdd[s].append(r)
+                continue
+
+            for key, name in OUTPUT_FILES:
+                r = self.outputPath(s, name)
+                if (s, key) not in stale:
+                    feedback.pushInfo(f"Reuse up to date output {manifest.name(r)}.")
+                    reused += 1
+                elif cogWriter is not None:
+                    convert.append((outputs[f"{s}_{key}"], r))
+                elif outputs[f"{s}_{key}"] == partialPath(r):
+                    os.replace(outputs[f"{s}_{key}"], r)
+                elif outputs[f"{s}_{key}"] != r:
+                    with self.profiler.stage("Copy output", *self.gridSize):
+                        r = shutil.copyfile(outputs[f"{s}_{key}"], r)
+                self.outputLayers.append(r)
+                self.layersToAdd[s].append(r)
+
+        for s, r in ensembleFiles:
+            if cogWriter is not None:
+                convert.append((r, r))
+            self.outputLayers.append(r)
+            self.layersToAdd[s].append(r)
+
+        if cogWriter is not None:
+            feedback.pushInfo(f"Write {len(convert)} cloud optimized GeoTIFFs.")
+            with self.profiler.stage("Write cloud optimized GeoTIFFs", *self.gridSize):
+                completed = cogWriter.run(convert, multistepFeedback)
+            if not completed:
+                return {}
+
+            step += 1
+            multistepFeedback.setCurrentStep(step)
+
+        # record outputs only once they are complete
+        if landcoverKey is not None:
+            for key, name in LANDCOVER_FILES:
+                manifest.record(outputs[key]["OUTPUT"], landcoverDependencies)
+            for s in self.scenarios:
+                if cubes:
+                    manifest.record(self.cubePath(s), dependencies[self.cubePath(s)])
+                    continue
+                for key, name in OUTPUT_FILES:
+                    manifest.record(self.outputPath(s, name), dependencies[self.outputPath(s, name)])
+
+        manifest.save()
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+        feedback.pushInfo(f"Calculated {len(stale)} outputs, reused {reused} outputs from previous run.")
+        self.scratch.report(feedback)
+
+        self.profiler.write(os.path.join(self.outputDir, "profile.json"))
+        if self.parameterAsBool(parameters, self.PROFILE_SUMMARY, context):
+            self.profiler.summary(feedback)
+
+        with open(os.path.join(self.outputDir, "execution-log.txt"), "w", encoding="utf-8") as f:
+            f.write(feedback.textLog())
+
+        return {self.OUTPUT: self.outputDir,
+                self.OUTPUT_LAYERS: self.outputLayers}
+
+    def rasterizeLandcover(self, parameters, outputs, rasterOptions, context, feedback, multistepFeedback, step):
+        # attach sensitivity and seasonality scores to the landcover and
+        # rasterize them, returns the current step or None if the algorithm
+        # was canceled
+        from mopst.landcover import ScoreTables, SUMMER_FIELD, WINTER_FIELD
+
+        if self.parameterAsBool(parameters, self.LANDCOVER_CLASSES, context):
+            return self.rasterizeLandcoverClasses(parameters, outputs, rasterOptions, context, feedback, multistepFeedback, step)
+
+        fieldName = self.parameterAsString(parameters, self.SENSITIVITY_SCORE_FIELD, context)
+        layer = self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context)
+
+        # join scores with hash indexes over the sensitivity and seasonality
+        # tables in one pass over the landcover features
+        feedback.pushInfo("Join landcover sensitivity and seasonality tables.")
+        with self.profiler.stage("Join landcover tables"):
+            tables = ScoreTables(self.parameterAsSource(parameters, self.LANDCOVER_SENSITIVITY, context),
+                                 fieldName,
+                                 self.parameterAsSource(parameters, self.SEASONALITY_SCORE, context))
+            scoredLayer = tables.scoredLayer(self.parameterAsSource(parameters, self.LANDCOVER, context), multistepFeedback)
+        if scoredLayer is None:
+            return None
+
+        tables.report(feedback)
+
+        # the join replaces five vector processing steps
+        step += 5
         multistepFeedback.setCurrentStep(step)
         if feedback.isCanceled():
-            return {}
+            return None
 
         # rasterize base landcover sensitivity score using pressure raster as the template
         feedback.pushInfo("Rasterize base landcover.")
-        params = {"INPUT": outputs["WINTER_SCORE"]["OUTPUT"],
-                  "FIELD": parameters[self.SENSITIVITY_SCORE_FIELD],
+        params = {"INPUT": scoredLayer,
+                  "FIELD": fieldName,
                   "BURN": None,
                   "USE_Z": False,
                   "UNITS": 1,
@@ -232,24 +785,25 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                   "HEIGHT": layer.rasterUnitsPerPixelY(),
                   "EXTENT": parameters[self.PRESSURE_AREAS],
                   "NODATA": None,
-                  "OPTIONS": "",
+                  "OPTIONS": rasterOptions,
                   "DATA_TYPE": 5,
                   "INIT": None,
                   "INVERT": False,
-                  "OUTPUT": os.path.join(self.outputDir, "base_landcover.tif")}
-        outputs["LANDCOVER_BASE"] = processing.run("gdal:rasterize", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-        self.outputLayers.append(outputs["LANDCOVER_BASE"]["OUTPUT"])
-        self.layersToAdd["BASELINE"].append(outputs["LANDCOVER_BASE"]["OUTPUT"])
+                  "OUTPUT": partialPath(os.path.join(self.outputDir, "base_landcover.tif"))}
+        self.runChild("gdal:rasterize", params, context, multistepFeedback)
+        if feedback.isCanceled():
+            return None
+        outputs["LANDCOVER_BASE"] = {"OUTPUT": self.complete(os.path.join(self.outputDir, "base_landcover.tif"))}
 
         step += 1
         multistepFeedback.setCurrentStep(step)
         if feedback.isCanceled():
-            return {}
+            return None
 
         # rasterize summer landcover sensitivity score using pressure raster as the template
         feedback.pushInfo("Rasterize summer landcover.")
-        params = {"INPUT": outputs["WINTER_SCORE"]["OUTPUT"],
-                  "FIELD": "summer_score",
+        params = {"INPUT": scoredLayer,
+                  "FIELD": SUMMER_FIELD,
                   "BURN": None,
                   "USE_Z": False,
                   "UNITS": 1,
@@ -257,24 +811,25 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                   "HEIGHT": layer.rasterUnitsPerPixelY(),
                   "EXTENT": parameters[self.PRESSURE_AREAS],
                   "NODATA": None,
-                  "OPTIONS": "",
+                  "OPTIONS": rasterOptions,
                   "DATA_TYPE": 5,
                   "INIT": None,
                   "INVERT": False,
-                  "OUTPUT": os.path.join(self.outputDir, "summer_landcover.tif")}
-        outputs["LANDCOVER_SUMMER"] = processing.run("gdal:rasterize", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-        self.outputLayers.append(outputs["LANDCOVER_SUMMER"]["OUTPUT"])
-        self.layersToAdd["BASELINE"].append(outputs["LANDCOVER_SUMMER"]["OUTPUT"])
+                  "OUTPUT": partialPath(os.path.join(self.outputDir, "summer_landcover.tif"))}
+        self.runChild("gdal:rasterize", params, context, multistepFeedback)
+        if feedback.isCanceled():
+            return None
+        outputs["LANDCOVER_SUMMER"] = {"OUTPUT": self.complete(os.path.join(self.outputDir, "summer_landcover.tif"))}
 
         step += 1
         multistepFeedback.setCurrentStep(step)
         if feedback.isCanceled():
-            return {}
+            return None
 
         # rasterize winter landcover sensitivity score using pressure raster as the template
         feedback.pushInfo("Rasterize winter landcover.")
-        params = {"INPUT": outputs["WINTER_SCORE"]["OUTPUT"],
-                  "FIELD": "winter_score",
+        params = {"INPUT": scoredLayer,
+                  "FIELD": WINTER_FIELD,
                   "BURN": None,
                   "USE_Z": False,
                   "UNITS": 1,
@@ -282,96 +837,206 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                   "HEIGHT": layer.rasterUnitsPerPixelY(),
                   "EXTENT": parameters[self.PRESSURE_AREAS],
                   "NODATA": None,
-                  "OPTIONS": "",
+                  "OPTIONS": rasterOptions,
                   "DATA_TYPE": 5,
                   "INIT": None,
                   "INVERT": False,
-                  "OUTPUT": os.path.join(self.outputDir, "winter_landcover.tif")}
-        outputs["LANDCOVER_WINTER"] = processing.run("gdal:rasterize", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-        self.outputLayers.append(outputs["LANDCOVER_WINTER"]["OUTPUT"])
-        self.layersToAdd["BASELINE"].append(outputs["LANDCOVER_WINTER"]["OUTPUT"])
+                  "OUTPUT": partialPath(os.path.join(self.outputDir, "winter_landcover.tif"))}
+        self.runChild("gdal:rasterize", params, context, multistepFeedback)
+        if feedback.isCanceled():
+            return None
+        outputs["LANDCOVER_WINTER"] = {"OUTPUT": self.complete(os.path.join(self.outputDir, "winter_landcover.tif"))}
+
+        step += 1
+        multistepFeedback.setCurrentStep(step)
+        if feedback.isCanceled():
+            return None
+
+        return step
+
+    def rasterizeLandcoverClasses(self, parameters, outputs, rasterOptions, context, feedback, multistepFeedback, step):
+        # rasterize landcover classes once and derive base, summer and winter
+        # scores through lookup tables, returns the current step or None if
+        # the algorithm was canceled
+        from mopst.engine import LookupEngine
+        from mopst.landcover import LandcoverClasses, ScoreTables, CLASS_FIELD
+
+        fieldName = self.parameterAsString(parameters, self.SENSITIVITY_SCORE_FIELD, context)
+        layer = self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context)
+
+        feedback.pushInfo("Build landcover classes and score lookup tables.")
+        with self.profiler.stage("Build landcover classes"):
+            tables = ScoreTables(self.parameterAsSource(parameters, self.LANDCOVER_SENSITIVITY, context),
+                                 fieldName,
+                                 self.parameterAsSource(parameters, self.SEASONALITY_SCORE, context))
+            classes = LandcoverClasses()
+            classLayer = classes.classLayer(self.parameterAsSource(parameters, self.LANDCOVER, context), multistepFeedback)
+        if classLayer is None:
+            return None
+
+        lookup = classes.lookupTables(tables)
+        self.classNames = {classId: value for value, classId in classes.ids.items()}
+        tables.report(feedback)
+        classes.writeTable(os.path.join(self.outputDir, "landcover_classes.csv"))
+        feedback.pushInfo(f"Found {len(classes.ids)} landcover classes.")
+
+        # five vector steps are replaced by building the lookup tables
+        step += 5
+        multistepFeedback.setCurrentStep(step)
+        if feedback.isCanceled():
+            return None
+
+        feedback.pushInfo("Rasterize landcover classes.")
+        params = {"INPUT": classLayer,
+                  "FIELD": CLASS_FIELD,
+                  "BURN": None,
+                  "USE_Z": False,
+                  "UNITS": 1,
+                  "WIDTH": layer.rasterUnitsPerPixelX(),
+                  "HEIGHT": layer.rasterUnitsPerPixelY(),
+                  "EXTENT": parameters[self.PRESSURE_AREAS],
+                  "NODATA": None,
+                  "OPTIONS": rasterOptions,
+                  "DATA_TYPE": classes.dataType(),
+                  "INIT": None,
+                  "INVERT": False,
+                  "OUTPUT": partialPath(os.path.join(self.outputDir, "landcover_classes.tif"))}
+        self.runChild("gdal:rasterize", params, context, multistepFeedback)
+        if feedback.isCanceled():
+            return None
+        outputs["LANDCOVER_CLASSES"] = {"OUTPUT": self.complete(os.path.join(self.outputDir, "landcover_classes.tif"))}
 
         step += 1
         multistepFeedback.setCurrentStep(step)
         if feedback.isCanceled():
-            return {}
+            return None
 
-        # process factors
+        feedback.pushInfo("Look up base, summer and winter landcover scores.")
+        engine = LookupEngine(self.blockSize, self.memoryBudget, self.threads)
+        engine.addSource("CLASSES", outputs["LANDCOVER_CLASSES"]["OUTPUT"])
+        for key, name in LANDCOVER_FILES:
+            path = os.path.join(self.outputDir, name)
+            engine.addOperation("CLASSES", lookup[key.split("_")[1]], [path])
+            outputs[key] = {"OUTPUT": path}
+
+        with self.profiler.stage("Look up landcover scores", *self.gridSize):
+            completed = engine.run(multistepFeedback)
+        if not completed:
+            return None
+
+        step += 1
+        multistepFeedback.setCurrentStep(step)
+        if feedback.isCanceled():
+            return None
+
+        return step
+
+    def landcoverInputs(self, parameters, context):
+        # files the rasterized landcover depends on, None for inputs which
+        # are not files on disk
+        inputs = []
+        for name in (self.LANDCOVER, self.LANDCOVER_SENSITIVITY, self.SEASONALITY_SCORE):
+            layer = self.parameterAsVectorLayer(parameters, name, context)
+            inputs.append(self.layerFile(layer))
+        inputs.append(self.layerFile(self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context)))
+        return inputs
+
+    def maskSources(self, parameters, context):
+        # files of the pressure and opportunity rasters as given
+        layers = [self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context),
+                  self.parameterAsRasterLayer(parameters, self.OPPORTUNITY_AREAS, context)]
+        return [self.layerFile(layer) or layer.source() for layer in layers]
+
+    def maskFiles(self, parameters, context):
+        # pressure and opportunity rasters, read by GDAL in sparse mode and
+        # for summary statistics, on the pressure raster grid
+        layers = [self.parameterAsRasterLayer(parameters, self.PRESSURE_AREAS, context),
+                  self.parameterAsRasterLayer(parameters, self.OPPORTUNITY_AREAS, context)]
+        return [self.aligned.get(layer.source(), self.layerFile(layer) or layer.source()) for layer in layers]
+
+    def alignedFiles(self, paths):
+        # paths of the rasters on the pressure raster grid
+        return [self.aligned.get(p, p) for p in paths]
+
+    def layerFile(self, layer):
+        if layer is None:
+            return None
+        parts = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source())
+        return parts.get("path") or None
+
+    def runCalculatorChain(self, factorLayers, weights, scenarios, outputs, context, feedback, multistepFeedback, step, start=0):
+        # process factors with a chain of raster calculator runs, starting
+        # after the given number of factors already accumulated in outputs.
+        # Returns the current step or None if the algorithm was canceled
         for i, factorFile in enumerate(factorLayers):
+            if i < start:
+                continue
             feedback.pushInfo(f"Process factor file {factorFile}.")
 
             fileName = os.path.split(factorFile)[1]
+            last = i == len(factorLayers) - 1
 
-             # get pressure and opportunity weights for the factor
-            found = False
-            for f in factorData:
-                if f[0] == fileName:
-                    pressureWeight = f[1]
-                    opportunityWeight = f[2]
-                    found = True
-                    break
-
-            if not found:
-                raise QgsProcessingException(f"Could not find pressure and opportunity weights for factor file {fileName}.")
+            # get pressure and opportunity weights for the factor
+            pressureWeight, opportunityWeight = weights.factorWeights(fileName)
 
             # baseline pressure summer factor
             params = {"INPUT_A": outputs["LANDCOVER_SUMMER"]["OUTPUT"],
                       "BAND_A": 1,
                       "FORMULA": f"A*{pressureWeight}",
                       "RTYPE": 5,
-                      "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-            factor_pressure_summer = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                      "OUTPUT": self.destination("BASELINE_PRESSURE_SUMMER", last and i == 0)}
+            factor_pressure_summer = self.rasterCalculator(params, context, multistepFeedback)
 
             step += 1
             multistepFeedback.setCurrentStep(step)
             if feedback.isCanceled():
-                return {}
+                return None
 
             # baseline opportunity summer factor
             params = {"INPUT_A": outputs["LANDCOVER_SUMMER"]["OUTPUT"],
                       "BAND_A": 1,
                       "FORMULA": f"A*{opportunityWeight}",
                       "RTYPE": 5,
-                      "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-            factor_opportunity_summer = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                      "OUTPUT": self.destination("BASELINE_OPPORTUNITY_SUMMER", last and i == 0)}
+            factor_opportunity_summer = self.rasterCalculator(params, context, multistepFeedback)
 
             step += 1
             multistepFeedback.setCurrentStep(step)
             if feedback.isCanceled():
-                return {}
+                return None
 
             # baseline pressure winter factor
             params = {"INPUT_A": outputs["LANDCOVER_WINTER"]["OUTPUT"],
                       "BAND_A": 1,
                       "FORMULA": f"A*{pressureWeight}",
                       "RTYPE": 5,
-                      "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-            factor_pressure_winter = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                      "OUTPUT": self.destination("BASELINE_PRESSURE_WINTER", last and i == 0)}
+            factor_pressure_winter = self.rasterCalculator(params, context, multistepFeedback)
 
             step += 1
             multistepFeedback.setCurrentStep(step)
             if feedback.isCanceled():
-                return {}
+                return None
 
             # baseline opportunity winter factor
             params = {"INPUT_A": outputs["LANDCOVER_WINTER"]["OUTPUT"],
                       "BAND_A": 1,
                       "FORMULA": f"A*{opportunityWeight}",
                       "RTYPE": 5,
-                      "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-            factor_opportunity_winter = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                      "OUTPUT": self.destination("BASELINE_OPPORTUNITY_WINTER", last and i == 0)}
+            factor_opportunity_winter = self.rasterCalculator(params, context, multistepFeedback)
 
             step += 1
             multistepFeedback.setCurrentStep(step)
             if feedback.isCanceled():
-                return {}
+                return None
 
             if i == 0:
                 # if this is the first factor, we store calculated rasters as outputs
-                outputs["BASELINE_PRESSURE_SUMMER"] = factor_pressure_summer["OUTPUT"]
-                outputs["BASELINE_OPPORTUNITY_SUMMER"] = factor_opportunity_summer["OUTPUT"]
-                outputs["BASELINE_PRESSURE_WINTER"] = factor_pressure_winter["OUTPUT"]
-                outputs["BASELINE_OPPORTUNITY_WINTER"] = factor_opportunity_winter["OUTPUT"]
+                self.store(outputs, "BASELINE_PRESSURE_SUMMER", factor_pressure_summer["OUTPUT"])
+                self.store(outputs, "BASELINE_OPPORTUNITY_SUMMER", factor_opportunity_summer["OUTPUT"])
+                self.store(outputs, "BASELINE_PRESSURE_WINTER", factor_pressure_winter["OUTPUT"])
+                self.store(outputs, "BASELINE_OPPORTUNITY_WINTER", factor_opportunity_winter["OUTPUT"])
             else:
                 # for 2nd and all subsequent factors we add them to the previously saved
                 # outputs and then update output to point out at the new file
@@ -383,14 +1048,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                           "BAND_B": 1,
                           "FORMULA": f"A+B",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                outputs["BASELINE_PRESSURE_SUMMER"] = r["OUTPUT"]
+                          "OUTPUT": self.destination("BASELINE_PRESSURE_SUMMER", last)}
+                r = self.rasterCalculator(params, context, multistepFeedback)
+                self.store(outputs, "BASELINE_PRESSURE_SUMMER", r["OUTPUT"])
+                self.scratch.release(r["OUTPUT"])
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # baseline opportunity summer (all factors)
                 params = {"INPUT_A": outputs["BASELINE_OPPORTUNITY_SUMMER"],
@@ -399,14 +1065,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                           "BAND_B": 1,
                           "FORMULA": f"A+B",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                outputs["BASELINE_OPPORTUNITY_SUMMER"] = r["OUTPUT"]
+                          "OUTPUT": self.destination("BASELINE_OPPORTUNITY_SUMMER", last)}
+                r = self.rasterCalculator(params, context, multistepFeedback)
+                self.store(outputs, "BASELINE_OPPORTUNITY_SUMMER", r["OUTPUT"])
+                self.scratch.release(r["OUTPUT"])
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # baseline pressure winter (all factors)
                 params = {"INPUT_A": outputs["BASELINE_PRESSURE_WINTER"],
@@ -415,14 +1082,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                           "BAND_B": 1,
                           "FORMULA": f"A+B",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                outputs["BASELINE_PRESSURE_WINTER"] = r["OUTPUT"]
+                          "OUTPUT": self.destination("BASELINE_PRESSURE_WINTER", last)}
+                r = self.rasterCalculator(params, context, multistepFeedback)
+                self.store(outputs, "BASELINE_PRESSURE_WINTER", r["OUTPUT"])
+                self.scratch.release(r["OUTPUT"])
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # baseline opportunity winter (all factors)
                 params = {"INPUT_A": outputs["BASELINE_OPPORTUNITY_WINTER"],
@@ -431,88 +1099,80 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                           "BAND_B": 1,
                           "FORMULA": f"A+B",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                outputs["BASELINE_OPPORTUNITY_WINTER"] = r["OUTPUT"]
+                          "OUTPUT": self.destination("BASELINE_OPPORTUNITY_WINTER", last)}
+                r = self.rasterCalculator(params, context, multistepFeedback)
+                self.store(outputs, "BASELINE_OPPORTUNITY_WINTER", r["OUTPUT"])
+                self.scratch.release(r["OUTPUT"])
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
-            # process user self.scenarios
-            for s in self.scenarios:
+            # process user scenarios
+            for s in scenarios:
                 feedback.pushInfo(f"Process scenario '{s}'.")
 
-                found = False
-                for sw in scenarioData:
-                    if sw[0] == s and sw[1] == fileName:
-                        opportunityMultiplier = sw[2]
-                        pressureMultiplier = sw[3]
-                        found = True
-                        break
-
-                if not found:
-                    raise QgsProcessingException(f"Could not find pressure and opportunity multipliers scenario {s} and factor file {fileName}.")
+                opportunityMultiplier, pressureMultiplier = weights.scenarioMultipliers(s, fileName)
 
                 # scenario pressure summer factor
                 params = {"INPUT_A": factor_pressure_summer["OUTPUT"],
                           "BAND_A": 1,
                           "FORMULA": f"A*{pressureMultiplier}",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                scenario_pressure_summer = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                          "OUTPUT": self.destination(f"{s}_PRESSURE_SUMMER", last and i == 0)}
+                scenario_pressure_summer = self.rasterCalculator(params, context, multistepFeedback)
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # scenario opportunity summer factor
                 params = {"INPUT_A": factor_opportunity_summer["OUTPUT"],
                           "BAND_A": 1,
                           "FORMULA": f"A*{opportunityMultiplier}",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                scenario_opportunity_summer = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                          "OUTPUT": self.destination(f"{s}_OPPORTUNITY_SUMMER", last and i == 0)}
+                scenario_opportunity_summer = self.rasterCalculator(params, context, multistepFeedback)
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # scenario pressure winter factor
                 params = {"INPUT_A": factor_pressure_winter["OUTPUT"],
                           "BAND_A": 1,
                           "FORMULA": f"A*{pressureMultiplier}",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                scenario_pressure_winter = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                          "OUTPUT": self.destination(f"{s}_PRESSURE_WINTER", last and i == 0)}
+                scenario_pressure_winter = self.rasterCalculator(params, context, multistepFeedback)
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 # scenario opportunity winter factor
                 params = {"INPUT_A": factor_opportunity_winter["OUTPUT"],
                           "BAND_A": 1,
                           "FORMULA": f"A*{opportunityMultiplier}",
                           "RTYPE": 5,
-                          "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                scenario_opportunity_winter = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
+                          "OUTPUT": self.destination(f"{s}_OPPORTUNITY_WINTER", last and i == 0)}
+                scenario_opportunity_winter = self.rasterCalculator(params, context, multistepFeedback)
 
                 step += 1
                 multistepFeedback.setCurrentStep(step)
                 if feedback.isCanceled():
-                    return {}
+                    return None
 
                 if i == 0:
                     # if this is the first factor for current scenario, we just store rasters as outputs
-                    outputs[f"{s}_PRESSURE_SUMMER"] = scenario_pressure_summer["OUTPUT"]
-                    outputs[f"{s}_OPPORTUNITY_SUMMER"] = scenario_opportunity_summer["OUTPUT"]
-                    outputs[f"{s}_PRESSURE_WINTER"] = scenario_pressure_winter["OUTPUT"]
-                    outputs[f"{s}_OPPORTUNITY_WINTER"] = scenario_opportunity_winter["OUTPUT"]
+                    self.store(outputs, f"{s}_PRESSURE_SUMMER", scenario_pressure_summer["OUTPUT"])
+                    self.store(outputs, f"{s}_OPPORTUNITY_SUMMER", scenario_opportunity_summer["OUTPUT"])
+                    self.store(outputs, f"{s}_PRESSURE_WINTER", scenario_pressure_winter["OUTPUT"])
+                    self.store(outputs, f"{s}_OPPORTUNITY_WINTER", scenario_opportunity_winter["OUTPUT"])
                 else:
                     # for 2nd and all subsequent factors we add them to the previously saved
                     # outputs and then update output to point out at the new file
@@ -524,14 +1184,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                               "BAND_B": 1,
                               "FORMULA": f"A+B",
                               "RTYPE": 5,
-                              "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                    r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                    outputs[f"{s}_PRESSURE_SUMMER"] = r["OUTPUT"]
+                              "OUTPUT": self.destination(f"{s}_PRESSURE_SUMMER", last)}
+                    r = self.rasterCalculator(params, context, multistepFeedback)
+                    self.store(outputs, f"{s}_PRESSURE_SUMMER", r["OUTPUT"])
+                    self.scratch.release(r["OUTPUT"])
 
                     step += 1
                     multistepFeedback.setCurrentStep(step)
                     if feedback.isCanceled():
-                        return {}
+                        return None
 
                     # scenario opportunity summer (all factors)
                     params = {"INPUT_A": outputs[f"{s}_OPPORTUNITY_SUMMER"],
@@ -540,14 +1201,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                               "BAND_B": 1,
                               "FORMULA": f"A+B",
                               "RTYPE": 5,
-                              "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                    r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                    outputs[f"{s}_OPPORTUNITY_SUMMER"] = r["OUTPUT"]
+                              "OUTPUT": self.destination(f"{s}_OPPORTUNITY_SUMMER", last)}
+                    r = self.rasterCalculator(params, context, multistepFeedback)
+                    self.store(outputs, f"{s}_OPPORTUNITY_SUMMER", r["OUTPUT"])
+                    self.scratch.release(r["OUTPUT"])
 
                     step += 1
                     multistepFeedback.setCurrentStep(step)
                     if feedback.isCanceled():
-                        return {}
+                        return None
 
                     # scenario pressure winter (all factors)
                     params = {"INPUT_A": outputs[f"{s}_PRESSURE_WINTER"],
@@ -556,14 +1218,15 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                               "BAND_B": 1,
                               "FORMULA": f"A+B",
                               "RTYPE": 5,
-                              "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                    r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                    outputs[f"{s}_PRESSURE_WINTER"] = r["OUTPUT"]
+                              "OUTPUT": self.destination(f"{s}_PRESSURE_WINTER", last)}
+                    r = self.rasterCalculator(params, context, multistepFeedback)
+                    self.store(outputs, f"{s}_PRESSURE_WINTER", r["OUTPUT"])
+                    self.scratch.release(r["OUTPUT"])
 
                     step += 1
                     multistepFeedback.setCurrentStep(step)
                     if feedback.isCanceled():
-                        return {}
+                        return None
 
                     # scenario opportunity winter (all factors)
                     params = {"INPUT_A": outputs[f"{s}_OPPORTUNITY_WINTER"],
@@ -572,39 +1235,370 @@ class MopstAlgorithm(QgsProcessingAlgorithm):
                               "BAND_B": 1,
                               "FORMULA": f"A+B",
                               "RTYPE": 5,
-                              "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT}
-                    r = processing.run("gdal:rastercalculator", params, context=context, feedback=multistepFeedback, is_child_algorithm=True)
-                    outputs[f"{s}_OPPORTUNITY_WINTER"] = r["OUTPUT"]
+                              "OUTPUT": self.destination(f"{s}_OPPORTUNITY_WINTER", last)}
+                    r = self.rasterCalculator(params, context, multistepFeedback)
+                    self.store(outputs, f"{s}_OPPORTUNITY_WINTER", r["OUTPUT"])
+                    self.scratch.release(r["OUTPUT"])
 
                     step += 1
                     multistepFeedback.setCurrentStep(step)
                     if feedback.isCanceled():
-                        return {}
-
-        # copy results to the output directory
-        self.scenarios.append("BASELINE")
+                        return None
+
+                # scenario factor rasters are not needed any more
+                for raster in (scenario_pressure_summer, scenario_opportunity_summer, scenario_pressure_winter, scenario_opportunity_winter):
+                    self.scratch.release(raster["OUTPUT"])
+
+            # neither are the factor rasters once all scenarios are processed
+            for raster in (factor_pressure_summer, factor_opportunity_summer, factor_pressure_winter, factor_opportunity_winter):
+                self.scratch.release(raster["OUTPUT"])
+
+            if not last and self.checkpoint is not None and self.checkpoint.interval:
+                self.keepChainState(i + 1, ["BASELINE"] + scenarios, outputs)
+                if self.checkpoint.isDue():
+                    feedback.pushInfo(f"Save checkpoint after {i + 1} factors.")
+                    with self.profiler.stage("Save checkpoint", *self.gridSize):
+                        self.checkpointChain(*self.chainState)
+
+        return step
+
+    def keepChainState(self, factors, scenarios, outputs):
+        # keep the outputs accumulated over the given number of factors
+        # until the next factor is complete, so they can still be saved to
+        # the checkpoint when the run is canceled or fails
+        rasters = {f"{s}_{key}": outputs[f"{s}_{key}"] for s in scenarios for key, name in OUTPUT_FILES}
+        for path in rasters.values():
+            self.scratch.retain(path)
+        if self.chainState is not None:
+            for path in self.chainState[1].values():
+                self.scratch.release(path)
+        self.chainState = (factors, rasters)
+
+    def checkpointChain(self, factors, rasters):
+        # save copies of the rasters accumulated over the given number of
+        # factors to the checkpoint
+        folder = self.checkpoint.folder()
+        names = {}
+        for key, path in rasters.items():
+            names[key] = f"{key}.tif"
+            if self.scratch.array(path) is not None:
+                self.stripCalculator().run("A", {"A": path}, os.path.join(folder, names[key]))
+            else:
+                shutil.copyfile(path, os.path.join(folder, names[key]))
+        self.checkpoint.save("chain", {"factors": factors, "folder": os.path.basename(folder), "rasters": names})
+
+    def saveCheckpoint(self, feedback):
+        # save the factors accumulated since the last checkpoint before a
+        # canceled or failed run ends, without hiding why it failed
+        if self.checkpoint is None or self.chainState is None:
+            return
+        saved = self.checkpoint.stage("chain")
+        if saved is not None and saved["factors"] >= self.chainState[0]:
+            return
+        try:
+            with self.profiler.stage("Save checkpoint", *self.gridSize):
+                self.checkpointChain(*self.chainState)
+            feedback.pushInfo(f"Saved checkpoint after {self.chainState[0]} factors, resume the run to continue.")
+        except (OSError, QgsProcessingException) as e:
+            feedback.pushWarning(f"Could not save checkpoint: {e}")
+
+    def restoreChain(self, outputs):
+        # copy the accumulated outputs of the checkpoint to the scratch
+        # folder, returns the number of factors they hold
+        state = self.checkpoint.stage("chain")
+        with self.profiler.stage("Restore checkpoint", *self.gridSize):
+            for key, name in state["rasters"].items():
+                outputs[key] = shutil.copyfile(self.checkpoint.rasterPath(name, state), self.scratch.path())
+        return state["factors"]
+
+    def runChild(self, algorithm, params, context, feedback):
+        # run a processing algorithm as a profiled stage
+        import processing
+
+        with self.profiler.stage(algorithm, *self.gridSize):
+            return processing.run(algorithm, params, context=context, feedback=feedback, is_child_algorithm=True)
+
+    def rasterCalculator(self, params, context, feedback):
+        # a gdal:rastercalculator step, evaluated in this process when
+        # intermediate rasters are kept in memory
+        if not self.inMemory:
+            return self.runChild("gdal:rastercalculator", params, context, feedback)
+
+        inputs = {name: params[f"INPUT_{name}"] for name in "AB" if f"INPUT_{name}" in params}
+        with self.profiler.stage("In memory raster calculator", *self.gridSize):
+            return {"OUTPUT": self.stripCalculator().run(params["FORMULA"], inputs, params["OUTPUT"])}
+
+    def stripCalculator(self):
+        from mopst.calculator import StripCalculator
+
+        if self.calculator is None:
+            self.calculator = StripCalculator(self.scratch, self.gridTemplate)
+        return self.calculator
+
+    def restoreLandcover(self, cache, key, files):
+        with self.profiler.stage("Restore landcover from cache"):
+            return cache.restore(key, files)
+
+    def destination(self, key, final):
+        # the final step of an output writes next to its destination, all
+        # other steps to the scratch folder or memory
+        if final and key in self.destinations:
+            return self.destinations[key]
+        return self.scratch.path(inMemory=self.inMemory and not final)
+
+    def store(self, outputs, key, path):
+        # point an output to a new raster, the previous one is released
+        self.scratch.retain(path)
+        if key in outputs:
+            self.scratch.release(outputs[key])
+        outputs[key] = path
+
+    def complete(self, path):
+        # move the completed partial file of an output into place
+        os.replace(partialPath(path), path)
+        return path
+
+    def scoringTerms(self, factorLayers, weights):
+        # constants multiplying the seasonal landcover for every factor,
+        # per (scenario, metric)
+        terms = {("BASELINE", "PRESSURE"): [], ("BASELINE", "OPPORTUNITY"): []}
         for s in self.scenarios:
-            dst = self.outputDir
-            if s != "BASELINE":
-                dst = os.path.join(self.outputDir, f"scenario-{s}")
-            r = shutil.copyfile(outputs[f"{s}_PRESSURE_SUMMER"], os.path.join(dst, "pressure-summer.tif"))
-            self.outputLayers.append(r)
-            self.layersToAdd[s].append(r)
-            r = shutil.copyfile(outputs[f"{s}_OPPORTUNITY_SUMMER"], os.path.join(dst, "opportunity-summer.tif"))
-            self.outputLayers.append(r)
-            self.layersToAdd[s].append(r)
-            r = shutil.copyfile(outputs[f"{s}_PRESSURE_WINTER"], os.path.join(dst, "pressure-winter.tif"))
-            self.outputLayers.append(r)
-            self.layersToAdd[s].append(r)
-            r = shutil.copyfile(outputs[f"{s}_OPPORTUNITY_WINTER"], os.path.join(dst, "opportunity-winter.tif"))
-            self.outputLayers.append(r)
-            self.layersToAdd[s].append(r)
+            terms[(s, "PRESSURE")] = []
+            terms[(s, "OPPORTUNITY")] = []
 
-        with open(os.path.join(self.outputDir, "execution-log.txt"), "w", encoding="utf-8") as f:
-            f.write(feedback.textLog())
+        for factorFile in factorLayers:
+            fileName = os.path.split(factorFile)[1]
+            pressureWeight, opportunityWeight = weights.factorWeights(fileName)
+            terms[("BASELINE", "PRESSURE")].append((pressureWeight,))
+            terms[("BASELINE", "OPPORTUNITY")].append((opportunityWeight,))
+            for s in self.scenarios:
+                opportunityMultiplier, pressureMultiplier = weights.scenarioMultipliers(s, fileName)
+                terms[(s, "PRESSURE")].append((pressureWeight, pressureMultiplier))
+                terms[(s, "OPPORTUNITY")].append((opportunityWeight, opportunityMultiplier))
+
+        return terms
+
+    def runPlannedCalculator(self, plan, outputs, context, feedback, multistepFeedback, step):
+        # one raster calculator run per planned operation, returns the
+        # current step or None if the algorithm was canceled
+        for season, coefficient, targets in plan.operations:
+            s, key = targets[0]
+            params = {"INPUT_A": outputs[f"LANDCOVER_{season}"]["OUTPUT"],
+                      "BAND_A": 1,
+                      "FORMULA": f"A*{coefficient!r}",
+                      "RTYPE": 5,
+                      "OUTPUT": self.destination(f"{s}_{key}", True)}
+            r = self.rasterCalculator(params, context, multistepFeedback)
+            self.store(outputs, f"{s}_{key}", r["OUTPUT"])
+
+            # outputs sharing the operation get a copy
+            for s, key in targets[1:]:
+                if f"{s}_{key}" in self.destinations:
+                    self.store(outputs, f"{s}_{key}", shutil.copyfile(r["OUTPUT"], self.destinations[f"{s}_{key}"]))
+                else:
+                    self.store(outputs, f"{s}_{key}", r["OUTPUT"])
+            self.scratch.release(r["OUTPUT"])
 
-        return {self.OUTPUT: self.outputDir,
-                self.OUTPUT_LAYERS: self.outputLayers}
+            step += 1
+            multistepFeedback.setCurrentStep(step)
+            if feedback.isCanceled():
+                return None
+
+        return step
+
+    def runBlockEngine(self, plan, cubes, masks, factors, zones, outputs, feedback):
+        # compute all baseline and scenario outputs in one pass over the
+        # summer and winter landcover rasters, writing them to the final paths.
+        # Operations are grouped by scenario so groups can run in parallel.
+        # With masks only the tiles with pixels inside them are computed, with
+        # factors their rasters are read in the same pass, with zones summary
+        # statistics are collected while outputs are written
+        from mopst.engine import BlockEngine
+        from mopst.parallel import runEngines
+
+        fileNames = dict(OUTPUT_FILES)
+        bands = {key: i + 1 for i, (key, name) in enumerate(OUTPUT_FILES)}
+
+        # all bands of a cube are written by one engine, so scenarios sharing
+        # an operation are put into the same group
+        groupOf = {}
+        for season, coefficient, targets in plan.operations:
+            members = {targets[0][0]}
+            if cubes:
+                for s, key in targets:
+                    members |= groupOf.get(s, {s})
+            for s in members:
+                groupOf[s] = members
+
+        groups = {}
+        for season, coefficient, targets in plan.operations:
+            paths = []
+            for s, key in targets:
+                if cubes:
+                    path = (self.cubePath(s), bands[key])
+                else:
+                    path = self.outputPath(s, fileNames[key])
+                outputs[f"{s}_{key}"] = path
+                paths.append(path)
+            groups.setdefault(min(groupOf[targets[0][0]]), []).append((season, coefficient, paths))
+
+        # distribute scenario groups over the workers, largest first, each
+        # worker gets an equal share of the memory budget and threads
+        nWorkers = max(1, min(self.workers, len(groups)))
+        engines = [BlockEngine(self.blockSize, self.memoryBudget // nWorkers, self.threads // nWorkers)
+                   for i in range(nWorkers)]
+        for operations in sorted(groups.values(), key=len, reverse=True):
+            engine = min(engines, key=lambda e: len(e.operations))
+            for season, coefficient, paths in operations:
+                engine.addOperation(season, coefficient, paths)
+                if cubes:
+                    for path, band in paths:
+                        engine.addCube(path, self.cubeBands())
+
+        for engine in engines:
+            engine.addSource("SUMMER", outputs["LANDCOVER_SUMMER"]["OUTPUT"])
+            engine.addSource("WINTER", outputs["LANDCOVER_WINTER"]["OUTPUT"])
+            for path in masks:
+                engine.addMask(path)
+            for path in factors:
+                engine.addFactor(path)
+            if zones is not None:
+                engine.summarize = True
+                for name, path in zones.items():
+                    engine.addZone(name, path)
+
+        if masks:
+            self.shareOccupancy(engines, feedback)
+
+        if nWorkers == 1:
+            completed = engines[0].run(feedback)
+        else:
+            feedback.pushInfo(f"Run block engine in {nWorkers} worker processes.")
+            completed = runEngines(engines, feedback)
+
+        if completed and zones is not None:
+            self.writeSummary(engines, cubes, feedback)
+        return completed
+
+    def zoneFiles(self, parameters, outputs, context):
+        # rasters whose values the summary statistics are broken down by,
+        # habitats only if the landcover classes were rasterized in this run
+        maskFiles = self.maskFiles(parameters, context)
+        zones = {"pressure-areas": maskFiles[0], "opportunity-areas": maskFiles[1]}
+        if "LANDCOVER_CLASSES" in outputs and self.classNames is not None:
+            zones["habitat"] = outputs["LANDCOVER_CLASSES"]["OUTPUT"]
+        return zones
+
+    def writeSummary(self, engines, cubes, feedback):
+        # statistics of the outputs written by the engines, merged into the
+        # summary of the output directory
+        from mopst.summary import RunSummary
+
+        labels = {}
+        if self.classNames is not None:
+            labels["habitat"] = self.classNames
+        names = {}
+        for s in self.scenarios + ["BASELINE"]:
+            for i, (key, name) in enumerate(OUTPUT_FILES):
+                if cubes:
+                    names[(self.cubePath(s), i + 1)] = f"{self.relativePath(self.cubePath(s))}:{self.cubeBands()[i]}"
+                else:
+                    names[self.outputPath(s, name)] = self.relativePath(self.outputPath(s, name))
+
+        summary = RunSummary(self.outputDir)
+        for engine in engines:
+            for target, statistics in engine.summaries.items():
+                summary.update(names[target], statistics, labels)
+        summary.restrict(names.values())
+        with self.profiler.stage("Write summary statistics"):
+            summary.write()
+        feedback.pushInfo(f"Summary statistics written to {os.path.join(self.outputDir, 'summary.csv')}.")
+
+    def relativePath(self, path):
+        return os.path.relpath(path, self.outputDir).replace(os.sep, "/")
+
+    def shareOccupancy(self, engines, feedback):
+        # the occupancy index is built once and shared by all engines
+        with self.profiler.stage("Occupancy index", *self.gridSize):
+            occupied = engines[0].occupancy()
+        feedback.pushInfo(f"{len(occupied)} of {engines[0].tiles(*self.gridSize)} blocks have pixels in pressure or opportunity areas.")
+        for engine in engines:
+            engine.occupied = occupied
+
+    def runEnsemble(self, weights, factorLayers, factorValues, masks, outputs, size, spread, distribution, percentiles, feedback):
+        # write mean, standard deviation and percentiles of every output
+        # over random draws of the weights, one multi-band raster per
+        # output. Returns the (scenario, path) of the rasters written, None
+        # if canceled
+        from mopst.ensemble import EnsembleEngine, drawCoefficients, statisticNames, DISTRIBUTIONS, SEED
+
+        coefficients = drawCoefficients(weights, [os.path.split(f)[1] for f in factorLayers], self.scenarios,
+                                        size, spread, DISTRIBUTIONS[distribution], SEED, factorValues)
+
+        engine = EnsembleEngine(self.blockSize, self.memoryBudget, self.threads, percentiles)
+        engine.addSource("SUMMER", outputs["LANDCOVER_SUMMER"]["OUTPUT"])
+        engine.addSource("WINTER", outputs["LANDCOVER_WINTER"]["OUTPUT"])
+        if factorValues:
+            for path in self.alignedFiles(factorLayers):
+                engine.addFactor(path)
+        for path in masks:
+            engine.addMask(path)
+
+        files = []
+        names = statisticNames(percentiles)
+        for s in ["BASELINE"] + self.scenarios:
+            for key, name in OUTPUT_FILES:
+                metric, season = key.split("_")
+                path = self.outputPath(s, os.path.splitext(name)[0] + "-ensemble.tif")
+                engine.addDraws((s, metric), coefficients[(s, metric)])
+                engine.addCube(path, names)
+                for i in range(len(names)):
+                    engine.addOperation(season, ((s, metric), i), [(path, i + 1)])
+                files.append((s, path))
+
+        if masks:
+            self.shareOccupancy([engine], feedback)
+        if not engine.run(feedback):
+            return None
+        return files
+
+    def ensemblePercentiles(self, parameters, context):
+        text = self.parameterAsString(parameters, self.ENSEMBLE_PERCENTILES, context)
+        try:
+            percentiles = [float(p) for p in text.replace(";", ",").split(",") if p.strip()]
+        except ValueError:
+            raise QgsProcessingException(f"Ensemble percentiles must be numbers separated by commas, not '{text}'.")
+        if any(p < 0 or p > 100 for p in percentiles):
+            raise QgsProcessingException("Ensemble percentiles must be between 0 and 100.")
+        return percentiles
+
+    def writeCubes(self, stale, outputs, feedback):
+        # stack the separate rasters of every out of date scenario into its
+        # cube, returns False if canceled
+        from mopst.engine import BlockEngine
+
+        engine = BlockEngine(self.blockSize, self.memoryBudget, self.threads)
+        for s in self.scenarios:
+            if (s, OUTPUT_FILES[0][0]) not in stale:
+                continue
+            engine.addCube(self.cubePath(s), self.cubeBands())
+            for i, (key, name) in enumerate(OUTPUT_FILES):
+                engine.addSource(f"{s}_{key}", outputs[f"{s}_{key}"])
+                engine.addOperation(f"{s}_{key}", 1.0, [(self.cubePath(s), i + 1)])
+
+        return engine.run(feedback)
+
+    def cubeBands(self):
+        # band descriptions of a cube, named like the separate rasters
+        return [os.path.splitext(name)[0] for key, name in OUTPUT_FILES]
+
+    def cubePath(self, scenario):
+        return self.outputPath(scenario, "scores.tif")
+
+    def outputPath(self, scenario, name):
+        if scenario == "BASELINE":
+            return os.path.join(self.outputDir, name)
+        return os.path.join(self.outputDir, f"scenario-{scenario}", name)
 
     def postProcessAlgorithm(self, context, feedback):
         project = context.project()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+
+from osgeo import gdal
+
+from qgis.core import QgsProcessingException
+
+from mopst.paths import partialPath
+
+# folder of the warped virtual rasters, in the cache or output directory.
+# Starts with a dot so cache eviction leaves it alone
+ALIGNED_DIR = ".aligned"
+
+# bump when the warp definitions change
+ALIGN_VERSION = 1
+
+
+class GridAligner:
+    """
+    Wraps rasters which are not on the grid of the template raster in
+    warped virtual rasters (VRT) matching its CRS, extent and resolution.
+
+    A warped VRT only holds the warp definition, GDAL resamples the
+    windows read from it on the fly, so no resampled copy of the raster is
+    written. Nearest neighbour resampling keeps the 0/1 values of masks
+    and factors. VRTs are named after a hash of the source file, its size
+    and modification time and the template grid, and reused by later runs
+    as long as none of these change.
+    """
+
+    def __init__(self, templatePath, directory):
+        self.directory = os.path.join(directory, ALIGNED_DIR)
+        template = gdal.Open(templatePath)
+        geoTransform = template.GetGeoTransform()
+        self.width = template.RasterXSize
+        self.height = template.RasterYSize
+        self.projection = template.GetProjection()
+        self.bounds = (geoTransform[0],
+                       geoTransform[3] + geoTransform[5] * self.height,
+                       geoTransform[0] + geoTransform[1] * self.width,
+                       geoTransform[3])
+
+    def key(self, path):
+        try:
+            stat = os.stat(path)
+            data = [ALIGN_VERSION, os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            # not a local file, e.g. a URL
+            data = [ALIGN_VERSION, path]
+        data += [self.width, self.height, self.bounds, self.projection]
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+    def aligned(self, path):
+        """
+        Returns the path of a warped VRT of the raster on the template
+        grid and whether it was reused.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        vrtPath = os.path.join(self.directory, f"{name}-{self.key(path)[:16]}.vrt")
+        if os.path.exists(vrtPath):
+            return vrtPath, True
+
+        os.makedirs(self.directory, exist_ok=True)
+        options = gdal.WarpOptions(format="VRT",
+                                   outputBounds=self.bounds,
+                                   width=self.width,
+                                   height=self.height,
+                                   dstSRS=self.projection,
+                                   resampleAlg="near")
+        ds = gdal.Warp(partialPath(vrtPath), os.path.abspath(path) if os.path.exists(path) else path, options=options)
+        if ds is None:
+            raise QgsProcessingException(f"Could not align {path} to the pressure raster grid: {gdal.GetLastErrorMsg()}")
+        # the VRT is written when closed
+        ds = None
+        os.replace(partialPath(vrtPath), vrtPath)
+        return vrtPath, False
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs MOPST headlessly for many study areas listed in a manifest.
+
+    python -m mopst.batch areas.json --workers 4
+
+The manifest is a JSON file with a list of areas and optional defaults
+shared by all areas. Keys are MopstAlgorithm parameter names,
+FACTOR_WEIGHTS_CSV and SCENARIO_WEIGHTS_CSV are accepted as other names
+of FACTOR_WEIGHTS_FILE and SCENARIO_WEIGHTS_FILE. FACTORS may be given
+as a folder, all .tif files in it are used. Relative paths are resolved
+against the folder of the manifest.
+
+    {"defaults": {"FACTORS": "factor-rasters",
+                  "FACTOR_WEIGHTS_FILE": "factor-weights.csv",
+                  "SCENARIO_WEIGHTS_FILE": "scenario-weights.csv"},
+     "areas": [{"name": "south-downs",
+                "LAND_COVER": "south-downs/land-cover.shp",
+                ...
+                "OUTPUT": "output/south-downs"}]}
+
+Areas run in worker processes, each initializing QGIS once, as the GDAL
+block cache size set by the block engine and the counters read by the
+profiler are process wide and areas running in the same process would
+mix them. With a single worker areas run one after the other in this
+process. Unless the manifest sets CACHE_DIR, all areas share a cache
+next to the manifest so common inputs are rasterized once. A summary with the status and
+timing of every area is written to batch-report.json and printed.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from qgis.core import (QgsApplication,
+                       QgsProcessingContext,
+                       QgsProcessingException,
+                       QgsProcessingFeedback,
+                      )
+
+# parameters holding file or folder paths
+PATH_PARAMETERS = ("LAND_COVER", "LANDCOVER_SENSITIVITY", "SEASONALITY_SCORE", "PRESSURE_AREAS",
+                   "OPPORTUNITY_AREAS", "FACTORS", "FACTOR_WEIGHTS_FILE", "SCENARIO_WEIGHTS_FILE",
+                   "CACHE_DIR", "OUTPUT")
+
+# earlier names of parameters
+ALIASES = {"FACTOR_WEIGHTS_CSV": "FACTOR_WEIGHTS_FILE",
+           "SCENARIO_WEIGHTS_CSV": "SCENARIO_WEIGHTS_FILE",
+          }
+
+# QGIS application and provider of a worker process, set by the pool
+# initializer
+_qgis = None
+
+
+def resolve(value, base):
+    if isinstance(value, list):
+        return [resolve(v, base) for v in value]
+    if isinstance(value, str) and value:
+        return os.path.normpath(os.path.join(base, os.path.expanduser(value)))
+    return value
+
+
+def areaParameters(area, defaults, base):
+    """
+    Returns the name and the MopstAlgorithm parameters of a manifest area.
+    """
+    values = dict(defaults, **area)
+    name = values.pop("name", None) or os.path.basename(values.get("OUTPUT", ""))
+    for alias, key in ALIASES.items():
+        if alias in values:
+            values[key] = values.pop(alias)
+    for key in PATH_PARAMETERS:
+        if key in values:
+            values[key] = resolve(values[key], base)
+
+    if isinstance(values.get("FACTORS"), str) and os.path.isdir(values["FACTORS"]):
+        values["FACTORS"] = sorted(glob.glob(os.path.join(glob.escape(values["FACTORS"]), "*.tif")))
+
+    return name, values
+
+
+class BatchFeedback(QgsProcessingFeedback):
+    """
+    Collects the log of one area, messages printed to the console are
+    prefixed with the area name.
+    """
+
+    def __init__(self, name, verbose):
+        super().__init__()
+        self.name = name
+        self.verbose = verbose
+
+    def pushInfo(self, info):
+        super().pushInfo(info)
+        if self.verbose:
+            print(f"[{self.name}] {info}", flush=True)
+
+    def reportError(self, error, fatalError=False):
+        super().reportError(error, fatalError)
+        print(f"[{self.name}] {error}", file=sys.stderr, flush=True)
+
+
+def startQgis():
+    # initializes QGIS, Processing and the MOPST provider in this process
+    QgsApplication.setPrefixPath(os.environ.get("QGIS_PREFIX_PATH", "/usr"), True)
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    from processing.core.Processing import Processing
+    Processing.initialize()
+
+    from mopst.provider import MopstProvider
+    provider = MopstProvider()
+    QgsApplication.processingRegistry().addProvider(provider)
+    return app, provider
+
+
+def stopQgis(app, provider):
+    QgsApplication.processingRegistry().removeProvider(provider)
+    app.exitQgis()
+
+
+def _initWorker():
+    global _qgis
+    _qgis = startQgis()
+
+
+def runArea(name, parameters, verbose):
+    # runs the algorithm for one area on the calling thread of a process
+    # with QGIS initialized, results are not loaded into a project
+    status = {"name": name, "output": parameters.get("OUTPUT"), "status": "ok", "error": None}
+    start = time.perf_counter()
+    try:
+        context = QgsProcessingContext()
+        feedback = BatchFeedback(name, verbose)
+        alg = QgsApplication.processingRegistry().createAlgorithmById("mopst:mopst")
+        if not alg.prepare(parameters, context, feedback):
+            raise QgsProcessingException("Could not prepare the algorithm, check the parameters.")
+        results = alg.runPrepared(parameters, context, feedback)
+        if not results or feedback.isCanceled():
+            status["status"] = "canceled"
+    except Exception as e:
+        status["status"] = "failed"
+        status["error"] = str(e)
+    status["wallTime"] = time.perf_counter() - start
+    print(f"[{name}] {status['status']} in {status['wallTime']:.1f} s", flush=True)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MOPST for the study areas of a manifest.")
+    parser.add_argument("manifest")
+    parser.add_argument("--workers", type=int, default=1, help="areas run at the same time")
+    parser.add_argument("--report", help="summary report, default batch-report.json next to the manifest")
+    parser.add_argument("--verbose", action="store_true", help="print the log of every area")
+    args = parser.parse_args()
+
+    base = os.path.dirname(os.path.abspath(args.manifest))
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    # processors are shared between the areas running at the same time
+    defaults = {"CACHE_DIR": os.path.join(base, "cache"),
+                "THREADS": max(1, (os.cpu_count() or 1) // args.workers),
+               }
+    defaults.update(manifest.get("defaults", {}))
+    areas = [areaParameters(area, defaults, base) for area in manifest["areas"]]
+
+    start = time.perf_counter()
+    if args.workers <= 1:
+        app, provider = startQgis()
+        statuses = [runArea(name, parameters, args.verbose) for name, parameters in areas]
+        stopQgis(app, provider)
+    else:
+        from mopst.parallel import processContext
+
+        with ProcessPoolExecutor(args.workers, processContext(), _initWorker) as pool:
+            statuses = list(pool.map(runArea, [name for name, parameters in areas],
+                                     [parameters for name, parameters in areas], [args.verbose] * len(areas)))
+
+    report = {"manifest": os.path.abspath(args.manifest),
+              "workers": args.workers,
+              "wallTime": time.perf_counter() - start,
+              "areas": statuses,
+             }
+    reportPath = args.report or os.path.join(base, "batch-report.json")
+    with open(reportPath, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'Area':<30} {'Status':<10} {'Time (s)':>10}")
+    for s in statuses:
+        print(f"{s['name']:<30} {s['status']:<10} {s['wallTime']:>10.1f}")
+    print(f"Report written to {reportPath}.")
+
+    return 0 if all(s["status"] == "ok" for s in statuses) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
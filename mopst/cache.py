@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+
+# bump when the layout or content of cached entries changes
+CACHE_VERSION = 1
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def relatedFiles(path):
+    # shapefiles and similar formats are spread over several files
+    # sharing the same base name, GDAL auxiliary files only hold
+    # statistics and are skipped
+    stem = os.path.splitext(path)[0]
+    files = [f for f in glob.glob(glob.escape(stem) + ".*")
+             if os.path.isfile(f) and not f.lower().endswith(".aux.xml")]
+    return sorted(files) if files else [path]
+
+
+def fileDigest(path, digests):
+    # digests maps paths to [size, mtime, digest] of already hashed files
+    stat = os.stat(path)
+    known = digests.get(path)
+    if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+        return known[2]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    digests[path] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return digests[path][2]
+
+
+def inputsKey(inputs, params, digests):
+    """
+    Hashes the contents of the input files together with the step
+    parameters. Returns None if any of the inputs is not a local file.
+    """
+    if any(p is None or not os.path.isfile(p) for p in inputs):
+        return None
+
+    h = hashlib.sha256()
+    h.update(str(CACHE_VERSION).encode())
+    for path in inputs:
+        for f in relatedFiles(path):
+            h.update(os.path.splitext(f)[1].lower().encode())
+            h.update(fileDigest(f, digests).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class RasterCache:
+    """
+    Persistent, content-addressed cache of raster files.
+
+    Entries are keyed by a hash of the contents of the input files and of
+    the step parameters, so unchanged inputs hit the cache whatever their
+    path or modification time. File digests are remembered by path, size
+    and modification time to avoid re-reading large inputs on every run.
+    The total cache size is kept under a limit by evicting the least
+    recently used entries.
+    """
+
+    def __init__(self, directory, maxSize):
+        self.directory = directory
+        self.maxSize = maxSize
+        os.makedirs(self.directory, exist_ok=True)
+        self.digestsFile = os.path.join(self.directory, "digests.json")
+
+    def loadDigests(self):
+        try:
+            with open(self.digestsFile, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def saveDigests(self, digests):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(digests, f)
+        os.replace(tmp, self.digestsFile)
+
+    def key(self, inputs, params):
+        """
+        Returns the cache key for the given input files and step parameters,
+        or None if any of the inputs is not a local file.
+        """
+        digests = self.loadDigests()
+        key = inputsKey(inputs, params, digests)
+        if key is not None:
+            self.saveDigests(digests)
+        return key
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, files):
+        """
+        Copies cached files of the entry to the given destinations, files is
+        a mapping of entry file name to destination path. Returns False on a
+        cache miss, also when the entry is evicted by another process while
+        it is copied, leaving no partial destination behind.
+        """
+        entry = self.entryPath(key)
+        if not all(os.path.isfile(os.path.join(entry, name)) for name in files):
+            return False
+
+        try:
+            for name, path in files.items():
+                shutil.copyfile(os.path.join(entry, name), path)
+            # mark the entry as recently used
+            os.utime(entry)
+        except OSError:
+            for path in files.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+        return True
+
+    def store(self, key, files):
+        """
+        Stores files in a new entry, files is a mapping of entry file name
+        to source path. The entry only becomes visible once complete.
+        """
+        entry = self.entryPath(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            for name, path in files.items():
+                shutil.copyfile(path, os.path.join(tmp, name))
+            os.replace(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+
+        self.evict()
+
+    def entrySize(self, entry):
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def evict(self):
+        # remove least recently used entries until the cache fits the limit
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if os.path.isdir(entry) and not name.startswith("."):
+                entries.append((os.path.getmtime(entry), self.entrySize(entry), entry))
+
+        total = sum(size for mtime, size, entry in entries)
+        for mtime, size, entry in sorted(entries):
+            if total <= self.maxSize:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+from osgeo import gdal
+
+from qgis.core import QgsProcessingException
+
+from mopst.engine import FLOAT32_NODATA
+
+# pixels per strip of every input and the output, 4 MB as Float32
+STRIP_PIXELS = 1024 * 1024
+
+
+class StripCalculator:
+    """
+    Evaluates gdal_calc.py formulas of rasters named A, B, ... in this
+    process, strip by strip, instead of starting gdal_calc.py for every
+    raster calculator step.
+
+    Rasters are files or in memory paths of a ScratchSpace, so the
+    intermediate rasters of a calculator chain are passed between steps
+    as arrays instead of being written to and read back from GeoTIFF
+    files. Like gdal_calc.py results are Float32 with the Float32 nodata
+    value, which is set wherever an input is nodata. Files are written on
+    the grid of the template raster.
+    """
+
+    def __init__(self, scratch, template):
+        ds = gdal.Open(template)
+        if ds is None:
+            raise QgsProcessingException(f"Could not open {template}: {gdal.GetLastErrorMsg()}")
+        self.scratch = scratch
+        self.width = ds.RasterXSize
+        self.height = ds.RasterYSize
+        self.geoTransform = ds.GetGeoTransform()
+        self.projection = ds.GetProjection()
+        self.rows = max(1, min(self.height, STRIP_PIXELS // self.width))
+
+    def source(self, path):
+        # (array or band, nodata, dataset) of an input
+        array = self.scratch.array(path)
+        if array is not None:
+            return array, FLOAT32_NODATA, None
+        ds = gdal.Open(path)
+        if ds is None:
+            raise QgsProcessingException(f"Could not open {path}: {gdal.GetLastErrorMsg()}")
+        band = ds.GetRasterBand(1)
+        return band, band.GetNoDataValue(), ds
+
+    def strip(self, source, row, rows):
+        if isinstance(source, numpy.ndarray):
+            return source[row:row + rows]
+        return source.ReadAsArray(0, row, self.width, rows)
+
+    def run(self, formula, inputs, output):
+        """
+        Writes formula evaluated on the inputs, a dict of names and paths,
+        to the output path.
+        """
+        sources = {name: self.source(path) for name, path in inputs.items()}
+
+        ds = None
+        if output in self.scratch.inMemory:
+            target = self.scratch.allocate(output, (self.height, self.width))
+        else:
+            ds = gdal.GetDriverByName("GTiff").Create(output, self.width, self.height, 1, gdal.GDT_Float32)
+            if ds is None:
+                raise QgsProcessingException(f"Could not create {output}: {gdal.GetLastErrorMsg()}")
+            ds.SetGeoTransform(self.geoTransform)
+            ds.SetProjection(self.projection)
+            band = ds.GetRasterBand(1)
+            band.SetNoDataValue(FLOAT32_NODATA)
+
+        for row in range(0, self.height, self.rows):
+            rows = min(self.rows, self.height - row)
+            values = {}
+            invalid = numpy.zeros((rows, self.width), bool)
+            for name, (source, nodata, handle) in sources.items():
+                values[name] = self.strip(source, row, rows)
+                if nodata is not None:
+                    invalid |= values[name] == nodata
+
+            # formulas are built by the algorithm, evaluated like gdal_calc.py
+            # does without builtins. Nodata pixels may overflow, they are
+            # overwritten
+            result = numpy.empty((rows, self.width), numpy.float32)
+            with numpy.errstate(over="ignore", invalid="ignore"):
+                result[...] = eval(formula, {"__builtins__": {}}, values)
+            result[invalid] = FLOAT32_NODATA
+
+            if ds is None:
+                target[row:row + rows] = result
+            else:
+                band.WriteArray(result, 0, row)
+
+        # files are written when closed
+        ds = None
+        return output
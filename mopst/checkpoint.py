@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+# folder of the checkpoint in the output directory, starts with a dot like
+# the other folders the Plugin keeps for itself
+CHECKPOINT_DIR = ".checkpoint"
+CHECKPOINT_FILE = "checkpoint.json"
+
+# bump when the meaning of saved stages changes
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint:
+    """
+    Progress of a run saved in its output directory, so a run which
+    crashed or was canceled can be resumed by a later run instead of
+    starting over.
+
+    A checkpoint records the stages completed so far with a JSON
+    compatible state each, e.g. the number of factors accumulated and the
+    copies of the accumulated rasters, which are kept in a new folder for
+    every save. It is saved under a key of everything the outputs depend
+    on and only loaded by a run with the same key, so a run with other
+    inputs or weights starts over.
+
+    Saves replace the checkpoint file atomically and remove the rasters
+    of the previous save afterwards, so a crash while saving leaves the
+    previous checkpoint intact.
+    """
+
+    def __init__(self, directory, dependencies, interval):
+        self.directory = os.path.join(directory, CHECKPOINT_DIR)
+        self.path = os.path.join(self.directory, CHECKPOINT_FILE)
+        self.key = hashlib.sha256(json.dumps([CHECKPOINT_VERSION, dependencies], sort_keys=True, default=str).encode()).hexdigest()
+        self.interval = interval
+        self.stages = {}
+        self.saved = time.monotonic()
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        # stages of a checkpoint saved with the same key, False if there
+        # is none
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("key") != self.key:
+            return False
+        self.stages = data.get("stages", {})
+        return True
+
+    def stage(self, name):
+        return self.stages.get(name)
+
+    def isDue(self):
+        # whether the interval has passed since the last save
+        return self.interval > 0 and time.monotonic() - self.saved >= self.interval
+
+    def folder(self):
+        # new folder for the rasters of the next save
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.directory, prefix="rasters-")
+
+    def rasterPath(self, name, state):
+        # path of a raster saved with a stage
+        return os.path.join(self.directory, state["folder"], name)
+
+    def save(self, name, state):
+        """
+        Records a completed stage. A state saved with rasters holds the
+        name of their folder, given by folder(), under the key "folder".
+        """
+        self.stages[name] = state
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"key": self.key, "stages": self.stages}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.saved = time.monotonic()
+
+        # rasters of earlier saves are not needed any more
+        used = {s["folder"] for s in self.stages.values() if "folder" in s}
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if os.path.isdir(path) and entry not in used:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def remove(self):
+        self.stages = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
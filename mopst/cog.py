@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from osgeo import gdal
+
+from qgis.core import QgsProcessingException
+
+from mopst.paths import partialPath
+
+# compression of cloud optimized GeoTIFF outputs
+COMPRESSIONS = ("DEFLATE", "ZSTD")
+
+
+def cogOptions(compression, blockSize, threads):
+    # floating point predictor for Float32 scores, overviews are built down
+    # to a single tile with average resampling
+    return [f"COMPRESS={compression}",
+            "PREDICTOR=YES",
+            f"BLOCKSIZE={blockSize}",
+            "OVERVIEWS=AUTO",
+            "RESAMPLING=AVERAGE",
+            "BIGTIFF=IF_SAFER",
+            f"NUM_THREADS={threads}",
+           ]
+
+
+def supportsCompression(compression):
+    driver = gdal.GetDriverByName("COG")
+    if driver is None:
+        return False
+    return compression in (driver.GetMetadataItem("DMD_CREATIONOPTIONLIST") or "")
+
+
+class CogWriter:
+    """
+    Writes finished rasters as cloud optimized GeoTIFFs: tiled, compressed
+    and with internal overviews, so layers display quickly at any scale.
+
+    Each file is converted on its own thread, GDAL releases the GIL while
+    compressing and building overviews. Results are written next to the
+    destination and renamed into place once complete, so a destination can
+    be converted in place.
+    """
+
+    def __init__(self, compression="DEFLATE", blockSize=512, threads=1):
+        if gdal.GetDriverByName("COG") is None:
+            raise QgsProcessingException("Cloud optimized GeoTIFF outputs need GDAL 3.1 or newer.")
+        self.compression = compression
+        self.blockSize = blockSize
+        self.threads = max(1, threads)
+        self.fileThreads = self.threads
+
+    def convert(self, source, destination, feedback):
+        # returns False if canceled
+        tmp = partialPath(destination)
+        options = gdal.TranslateOptions(format="COG",
+                                        creationOptions=cogOptions(self.compression, self.blockSize, self.fileThreads),
+                                        callback=lambda complete, message, data: 0 if feedback.isCanceled() else 1)
+        ds = gdal.Translate(tmp, source, options=options)
+        if ds is None:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if feedback.isCanceled():
+                return False
+            raise QgsProcessingException(f"Could not write cloud optimized GeoTIFF {destination}: {gdal.GetLastErrorMsg()}")
+
+        ds = None
+        os.replace(tmp, destination)
+        return True
+
+    def run(self, files, feedback):
+        """
+        Converts (source, destination) pairs of files in parallel. Returns
+        False if canceled.
+        """
+        if not files:
+            return True
+
+        # threads left over when there are fewer files than threads are
+        # used for compression within each file
+        nThreads = min(self.threads, len(files))
+        self.fileThreads = max(1, self.threads // nThreads)
+
+        done = 0
+        with ThreadPoolExecutor(nThreads) as pool:
+            futures = [pool.submit(self.convert, source, destination, feedback) for source, destination in files]
+            for future in futures:
+                if not future.result():
+                    for f in futures:
+                        f.cancel()
+                    return False
+                done += 1
+                feedback.setProgress(100 * done / len(files))
+
+        return True
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from osgeo import gdal
+
+from mopst.paths import partialPath
+from mopst.summary import OutputSummary
+
+# nodata value gdal_calc.py assigns to Float32 outputs when none is given,
+# block engine outputs carry the same value to match raster calculator ones
+FLOAT32_NODATA = 3.402823466E+38
+
+# smallest window side, GeoTIFF tile sizes must be multiples of 16
+MIN_BLOCK_SIZE = 16
+
+
+class BlockEngine:
+    """
+    Computes all pressure/opportunity outputs in one pass over the
+    rasterized landcover, block by block, instead of chaining
+    gdal:rastercalculator runs.
+
+    Work is given as operations of a ScoringPlan: each operation multiplies
+    a landcover source by a folded coefficient and writes the result to one
+    or more output files. A target is either a path or a (path, band) pair
+    for bands of multi-band outputs registered with addCube.
+
+    Rasters are streamed in square windows aligned to the template grid,
+    outputs are tiled with the same block size. Window size and GDAL block
+    cache are chosen to keep memory use within the given budget regardless
+    of the raster extent.
+
+    Outputs are written to partial files next to their destinations and
+    renamed into place once complete, so incomplete outputs are never
+    visible under their final names.
+
+    With more than one thread windows are computed on a thread pool, each
+    thread reading through its own dataset handles, while results are
+    written in window order from the calling thread. Every pixel goes
+    through the same operations, so output is identical to a serial run.
+
+    When masks are added the engine runs in sparse mode: an operation only
+    scores pixels inside one of the masks (non-zero, not nodata) with a
+    landcover score (non-zero, not nodata) in its own source, all other
+    pixels are nodata. Tiles without a pixel to score in any source, listed
+    by occupancy, are not computed nor written and take no space in the
+    outputs.
+
+    When factor rasters are added, the coefficient of an operation is a
+    tuple with one weight per factor, and the landcover is multiplied by
+    the weighted sum of the factor values of each pixel. All factors are
+    read window by window in the same pass, nodata counts as 0. Weighted
+    sums are shared by operations with the same weights.
+
+    With summarize set, statistics of every operation result are collected
+    on the computing threads while blocks are written, including sums per
+    value of the zone rasters added with addZone, and left in summaries by
+    target once the run completes.
+    """
+
+    nodata = FLOAT32_NODATA
+
+    def __init__(self, blockSize=512, memoryBudget=512 * 1024 * 1024, threads=1):
+        self.blockSize = max(MIN_BLOCK_SIZE, blockSize - blockSize % MIN_BLOCK_SIZE)
+        self.memoryBudget = memoryBudget
+        self.threads = max(1, threads)
+        self.sources = {}
+        self.operations = []
+        self.cubes = {}
+        self.masks = []
+        self.factors = []
+        self.zones = {}
+        self.occupied = None
+        self.summarize = False
+        self.summaries = {}
+
+    def addSource(self, name, path):
+        self.sources[name] = path
+
+    def addOperation(self, source, coefficient, paths):
+        self.operations.append((source, coefficient, paths))
+
+    def addCube(self, path, descriptions):
+        # multi-band output, one band per description
+        self.cubes[path] = list(descriptions)
+
+    def addMask(self, path):
+        # 0/1 raster on the template grid limiting the pixels scored
+        self.masks.append(path)
+
+    def addFactor(self, path):
+        # factor raster on the template grid, in the order of the weights
+        self.factors.append(path)
+
+    def addZone(self, name, path):
+        # integer raster on the template grid, results are summed per value
+        self.zones[name] = path
+
+    def cacheSize(self):
+        # GDAL block cache gets a quarter of the budget
+        return max(16 * 1024 * 1024, self.memoryBudget // 4)
+
+    def workspace(self):
+        # memory needed beside the windows and the block cache
+        return 0
+
+    def inFlight(self):
+        # number of windows held in memory at once
+        return 1 if self.threads == 1 else 2 * self.threads
+
+    def windowSize(self):
+        # largest divisor of the block size for which all windows in flight,
+        # each with every source, its float copy and the operation results,
+        # fit into the budget left after the block cache, so windows always
+        # nest within the tiles. Factors add their float copy and at most a
+        # weighted sum per operation. The block size is a multiple of
+        # MIN_BLOCK_SIZE, which is used when nothing larger fits
+        bytesPerPixel = 4 * (2 * len(self.sources) + 2 * len(self.factors) + len(self.masks)
+                             + len(self.operations) * (2 if self.factors else 1)) * self.inFlight()
+        available = max(0, self.memoryBudget - self.cacheSize() - self.workspace())
+        for size in range(self.blockSize, MIN_BLOCK_SIZE, -1):
+            if self.blockSize % size == 0 and size * size * bytesPerPixel <= available:
+                return size
+        return MIN_BLOCK_SIZE
+
+    def creationOptions(self):
+        options = ["TILED=YES",
+                   f"BLOCKXSIZE={self.blockSize}",
+                   f"BLOCKYSIZE={self.blockSize}",
+                   "BIGTIFF=IF_SAFER",
+                  ]
+        if self.masks:
+            # tiles never written are not allocated and read as nodata
+            options.append("SPARSE_OK=TRUE")
+        return options
+
+    def windows(self, width, height):
+        # all windows of a tile are yielded before those of the next tile,
+        # windows nest within the tiles, so the windows of tiles which are
+        # not occupied are skipped
+        size = self.windowSize()
+        for column, row in self.tileIndexes(width, height):
+            if self.occupied is None or (column, row) in self.occupied:
+                yield from self.tileWindows(column, row, width, height, size)
+
+    def tileIndexes(self, width, height):
+        # (column, row) of the tiles, row by row
+        for row in range(-(-height // self.blockSize)):
+            for column in range(-(-width // self.blockSize)):
+                yield column, row
+
+    def tileWindows(self, column, row, width, height, size):
+        # windows of one tile, size divides the block size
+        xStart = column * self.blockSize
+        yStart = row * self.blockSize
+        for yOff in range(yStart, min(yStart + self.blockSize, height), size):
+            for xOff in range(xStart, min(xStart + self.blockSize, width), size):
+                yield xOff, yOff, min(size, width - xOff), min(size, height - yOff)
+
+    def tiles(self, width, height):
+        return -(-width // self.blockSize) * -(-height // self.blockSize)
+
+    def occupancy(self):
+        """
+        Returns the (column, row) indexes of the tiles with at least one
+        pixel to score.
+
+        Only masks and sources are read, in windows of the scoring pass,
+        and a tile is left at its first window with a pixel to score.
+        """
+        datasets = {name: gdal.Open(path) for name, path in self.sources.items()}
+        datasets.update({("MASK", i): gdal.Open(path) for i, path in enumerate(self.masks)})
+        template = next(iter(datasets.values()))
+        width = template.RasterXSize
+        height = template.RasterYSize
+
+        size = self.windowSize()
+        occupied = set()
+        for column, row in self.tileIndexes(width, height):
+            for window in self.tileWindows(column, row, width, height, size):
+                if self.scoredPixels(datasets, self.read(datasets, window)).any():
+                    occupied.add((column, row))
+                    break
+        return occupied
+
+    def run(self, feedback):
+        # the block cache size is process wide, engines running at the same
+        # time must run in separate processes, as parallel.py and the batch
+        # runner do
+        cacheMax = gdal.GetCacheMax()
+        gdal.SetCacheMax(self.cacheSize())
+        try:
+            return self.process(feedback)
+        finally:
+            gdal.SetCacheMax(cacheMax)
+
+    def openSources(self):
+        # masks and factors are opened with the sources, keyed by kind and
+        # index
+        datasets = {name: gdal.Open(path) for name, path in self.sources.items()}
+        datasets.update({("MASK", i): gdal.Open(path) for i, path in enumerate(self.masks)})
+        datasets.update({("FACTOR", i): gdal.Open(path) for i, path in enumerate(self.factors)})
+        datasets.update({("ZONE", name): gdal.Open(path) for name, path in self.zones.items()})
+        return datasets
+
+    def read(self, datasets, window):
+        # zones are only read by summarize
+        xOff, yOff, xSize, ySize = window
+        return {name: ds.GetRasterBand(1).ReadAsArray(xOff, yOff, xSize, ySize)
+                for name, ds in datasets.items() if not (isinstance(name, tuple) and name[0] == "ZONE")}
+
+    def insideMasks(self, datasets, blocks):
+        # pixels inside any mask, None without masks
+        if not self.masks:
+            return None
+        return numpy.logical_or.reduce([self.hasData(datasets, blocks, ("MASK", i)) for i in range(len(self.masks))])
+
+    def scoredPixels(self, datasets, blocks):
+        # pixels inside any mask with a landcover score in at least one
+        # source, that is scored by at least one operation
+        scored = numpy.logical_or.reduce([self.hasData(datasets, blocks, name) for name in self.sources])
+        return self.insideMasks(datasets, blocks) & scored
+
+    def clearInvalid(self, datasets, blocks, results):
+        # in sparse mode, sets every result to nodata outside the masks and
+        # where the source of its operation has no landcover score
+        inside = self.insideMasks(datasets, blocks)
+        if inside is None:
+            return
+        valid = {}
+        for (source, coefficient, paths), result in zip(self.operations, results):
+            if source not in valid:
+                valid[source] = inside & self.hasData(datasets, blocks, source)
+            result[~valid[source]] = self.nodata
+
+    def hasData(self, datasets, blocks, name):
+        # pixels which are neither 0 nor nodata
+        block = blocks[name]
+        nodata = datasets[name].GetRasterBand(1).GetNoDataValue()
+        valid = block != 0
+        if nodata is not None:
+            valid &= block != nodata
+        return valid
+
+    def factorValues(self, datasets, blocks):
+        # factor windows as Float32, nodata as 0
+        values = []
+        for i in range(len(self.factors)):
+            block = blocks[("FACTOR", i)].astype(numpy.float32)
+            nodata = datasets[("FACTOR", i)].GetRasterBand(1).GetNoDataValue()
+            if nodata is not None:
+                block[blocks[("FACTOR", i)] == nodata] = 0
+            values.append(block)
+        return values
+
+    def weightedSum(self, factors, weights):
+        # sum of the factors times their weights, in factor order
+        total = numpy.zeros(factors[0].shape, numpy.float32)
+        for factor, weight in zip(factors, weights):
+            if weight:
+                total += factor * numpy.float32(weight)
+        return total
+
+    def apply(self, block, coefficient):
+        # per pixel kernel of an operation
+        return block.astype(numpy.float32, copy=False) * numpy.float32(coefficient)
+
+    def compute(self, datasets, window):
+        blocks = self.read(datasets, window)
+        if self.factors:
+            factors = self.factorValues(datasets, blocks)
+            sums = {}
+            results = []
+            for source, weights, paths in self.operations:
+                if weights not in sums:
+                    sums[weights] = self.weightedSum(factors, weights)
+                results.append(blocks[source].astype(numpy.float32) * sums[weights])
+        else:
+            results = [self.apply(blocks[source], coefficient) for source, coefficient, paths in self.operations]
+        self.clearInvalid(datasets, blocks, results)
+        return results
+
+    def evaluate(self, datasets, window):
+        # results of a window and, if collected, their statistics
+        results = self.compute(datasets, window)
+        if not self.summarize:
+            return results, None
+        return results, self.summarizeWindow(datasets, window, results)
+
+    def summarizeWindow(self, datasets, window, results):
+        xOff, yOff, xSize, ySize = window
+        zones = {}
+        for name in self.zones:
+            band = datasets[("ZONE", name)].GetRasterBand(1)
+            zones[name] = (band.ReadAsArray(xOff, yOff, xSize, ySize), band.GetNoDataValue())
+
+        summaries = []
+        for result in results:
+            valid = numpy.isfinite(result)
+            if self.nodata is not None:
+                valid &= result != self.nodata
+            summaries.append(OutputSummary.ofBlock(result[valid], {name: (zone[valid], nodata)
+                                                                   for name, (zone, nodata) in zones.items()}))
+        return summaries
+
+    def computed(self, datasets):
+        # yields windows with their results in window order
+        width = next(iter(datasets.values())).RasterXSize
+        height = next(iter(datasets.values())).RasterYSize
+
+        if self.threads == 1:
+            for window in self.windows(width, height):
+                yield window, self.evaluate(datasets, window)
+            return
+
+        local = threading.local()
+
+        def computeWindow(window):
+            # GDAL dataset handles must not be shared between threads
+            if not hasattr(local, "datasets"):
+                local.datasets = self.openSources()
+            return self.evaluate(local.datasets, window)
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            pending = deque()
+            try:
+                for window in self.windows(width, height):
+                    pending.append((window, pool.submit(computeWindow, window)))
+                    if len(pending) >= self.inFlight():
+                        window, future = pending.popleft()
+                        yield window, future.result()
+                while pending:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            finally:
+                for window, future in pending:
+                    future.cancel()
+
+    def outputPaths(self):
+        paths = []
+        for source, coefficient, targets in self.operations:
+            for target in targets:
+                path = target[0] if isinstance(target, tuple) else target
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def process(self, feedback):
+        # output datasets are closed when write returns, partial files are
+        # then renamed into place or removed
+        completed = False
+        try:
+            completed = self.write(feedback)
+        finally:
+            for path in self.outputPaths():
+                if completed:
+                    os.replace(partialPath(path), path)
+                elif os.path.exists(partialPath(path)):
+                    os.remove(partialPath(path))
+        return completed
+
+    def write(self, feedback):
+        datasets = self.openSources()
+        template = next(iter(datasets.values()))
+        width = template.RasterXSize
+        height = template.RasterYSize
+
+        driver = gdal.GetDriverByName("GTiff")
+        outputs = {}
+        targets = []
+        for source, coefficient, paths in self.operations:
+            bands = []
+            for target in paths:
+                path, index = target if isinstance(target, tuple) else (target, 1)
+                if path not in outputs:
+                    descriptions = self.cubes.get(path, [None])
+                    ds = driver.Create(partialPath(path), width, height, len(descriptions), gdal.GDT_Float32, self.creationOptions())
+                    ds.SetGeoTransform(datasets[source].GetGeoTransform())
+                    ds.SetProjection(datasets[source].GetProjection())
+                    for i, description in enumerate(descriptions):
+                        band = ds.GetRasterBand(i + 1)
+                        if self.nodata is not None:
+                            band.SetNoDataValue(self.nodata)
+                        if description is not None:
+                            band.SetDescription(description)
+                    outputs[path] = ds
+                ds = outputs[path]
+                bands.append((ds, ds.GetRasterBand(index)))
+            targets.append(bands)
+
+        total = sum(xSize * ySize for xOff, yOff, xSize, ySize in self.windows(width, height)) or 1
+        done = 0
+        statistics = [OutputSummary() for operation in self.operations]
+        results = self.computed(datasets)
+        for (xOff, yOff, xSize, ySize), (values, summaries) in results:
+            if feedback.isCanceled():
+                results.close()
+                return False
+
+            for bands, result in zip(targets, values):
+                for ds, band in bands:
+                    band.WriteArray(result, xOff, yOff)
+            if summaries is not None:
+                for statistic, summary in zip(statistics, summaries):
+                    statistic.merge(summary)
+
+            done += xSize * ySize
+            feedback.setProgress(100 * done / total)
+
+        for ds in outputs.values():
+            ds.FlushCache()
+
+        if self.summarize:
+            self.summaries = {target: statistic for statistic, (source, coefficient, paths) in zip(statistics, self.operations)
+                              for target in paths}
+        return True
+
+
+class LookupEngine(BlockEngine):
+    """
+    Maps integer class rasters to Float32 rasters through lookup tables,
+    operations are given with a lookup array indexed by class ID instead
+    of a coefficient.
+
+    Outputs have no nodata value, like rasters burnt by gdal:rasterize.
+    """
+
+    nodata = None
+
+    def apply(self, block, lookup):
+        return lookup[block]
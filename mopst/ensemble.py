@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from mopst.engine import BlockEngine
+
+DISTRIBUTIONS = ("normal", "uniform")
+
+# draws are the same for every run with the same weights
+SEED = 0
+
+# bytes per drawn value while statistics are computed: the value and the
+# copies numpy.percentile partitions
+BYTES_PER_DRAW = 24
+
+
+def drawCoefficients(weights, fileNames, scenarios, size, spread, distribution, seed, perFactor):
+    """
+    Draws perturbed factor weights and scenario multipliers and folds them
+    into coefficients per (scenario, metric), like ScoringPlan does for a
+    single set of weights.
+
+    Every weight and multiplier varies independently around its value by
+    the relative spread, with a normal distribution (spread is the
+    standard deviation) or a uniform one (spread is the half width). A
+    draw uses the same factor weights for the baseline and all scenarios.
+
+    Returns arrays of shape (factors, size) with per factor coefficients,
+    or (1, size) with their sums unless perFactor.
+    """
+    rng = numpy.random.default_rng(seed)
+
+    def perturb(value):
+        if distribution == "uniform":
+            noise = rng.uniform(-1.0, 1.0, size)
+        else:
+            noise = rng.standard_normal(size)
+        return float(value) * (1.0 + spread * noise)
+
+    factorDraws = [[perturb(w) for w in weights.factorWeights(f)] for f in fileNames]
+    coefficients = {("BASELINE", "PRESSURE"): numpy.array([pressure for pressure, opportunity in factorDraws]),
+                    ("BASELINE", "OPPORTUNITY"): numpy.array([opportunity for pressure, opportunity in factorDraws])}
+    for s in scenarios:
+        pressure = []
+        opportunity = []
+        for (pressureWeight, opportunityWeight), f in zip(factorDraws, fileNames):
+            opportunityMultiplier, pressureMultiplier = weights.scenarioMultipliers(s, f)
+            pressure.append(pressureWeight * perturb(pressureMultiplier))
+            opportunity.append(opportunityWeight * perturb(opportunityMultiplier))
+        coefficients[(s, "PRESSURE")] = numpy.array(pressure)
+        coefficients[(s, "OPPORTUNITY")] = numpy.array(opportunity)
+
+    for key, draws in coefficients.items():
+        draws = draws.reshape(len(fileNames), size)
+        if not perFactor:
+            draws = draws.sum(axis=0, keepdims=True)
+        coefficients[key] = draws.astype(numpy.float32)
+    return coefficients
+
+
+def statisticNames(percentiles):
+    # band descriptions of an ensemble raster
+    return ["mean", "std"] + [f"p{q:g}" for q in percentiles]
+
+
+class EnsembleEngine(BlockEngine):
+    """
+    Writes per pixel statistics of an ensemble of weight draws: mean,
+    standard deviation and percentiles, one band each.
+
+    Operations are given with a (draws key, statistic index) pair instead
+    of a coefficient, the draws are registered with addDraws. Without
+    factor rasters every pixel of a landcover source L takes the values
+    L * c[d] for the folded draws c, with factor rasters L * (F . c[d])
+    for the factor values F of the pixel. Statistics of F . c are computed
+    once per distinct F in a window, for 0/1 factors a handful, and scaled
+    by L, so the cost of a window barely grows with the ensemble size.
+    """
+
+    def __init__(self, blockSize=512, memoryBudget=512 * 1024 * 1024, threads=1, percentiles=(5, 50, 95)):
+        super().__init__(blockSize, memoryBudget, threads)
+        self.percentiles = tuple(percentiles)
+        self.draws = {}
+
+    def addDraws(self, key, draws):
+        self.draws[key] = draws
+
+    def workspace(self):
+        # a quarter of the budget is kept for the draws evaluated by the
+        # threads, windows get less
+        return self.memoryBudget // 4
+
+    def chunkSize(self, size):
+        # patterns of factor values whose draws are evaluated at once, so
+        # the values of all threads fit the workspace
+        return max(1, self.workspace() // (self.threads * size * BYTES_PER_DRAW))
+
+    def statistics(self, patterns, draws):
+        # mean, std, percentiles and mirrored percentiles (for negative
+        # landcover) of patterns . draws, one row per pattern
+        q = numpy.array(self.percentiles, dtype=numpy.float64)
+        rows = []
+        chunk = self.chunkSize(draws.shape[1])
+        for start in range(0, len(patterns), chunk):
+            values = patterns[start:start + chunk] @ draws
+            rows.append(numpy.column_stack([values.mean(axis=1),
+                                            values.std(axis=1),
+                                            numpy.percentile(values, q, axis=1).T,
+                                            numpy.percentile(values, 100 - q, axis=1).T]))
+        return numpy.concatenate(rows).astype(numpy.float32)
+
+    def compute(self, datasets, window):
+        blocks = self.read(datasets, window)
+        shape = blocks[next(iter(self.sources))].shape
+        if self.factors:
+            values = numpy.stack([f.ravel() for f in self.factorValues(datasets, blocks)], axis=1)
+            patterns, inverse = numpy.unique(values, axis=0, return_inverse=True)
+        else:
+            patterns = numpy.ones((1, 1), numpy.float32)
+            inverse = numpy.zeros(shape[0] * shape[1], numpy.intp)
+        inverse = inverse.reshape(shape)
+
+        n = len(self.percentiles)
+        stats = {}
+        results = []
+        for source, (key, statistic), paths in self.operations:
+            if key not in stats:
+                stats[key] = self.statistics(patterns, self.draws[key])
+            landcover = blocks[source].astype(numpy.float32)
+            if statistic == 0:
+                result = landcover * stats[key][inverse, 0]
+            elif statistic == 1:
+                result = numpy.abs(landcover) * stats[key][inverse, 1]
+            else:
+                # scaling by a negative value reverses the order of the draws
+                result = landcover * numpy.where(landcover >= 0,
+                                                 stats[key][inverse, statistic],
+                                                 stats[key][inverse, statistic + n])
+            results.append(result)
+
+        self.clearInvalid(datasets, blocks, results)
+        return results
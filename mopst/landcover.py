@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import csv
+
+import numpy
+
+from qgis.core import (NULL,
+                       QgsProcessingException,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsField,
+                       QgsFields,
+                       QgsVectorLayer,
+                       QgsWkbTypes,
+                      )
+from qgis.PyQt.QtCore import QVariant
+
+MAIN_HABIT = "Main_habit"
+HABITAT_FIELD = "Habitat_environment_type"
+CLASS_FIELD = "class_id"
+SUMMER_FIELD = "summer_score"
+WINTER_FIELD = "winter_score"
+
+# features added to the memory layer at once
+BATCH_SIZE = 10000
+
+
+def toKey(value):
+    # NULL attribute values can not be used as dictionary keys
+    return None if value is None or value == NULL else value
+
+
+def toFloat(value):
+    # same conversion as qgis:texttofloat and to_real(), None for values
+    # which are NULL or not numeric
+    value = toKey(value)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def checkFields(source, name, required):
+    names = source.fields().names()
+    missing = [f for f in required if f not in names]
+    if missing:
+        raise QgsProcessingException(f"{name} is missing field(s) {', '.join(missing)}.")
+
+
+def memoryLayer(source, name, fields):
+    # empty memory layer with the geometry type and CRS of the source
+    layer = QgsVectorLayer(QgsWkbTypes.displayString(source.wkbType()), name, "memory")
+    layer.setCrs(source.sourceCrs())
+    layer.dataProvider().addAttributes(fields)
+    layer.updateFields()
+    return layer
+
+
+class ScoreTables:
+    """
+    Hash indexes over the sensitivity and seasonality tables keyed on
+    Habitat_environment_type, replacing attribute joins of the landcover
+    layer. Like the joins the first matching row wins.
+
+    Missing key or score fields fail immediately. Duplicate table keys and
+    Main_habit values without a match are counted for the join report.
+    """
+
+    def __init__(self, sensitivity, fieldName, seasonality):
+        self.fieldName = fieldName
+        self.scores = {}
+        self.seasons = {}
+        self.duplicates = {"sensitivity": {}, "seasonality": {}}
+        self.invalid = {"sensitivity": 0, "seasonality": 0}
+        self.unmatched = {"sensitivity": {}, "seasonality": {}}
+
+        checkFields(sensitivity, "Landcover sensitivity table", [HABITAT_FIELD, fieldName])
+        checkFields(seasonality, "Seasonality score table", [HABITAT_FIELD, "Summer", "Winter"])
+
+        for f in sensitivity.getFeatures():
+            self.index(self.scores, "sensitivity", toKey(f[HABITAT_FIELD]), [f[fieldName]])
+
+        for f in seasonality.getFeatures():
+            self.index(self.seasons, "seasonality", toKey(f[HABITAT_FIELD]), [f["Summer"], f["Winter"]])
+
+        if not self.scores:
+            raise QgsProcessingException("Landcover sensitivity table has no rows.")
+        if not self.seasons:
+            raise QgsProcessingException("Seasonality score table has no rows.")
+
+    def index(self, table, name, key, raw):
+        # stores the row's values converted to float under its key
+        if key in table:
+            self.duplicates[name][key] = self.duplicates[name].get(key, 1) + 1
+            return
+
+        values = tuple(toFloat(v) for v in raw)
+        if any(v is None and toKey(r) is not None for v, r in zip(values, raw)):
+            self.invalid[name] += 1
+        table[key] = values
+
+    def lookup(self, key, count=1):
+        """
+        Returns (score, summer score, winter score) for a Main_habit value,
+        None for missing scores. Values without a match are counted.
+        """
+        if key not in self.scores:
+            self.unmatched["sensitivity"][key] = self.unmatched["sensitivity"].get(key, 0) + count
+        if key not in self.seasons:
+            self.unmatched["seasonality"][key] = self.unmatched["seasonality"].get(key, 0) + count
+
+        score = self.scores.get(key, (None,))[0]
+        if score is None:
+            return None, None, None
+
+        summer, winter = self.seasons.get(key, (None, None))
+        return (score,
+                None if summer is None else score * summer,
+                None if winter is None else score * winter)
+
+    def scoredLayer(self, source, feedback):
+        """
+        Copies landcover geometries to a memory layer with the sensitivity
+        score, summer score and winter score attached in a single pass.
+        """
+        fields = QgsFields()
+        fields.append(QgsField(self.fieldName, QVariant.Double))
+        fields.append(QgsField(SUMMER_FIELD, QVariant.Double))
+        fields.append(QgsField(WINTER_FIELD, QVariant.Double))
+        checkFields(source, "Landcover layer", [MAIN_HABIT])
+        layer = memoryLayer(source, "landcover_scores", fields)
+        provider = layer.dataProvider()
+
+        request = QgsFeatureRequest().setSubsetOfAttributes([MAIN_HABIT], source.fields())
+        batch = []
+        for f in source.getFeatures(request):
+            if feedback.isCanceled():
+                return None
+
+            feature = QgsFeature(fields)
+            feature.setGeometry(f.geometry())
+            feature.setAttributes([NULL if v is None else v for v in self.lookup(toKey(f[MAIN_HABIT]))])
+            batch.append(feature)
+            if len(batch) == BATCH_SIZE:
+                provider.addFeatures(batch)
+                batch = []
+        provider.addFeatures(batch)
+
+        return layer
+
+    def report(self, feedback):
+        for name in ("sensitivity", "seasonality"):
+            for key, count in sorted(self.duplicates[name].items(), key=lambda i: str(i[0])):
+                feedback.pushWarning(f"Habitat_environment_type '{key}' is listed {count} times in the {name} table, the first row is used.")
+            if self.invalid[name]:
+                feedback.pushWarning(f"{self.invalid[name]} row(s) of the {name} table have non-numeric scores.")
+            for key, count in sorted(self.unmatched[name].items(), key=lambda i: str(i[0])):
+                feedback.pushWarning(f"Main_habit '{key}' of {count} landcover feature(s) is not listed in the {name} table.")
+
+        unmatched = sum(sum(u.values()) for u in self.unmatched.values())
+        duplicates = sum(len(d) for d in self.duplicates.values())
+        feedback.pushInfo(f"Join report: {duplicates} duplicate table keys, {unmatched} unmatched landcover features.")
+
+
+class LandcoverClasses:
+    """
+    Numbers the distinct Main_habit values of the landcover layer, so the
+    landcover can be rasterized once as class IDs and any score raster
+    derived from it through a lookup table indexed by class ID.
+
+    Class ID 0 is left for pixels not covered by any landcover polygon.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.counts = {}
+
+    def classLayer(self, source, feedback):
+        # memory layer with the landcover geometries and their class ID only
+        fields = QgsFields()
+        fields.append(QgsField(CLASS_FIELD, QVariant.Int))
+        checkFields(source, "Landcover layer", [MAIN_HABIT])
+        layer = memoryLayer(source, "landcover_classes", fields)
+        provider = layer.dataProvider()
+
+        request = QgsFeatureRequest().setSubsetOfAttributes([MAIN_HABIT], source.fields())
+        batch = []
+        for f in source.getFeatures(request):
+            if feedback.isCanceled():
+                return None
+
+            value = toKey(f[MAIN_HABIT])
+            classId = self.ids.setdefault(value, len(self.ids) + 1)
+            self.counts[value] = self.counts.get(value, 0) + 1
+            feature = QgsFeature(fields)
+            feature.setGeometry(f.geometry())
+            feature.setAttributes([classId])
+            batch.append(feature)
+            if len(batch) == BATCH_SIZE:
+                provider.addFeatures(batch)
+                batch = []
+        provider.addFeatures(batch)
+
+        return layer
+
+    def dataType(self):
+        # gdal:rasterize data type, UInt16 unless there are too many classes
+        return 2 if len(self.ids) < 65535 else 3
+
+    def lookupTables(self, tables):
+        """
+        Returns base, summer and winter score lookup tables indexed by class
+        ID from the ScoreTables, classes without a score burn as 0.
+        """
+        lookup = {name: numpy.zeros(len(self.ids) + 1, numpy.float32) for name in ("BASE", "SUMMER", "WINTER")}
+        for value, classId in self.ids.items():
+            scores = tables.lookup(value, self.counts[value])
+            for name, score in zip(("BASE", "SUMMER", "WINTER"), scores):
+                if score is not None:
+                    lookup[name][classId] = score
+
+        return lookup
+
+    def writeTable(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([CLASS_FIELD, MAIN_HABIT])
+            for value, classId in self.ids.items():
+                writer.writerow([classId, "" if value is None else value])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import tempfile
+
+MANIFEST_FILE = "manifest.json"
+
+# bump when the meaning of recorded dependencies changes
+MANIFEST_VERSION = 1
+
+
+class RunManifest:
+    """
+    Records, for every file written to the output directory, the inputs and
+    weights it was calculated from. A later run into the same directory
+    compares its own dependencies with the recorded ones and only
+    recomputes the outputs which are missing or out of date.
+
+    Dependencies are plain JSON-compatible values, e.g. a digest of the
+    landcover inputs and the weight and multiplier rows for an output.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.outputs = {}
+        self.digests = {}
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.outputs = data.get("outputs", {})
+                self.digests = data.get("digests", {})
+        except (OSError, ValueError):
+            pass
+
+    def name(self, path):
+        return os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+    def normalize(self, dependencies):
+        # compare values the way they are stored, e.g. tuples as lists
+        return json.loads(json.dumps(dependencies, sort_keys=True, default=str))
+
+    def isCurrent(self, path, dependencies):
+        entry = self.outputs.get(self.name(path))
+        return (entry is not None
+                and os.path.isfile(path)
+                and entry == self.normalize(dependencies))
+
+    def record(self, path, dependencies):
+        self.outputs[self.name(path)] = self.normalize(dependencies)
+
+    def forget(self, path):
+        self.outputs.pop(self.name(path), None)
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION,
+                "outputs": self.outputs,
+                "digests": self.digests,
+               }
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+
+from mopst.engine import BlockEngine
+
+# how often worker progress is merged back into the feedback, in seconds
+POLL_INTERVAL = 0.2
+
+# shared state of the worker processes, set by the pool initializer
+_progress = None
+_canceled = None
+
+
+class WorkerFeedback:
+    """
+    Minimal feedback for engines running in a worker process, progress
+    and cancellation are exchanged with the main process through shared
+    memory.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def isCanceled(self):
+        return _canceled.is_set()
+
+    def setProgress(self, progress):
+        _progress[self.index] = progress
+
+
+def processContext():
+    # spawn avoids forking the QGIS process with its threads. Inside QGIS
+    # sys.executable is the QGIS binary, so point workers to the bundled
+    # Python interpreter instead
+    ctx = multiprocessing.get_context("spawn")
+    if os.path.basename(sys.executable).lower().startswith("qgis"):
+        if sys.platform == "win32":
+            executable = os.path.join(sys.exec_prefix, "pythonw.exe")
+        else:
+            executable = os.path.join(sys.exec_prefix, "bin", "python3")
+        if os.path.exists(executable):
+            ctx.set_executable(executable)
+    return ctx
+
+
+def _initWorker(progress, canceled):
+    global _progress, _canceled
+    _progress = progress
+    _canceled = canceled
+
+
+def _runEngine(index, blockSize, memoryBudget, threads, sources, operations, cubes, masks, factors, occupied,
+               zones, summarize):
+    engine = BlockEngine(blockSize, memoryBudget, threads)
+    for name, path in sources.items():
+        engine.addSource(name, path)
+    for source, coefficient, paths in operations:
+        engine.addOperation(source, coefficient, paths)
+    for path, descriptions in cubes.items():
+        engine.addCube(path, descriptions)
+    for path in masks:
+        engine.addMask(path)
+    for path in factors:
+        engine.addFactor(path)
+    for name, path in zones.items():
+        engine.addZone(name, path)
+    engine.occupied = occupied
+    engine.summarize = summarize
+    completed = engine.run(WorkerFeedback(index))
+    return completed, engine.summaries
+
+
+def runEngines(engines, feedback):
+    """
+    Runs block engines concurrently, one per worker process, merging their
+    progress and forwarding cancellation. Statistics collected by the
+    workers are set on the engines. Returns False if canceled.
+    """
+    ctx = processContext()
+    progress = ctx.Array("d", len(engines))
+    canceled = ctx.Event()
+
+    with ProcessPoolExecutor(len(engines), ctx, _initWorker, (progress, canceled)) as pool:
+        futures = [pool.submit(_runEngine, i, e.blockSize, e.memoryBudget, e.threads, e.sources, e.operations, e.cubes,
+                               e.masks, e.factors, e.occupied, e.zones, e.summarize)
+                   for i, e in enumerate(engines)]
+
+        pending = futures
+        while pending:
+            done, pending = wait(pending, POLL_INTERVAL, FIRST_EXCEPTION)
+            feedback.setProgress(sum(progress[:]) / len(engines))
+            if feedback.isCanceled():
+                canceled.set()
+            for f in done:
+                # stop other workers and re-raise the error in the main process
+                if f.exception() is not None:
+                    canceled.set()
+                    raise f.exception()
+
+    completed = not canceled.is_set()
+    for engine, f in zip(engines, futures):
+        done, engine.summaries = f.result()
+        completed = completed and done
+    return completed
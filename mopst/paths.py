@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+
+def partialPath(path):
+    # hidden file next to the destination, renamed to it once complete
+    head, tail = os.path.split(path)
+    return os.path.join(head, f".{tail}.partial.tif")
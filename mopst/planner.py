@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+SEASONS = ("SUMMER", "WINTER")
+METRICS = ("PRESSURE", "OPPORTUNITY")
+
+
+class ScoringPlan:
+    """
+    Folds the per-factor weight and multiplier steps into a minimal set of
+    raster operations.
+
+    Every output is linear in the seasonal landcover raster, so
+    sum(landcover * weight[f] * multiplier[f]) is the same as
+    landcover * sum(weight[f] * multiplier[f]). Terms are given per
+    (scenario, metric) as sequences of constants to multiply, the plan folds
+    each into a single coefficient and shares one raster operation between
+    all outputs with the same season and coefficient.
+
+    When factors are scored by their raster values, an output is
+    landcover * sum(factor[f] * weight[f] * multiplier[f]) instead. Each
+    term is then folded on its own and the coefficient is the tuple of
+    per factor weights, one entry per factor raster.
+    """
+
+    def __init__(self, terms, factorCount, perFactor=False):
+        self.terms = terms
+        self.factorCount = factorCount
+        self.perFactor = perFactor
+        self.coefficients = {}
+        self.operations = []
+
+        self.fold()
+        self.eliminate()
+
+    def fold(self):
+        for key, termList in self.terms.items():
+            values = []
+            for term in termList:
+                value = 1.0
+                for m in term:
+                    value *= float(m)
+                values.append(value)
+            if self.perFactor:
+                self.coefficients[key] = tuple(values)
+            else:
+                coefficient = 0.0
+                for value in values:
+                    coefficient += value
+                self.coefficients[key] = coefficient
+
+    def eliminate(self):
+        # one operation per unique (season, coefficient), targets are
+        # (scenario, output key) pairs which share its result
+        index = {}
+        for season in SEASONS:
+            for (scenario, metric), coefficient in self.coefficients.items():
+                opKey = (season, coefficient)
+                if opKey not in index:
+                    index[opKey] = len(self.operations)
+                    self.operations.append((season, coefficient, []))
+                self.operations[index[opKey]][2].append((scenario, f"{metric}_{season}"))
+
+    def restrict(self, targets):
+        # keep only operations writing any of the given (scenario, key)
+        # targets, e.g. outputs which are out of date
+        operations = []
+        for season, coefficient, opTargets in self.operations:
+            kept = [t for t in opTargets if t in targets]
+            if kept:
+                operations.append((season, coefficient, kept))
+        self.operations = operations
+
+    def chainPasses(self):
+        # number of raster calculator runs the unfolded chain performs
+        scenarioCount = len(self.coefficients) // len(METRICS) - 1
+        factorSteps = 4 + 8 * (self.factorCount - 1)
+        return factorSteps + factorSteps * scenarioCount
+
+    def describe(self):
+        lines = ["MOPST scoring plan",
+                 "",
+                 f"Factors: {self.factorCount}",
+                 f"Outputs: {len(self.coefficients) * len(SEASONS)}",
+                 f"Raster calculator chain passes: {self.chainPasses()}",
+                 f"Planned raster passes: {len(self.operations)}",
+                 "",
+                 "Folded coefficients:",
+                ]
+        for (scenario, metric), coefficient in self.coefficients.items():
+            if self.perFactor:
+                terms = " + ".join(f"factor{i + 1}*" + "*".join(str(m) for m in term)
+                                   for i, term in enumerate(self.terms[(scenario, metric)]))
+            else:
+                terms = " + ".join("*".join(str(m) for m in term) for term in self.terms[(scenario, metric)])
+            lines.append(f"  {scenario} {metric.lower()} = {terms or 0} = {coefficient!r}")
+
+        lines.append("")
+        lines.append("Raster operations:")
+        for i, (season, coefficient, targets) in enumerate(self.operations):
+            outputs = ", ".join(f"{scenario}/{key.lower().replace('_', '-')}" for scenario, key in targets)
+            if self.perFactor:
+                lines.append(f"  {i + 1}. {season.lower()} landcover * factors . {coefficient!r} -> {outputs}")
+            else:
+                lines.append(f"  {i + 1}. {season.lower()} landcover * {coefficient!r} -> {outputs}")
+
+        return "\n".join(lines) + "\n"
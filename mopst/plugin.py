@@ -4,21 +4,23 @@ import os
 
 from qgis.core import QgsApplication
 
-from mopst.provider import MopstProvider
-
 pluginPath = os.path.dirname(__file__)
 
 
 class MopstPlugin:
 
     def __init__(self):
-        self.provider = MopstProvider()
+        self.provider = None
 
     def initProcessing(self):
+        from mopst.provider import MopstProvider
+
+        self.provider = MopstProvider()
         QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
         self.initProcessing()
 
     def unload(self):
-        QgsApplication.processingRegistry().removeProvider(self.provider)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
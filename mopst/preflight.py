@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from qgis.core import QgsRasterLayer
+
+# fraction of a pixel by which extents and resolutions may differ
+TOLERANCE = 0.01
+
+
+def gridProblems(name, layer, template):
+    """
+    Returns why a raster can not be combined pixel by pixel with the
+    template raster: a different CRS, extent or resolution.
+    """
+    problems = []
+    if not layer.crs().isValid():
+        problems.append(f"{name} has no coordinate system.")
+    elif layer.crs() != template.crs():
+        problems.append(f"{name} is in {layer.crs().authid() or 'an unknown CRS'}, "
+                        f"not {template.crs().authid() or 'the CRS of the pressure raster'}.")
+
+    pixelX = template.rasterUnitsPerPixelX()
+    pixelY = template.rasterUnitsPerPixelY()
+    if (abs(layer.rasterUnitsPerPixelX() - pixelX) > pixelX * TOLERANCE
+            or abs(layer.rasterUnitsPerPixelY() - pixelY) > pixelY * TOLERANCE):
+        problems.append(f"{name} has a resolution of {layer.rasterUnitsPerPixelX():g} x {layer.rasterUnitsPerPixelY():g}, "
+                        f"not {pixelX:g} x {pixelY:g}.")
+
+    extent = layer.extent()
+    expected = template.extent()
+    if (abs(extent.xMinimum() - expected.xMinimum()) > pixelX * TOLERANCE
+            or abs(extent.xMaximum() - expected.xMaximum()) > pixelX * TOLERANCE
+            or abs(extent.yMinimum() - expected.yMinimum()) > pixelY * TOLERANCE
+            or abs(extent.yMaximum() - expected.yMaximum()) > pixelY * TOLERANCE):
+        problems.append(f"{name} has the extent {extent.toString(3)}, not {expected.toString(3)}.")
+
+    return problems
+
+
+def inputProblems(template, opportunity, factorFiles, weights, misaligned=None):
+    """
+    Checks the factor rasters, the weights and the alignment of all rasters
+    with the pressure raster before any raster is processed. Returns a list
+    of problems, empty if the inputs are fine.
+
+    When a misaligned list is given, the paths of rasters with a known CRS
+    but not on the pressure raster grid are added to it instead of being
+    reported as problems, so they can be aligned.
+    """
+    problems = list(weights.problems)
+
+    fileNames = [os.path.split(f)[1] for f in factorFiles]
+    repeated = sorted({f for f in fileNames if fileNames.count(f) > 1})
+    if repeated:
+        problems.append(f"Factor file names are used more than once: {', '.join(repeated)}.")
+    problems.extend(weights.missing(fileNames))
+
+    def checkGrid(name, path, layer):
+        grid = gridProblems(name, layer, template)
+        if misaligned is None or not layer.crs().isValid():
+            problems.extend(grid)
+        elif grid:
+            misaligned.append(path)
+
+    if opportunity is not None:
+        checkGrid("Opportunity raster", opportunity.source(), opportunity)
+
+    for path, fileName in zip(factorFiles, fileNames):
+        if not os.path.isfile(path):
+            problems.append(f"Factor file {path} does not exist.")
+            continue
+        layer = QgsRasterLayer(path, fileName, "gdal")
+        if not layer.isValid():
+            problems.append(f"Factor file {path} is not a readable raster.")
+            continue
+        checkGrid(f"Factor file {fileName}", path, layer)
+
+    return problems
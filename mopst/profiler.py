@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# fields of /proc/self/io giving the bytes read and written
+IO_COUNTERS = ("rchar", "wchar")
+
+
+def ioCounters():
+    # bytes read and written by this process and its finished child
+    # processes, Linux only. Counted when files are read or written, unlike
+    # storage counters which lag behind with the page cache
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return tuple(int(counters[name]) for name in IO_COUNTERS)
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def sample():
+    values = {"wall": time.perf_counter(), "cpu": time.process_time()}
+    values["read"], values["written"] = ioCounters()
+    if resource is not None:
+        # ru_maxrss is in kilobytes, except on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        values["childCpu"] = children.ru_utime + children.ru_stime
+        values["peakRss"] = own.ru_maxrss * scale
+        values["childPeakRss"] = children.ru_maxrss * scale
+    return values
+
+
+def difference(after, before, name):
+    if after.get(name) is None or before.get(name) is None:
+        return None
+    return after[name] - before[name]
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, growth of the peak resident memory and
+    bytes read and written for every stage of a run.
+
+    CPU time includes child processes, e.g. GDAL utilities started by
+    processing algorithms. Memory and child process figures are missing on
+    Windows, I/O counters are only available on Linux.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.start = sample()
+
+    @contextmanager
+    def stage(self, name, width=None, height=None):
+        before = sample()
+        try:
+            yield
+        finally:
+            after = sample()
+            cpu = after["cpu"] - before["cpu"]
+            childCpu = difference(after, before, "childCpu")
+            self.stages.append({"stage": name,
+                                "wallTime": after["wall"] - before["wall"],
+                                "cpuTime": cpu + (childCpu or 0),
+                                "peakRssDelta": difference(after, before, "peakRss"),
+                                "childPeakRss": after.get("childPeakRss"),
+                                "bytesRead": difference(after, before, "read"),
+                                "bytesWritten": difference(after, before, "written"),
+                                "width": width,
+                                "height": height,
+                               })
+
+    def write(self, path):
+        end = sample()
+        data = {"wallTime": end["wall"] - self.start["wall"],
+                "cpuTime": end["cpu"] - self.start["cpu"] + (difference(end, self.start, "childCpu") or 0),
+                "peakRss": end.get("peakRss"),
+                "bytesRead": difference(end, self.start, "read"),
+                "bytesWritten": difference(end, self.start, "written"),
+                "ioCounters": list(IO_COUNTERS),
+                "stages": self.stages,
+               }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+    def summary(self, feedback):
+        # totals per stage name, slowest first
+        totals = {}
+        for s in self.stages:
+            total = totals.setdefault(s["stage"], {"count": 0, "wallTime": 0, "cpuTime": 0, "bytesWritten": 0})
+            total["count"] += 1
+            total["wallTime"] += s["wallTime"]
+            total["cpuTime"] += s["cpuTime"]
+            total["bytesWritten"] += s["bytesWritten"] or 0
+
+        feedback.pushInfo(f"{'Stage':<40} {'Runs':>5} {'Wall (s)':>10} {'CPU (s)':>10} {'Written (MB)':>13}")
+        for name, t in sorted(totals.items(), key=lambda i: i[1]["wallTime"], reverse=True):
+            feedback.pushInfo(f"{name:<40} {t['count']:>5} {t['wallTime']:>10.2f} {t['cpuTime']:>10.2f} "
+                              f"{t['bytesWritten'] / 1024 ** 2:>13.1f}")
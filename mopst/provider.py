@@ -7,8 +7,6 @@ from qgis.PyQt.QtCore import QCoreApplication
 
 from qgis.core import QgsProcessingProvider
 
-from mopst.algorithm import MopstAlgorithm
-
 pluginPath = os.path.dirname(__file__)
 
 
@@ -34,6 +32,8 @@ class MopstProvider(QgsProcessingProvider):
         pass
 
     def getAlgs(self):
+        from mopst.algorithm import MopstAlgorithm
+
         algs = [MopstAlgorithm(),
                ]
 
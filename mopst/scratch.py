@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from qgis.core import QgsProcessingException
+
+
+class ScratchSpace:
+    """
+    Run scoped folder for intermediate rasters.
+
+    Every file handed out by path() starts with one reference, held by the
+    step creating it. Further references are taken with retain() and given
+    up with release(), the file is deleted as soon as its last reference is
+    released. Paths not handed out by path(), e.g. final outputs, are
+    ignored.
+
+    With a budget, handing out a new file fails once the files in use plus
+    one more raster of the given size would exceed it.
+
+    Paths handed out with inMemory set may instead hold a Float32 array
+    given by allocate(), kept in memory while the arrays fit the memory
+    budget and otherwise memory-mapped to the file at the path. Arrays are
+    dropped with their last reference like files.
+    """
+
+    def __init__(self, directory, budget=0, rasterSize=0, memoryBudget=0):
+        self.directory = tempfile.mkdtemp(dir=directory, prefix="mopst-")
+        self.budget = budget
+        self.rasterSize = rasterSize
+        self.memoryBudget = memoryBudget
+        self.refs = {}
+        self.count = 0
+        self.peak = 0
+        self.inMemory = set()
+        self.arrays = {}
+        self.memoryUsed = 0
+        self.memoryPeak = 0
+        self.mapped = 0
+
+    def usage(self):
+        return sum(os.path.getsize(p) for p in self.refs if os.path.exists(p))
+
+    def update(self):
+        usage = self.usage()
+        self.peak = max(self.peak, usage)
+        return usage
+
+    def reserve(self, rasters):
+        # fail before any raster work if the plan can not fit the budget
+        needed = rasters * self.rasterSize
+        if self.budget and needed > self.budget:
+            raise QgsProcessingException(f"Intermediate rasters need up to {needed / 1024 ** 2:.0f} MB of scratch space, "
+                                         f"more than the scratch budget of {self.budget / 1024 ** 2:.0f} MB.")
+
+    def path(self, suffix=".tif", inMemory=False):
+        # in memory paths are checked when their array is allocated
+        usage = self.update()
+        if not inMemory and self.budget and usage + self.rasterSize > self.budget:
+            raise QgsProcessingException(f"Scratch space in {self.directory} is using {usage / 1024 ** 2:.0f} MB, "
+                                         f"another intermediate raster would exceed the scratch budget "
+                                         f"of {self.budget / 1024 ** 2:.0f} MB.")
+
+        self.count += 1
+        path = os.path.join(self.directory, f"{self.count}{suffix}")
+        self.refs[path] = 1
+        if inMemory:
+            self.inMemory.add(path)
+        return path
+
+    def allocate(self, path, shape):
+        """
+        Returns the array holding the raster of an in memory path, in
+        memory if it fits the memory budget, else mapped to its file.
+        """
+        import numpy
+
+        size = 4 * shape[0] * shape[1]
+        if self.memoryUsed + size <= self.memoryBudget:
+            array = numpy.empty(shape, numpy.float32)
+            self.memoryUsed += size
+            self.memoryPeak = max(self.memoryPeak, self.memoryUsed)
+        else:
+            usage = self.update()
+            if self.budget and usage + size > self.budget:
+                raise QgsProcessingException(f"Scratch space in {self.directory} is using {usage / 1024 ** 2:.0f} MB, "
+                                             f"another intermediate raster would exceed the scratch budget "
+                                             f"of {self.budget / 1024 ** 2:.0f} MB.")
+            array = numpy.memmap(path, numpy.float32, "w+", shape=shape)
+            self.mapped += 1
+            self.inMemory.discard(path)
+        self.arrays[path] = array
+        return array
+
+    def array(self, path):
+        # array of an in memory path, None for rasters in files
+        return self.arrays.get(path)
+
+    def retain(self, path):
+        if path in self.refs:
+            self.refs[path] += 1
+
+    def release(self, path):
+        if path not in self.refs:
+            return
+
+        self.refs[path] -= 1
+        if self.refs[path] == 0:
+            self.update()
+            del self.refs[path]
+            array = self.arrays.pop(path, None)
+            if path in self.inMemory and array is not None:
+                self.memoryUsed -= array.nbytes
+            self.inMemory.discard(path)
+            del array
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # still mapped on Windows, removed with the folder
+                    pass
+
+    def report(self, feedback):
+        self.update()
+        feedback.pushInfo(f"Peak scratch space used by {self.count} intermediate rasters: {self.peak / 1024 ** 2:.1f} MB.")
+        if self.memoryPeak or self.mapped:
+            feedback.pushInfo(f"Peak memory used by intermediate rasters: {self.memoryPeak / 1024 ** 2:.1f} MB, "
+                              f"{self.mapped} memory-mapped.")
+
+    def cleanup(self):
+        self.refs = {}
+        self.arrays = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
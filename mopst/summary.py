@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import json
+import math
+
+import numpy
+
+SUMMARY_FILE = "summary.json"
+SUMMARY_TABLE = "summary.csv"
+
+# most bins of a histogram
+HISTOGRAM_BINS = 64
+
+
+class Histogram:
+    """
+    Histogram with equal bins of a power of two width, anchored at 0, built
+    from values streamed in blocks. The width doubles, merging pairs of
+    bins, whenever the values seen so far span more than the given number
+    of bins, so histograms of different blocks can always be merged
+    exactly.
+    """
+
+    def __init__(self, bins=HISTOGRAM_BINS):
+        self.bins = bins
+        self.width = None
+        self.counts = {}
+
+    def add(self, values):
+        if not len(values):
+            return
+        lo = float(values.min())
+        hi = float(values.max())
+        if hi > lo:
+            width = 2.0 ** math.ceil(math.log2((hi - lo) / self.bins))
+        elif lo:
+            width = 2.0 ** math.floor(math.log2(abs(lo)))
+        else:
+            width = 1.0
+        if self.width is not None:
+            width = max(width, self.width)
+
+        keys, counts = numpy.unique(numpy.floor(values / width).astype(numpy.int64), return_counts=True)
+        self.merge(width, dict(zip(keys.tolist(), counts.tolist())))
+
+    def merge(self, width, counts):
+        # add the counts of bins of the given width
+        if self.width is None:
+            self.width = width
+        while self.width < width:
+            self.double()
+        while width < self.width:
+            counts = self.halve(counts)
+            width *= 2
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        while self.counts and max(self.counts) - min(self.counts) + 1 > self.bins:
+            self.double()
+
+    def halve(self, counts):
+        # counts of the same values in bins twice as wide
+        merged = {}
+        for key, count in counts.items():
+            merged[key // 2] = merged.get(key // 2, 0) + count
+        return merged
+
+    def double(self):
+        self.counts = self.halve(self.counts)
+        self.width *= 2
+
+    def rows(self):
+        # (lower bound, upper bound, count) of every bin in the range
+        if not self.counts:
+            return []
+        return [(key * self.width, (key + 1) * self.width, self.counts.get(key, 0))
+                for key in range(min(self.counts), max(self.counts) + 1)]
+
+
+class OutputSummary:
+    """
+    Streaming statistics of one output raster: pixel count, minimum,
+    maximum, mean and standard deviation, a histogram and the pixel count
+    and sum per value of zone rasters, such as landcover classes or the
+    pressure and opportunity areas. Summaries of blocks are merged with
+    the parallel variance formula of Chan et al.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = Histogram()
+        self.zones = {}
+
+    @classmethod
+    def ofBlock(cls, values, zones):
+        # values are the valid pixels of a block, zones maps zone names to
+        # their values at the same pixels and their nodata value
+        summary = cls()
+        summary.count = len(values)
+        if not summary.count:
+            return summary
+
+        values = values.astype(numpy.float64)
+        summary.mean = float(values.mean())
+        summary.m2 = float(((values - summary.mean) ** 2).sum())
+        summary.min = float(values.min())
+        summary.max = float(values.max())
+        summary.histogram.add(values)
+
+        for name, (zone, nodata) in zones.items():
+            inZone = values
+            if nodata is not None:
+                inZone = values[zone != nodata]
+                zone = zone[zone != nodata]
+            keys, inverse = numpy.unique(zone, return_inverse=True)
+            inverse = inverse.ravel()
+            counts = numpy.bincount(inverse, minlength=len(keys))
+            sums = numpy.bincount(inverse, weights=inZone, minlength=len(keys))
+            summary.zones[name] = {k: [c, s] for k, c, s in zip(keys.tolist(), counts.tolist(), sums.tolist())}
+
+        return summary
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.histogram.merge(other.histogram.width, other.histogram.counts)
+        for name, values in other.zones.items():
+            zone = self.zones.setdefault(name, {})
+            for key, (c, s) in values.items():
+                total = zone.setdefault(key, [0, 0.0])
+                total[0] += c
+                total[1] += s
+
+    def toDict(self, labels):
+        # JSON compatible summary, zone values named with the labels given
+        # per zone
+        zones = {}
+        for name, values in sorted(self.zones.items()):
+            zones[name] = [{"value": key,
+                            "name": labels.get(name, {}).get(key),
+                            "pixels": c,
+                            "sum": s,
+                            "mean": s / c if c else None}
+                           for key, (c, s) in sorted(values.items())]
+        return {"pixels": self.count,
+                "min": self.min,
+                "max": self.max,
+                "mean": self.mean if self.count else None,
+                "std": math.sqrt(self.m2 / self.count) if self.count else None,
+                "sum": self.mean * self.count,
+                "histogram": {"binWidth": self.histogram.width,
+                              "bins": [list(r) for r in self.histogram.rows()]},
+                "zones": zones,
+               }
+
+
+class RunSummary:
+    """
+    Summary statistics of the outputs in an output directory, written to
+    summary.json and as a table to summary.csv. Outputs reused from a
+    previous run keep their earlier statistics.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, SUMMARY_FILE)
+        self.outputs = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.outputs = json.load(f).get("outputs", {})
+        except (OSError, ValueError):
+            pass
+
+    def update(self, name, summary, labels):
+        self.outputs[name] = summary.toDict(labels)
+
+    def restrict(self, names):
+        # drop outputs which no longer exist
+        self.outputs = {name: self.outputs[name] for name in names if name in self.outputs}
+
+    def write(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"outputs": self.outputs}, f, indent=2)
+
+        with open(os.path.join(self.directory, SUMMARY_TABLE), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["output", "zone", "value", "name", "pixels", "sum", "mean", "min", "max", "std"])
+            for name, s in self.outputs.items():
+                writer.writerow([name, "", "", "", s["pixels"], s["sum"], s["mean"], s["min"], s["max"], s["std"]])
+                for zone, rows in s["zones"].items():
+                    for r in rows:
+                        writer.writerow([name, zone, r["value"], r["name"] or "", r["pixels"], r["sum"], r["mean"], "", "", ""])
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import csv
+
+from qgis.core import QgsProcessingException
+
+# columns of the factor and scenario weights CSV files, see
+# input-file-specification.md
+FACTOR_WEIGHTS_COLUMNS = ("factor-file", "pressure-weight", "opportunity-weight")
+SCENARIO_WEIGHTS_COLUMNS = ("scenario", "factor-file", "opportunity-multiplier", "pressure-multiplier")
+
+
+def readTable(path, columns, name):
+    """
+    Reads the given columns of a weights CSV file, returns the rows
+    flattened into a list of strings like the values of a matrix
+    parameter. Values are converted to numbers by WeightModel, which
+    reports every one that is not a number.
+    """
+    values = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fields = [c.strip().lower() for c in reader.fieldnames or []]
+        missing = [c for c in columns if c not in fields]
+        if missing:
+            raise QgsProcessingException(f"{name} {path} is missing column(s) {', '.join(missing)}.")
+
+        for row in reader:
+            row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k is not None}
+            if not any(row.values()):
+                continue
+            values.extend(row[c] for c in columns)
+
+    return values
+
+
+def readFactorWeights(path):
+    return readTable(path, FACTOR_WEIGHTS_COLUMNS, "Factor weights file")
+
+
+def readScenarioWeights(path):
+    return readTable(path, SCENARIO_WEIGHTS_COLUMNS, "Scenario weights file")
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class WeightModel:
+    """
+    Factor weights indexed by factor file name and scenario multipliers
+    indexed by (scenario, factor file name), built once from the flattened
+    rows of the weights matrices or CSV files.
+
+    Incomplete rows, values which are not numbers and rows which repeat an
+    earlier key are collected in problems instead of raising, so all of
+    them can be reported together. The first of repeated rows is used.
+    """
+
+    def __init__(self, factorTable, scenarioTable):
+        self.factors = {}
+        self.multipliers = {}
+        self.scenarios = []
+        self.problems = []
+
+        for row in self.rows(factorTable, FACTOR_WEIGHTS_COLUMNS, 1, "Factor weights"):
+            values = self.values(row, FACTOR_WEIGHTS_COLUMNS, 1, "Factor weights", f"factor file {row[0]}")
+            if values is None:
+                continue
+            if row[0] in self.factors:
+                self.problems.append(f"Factor weights list factor file {row[0]} more than once.")
+                continue
+            self.factors[row[0]] = values
+
+        for row in self.rows(scenarioTable, SCENARIO_WEIGHTS_COLUMNS, 2, "Scenario weights"):
+            scenario, fileName = row[0], row[1]
+            if scenario not in self.scenarios:
+                self.scenarios.append(scenario)
+            values = self.values(row, SCENARIO_WEIGHTS_COLUMNS, 2, "Scenario weights", f"scenario {scenario} and factor file {fileName}")
+            if values is None:
+                continue
+            if (scenario, fileName) in self.multipliers:
+                self.problems.append(f"Scenario weights list scenario {scenario} and factor file {fileName} more than once.")
+                continue
+            self.multipliers[(scenario, fileName)] = values
+
+    @classmethod
+    def fromFiles(cls, factorPath, scenarioPath):
+        return cls(readFactorWeights(factorPath), readScenarioWeights(scenarioPath))
+
+    def rows(self, table, columns, keys, name):
+        # split the flattened table into rows, key columns as text
+        n = len(columns)
+        if len(table) % n:
+            self.problems.append(f"{name} have an incomplete last row, every row needs {n} values.")
+        for j in range(0, len(table) - n + 1, n):
+            row = table[j:j + n]
+            yield [str(v).strip() for v in row[:keys]] + list(row[keys:])
+
+    def values(self, row, columns, keys, name, label):
+        # numbers of the value columns, every value which is not a number is
+        # added to problems and None returned
+        values = tuple(number(v) for v in row[keys:])
+        for column, value, converted in zip(columns[keys:], row[keys:], values):
+            if converted is None:
+                self.problems.append(f"{name} for {label} have a non-numeric {column} '{value}'.")
+        return None if None in values else values
+
+    def factorWeights(self, fileName):
+        # pressure and opportunity weights of the factor
+        try:
+            return self.factors[fileName]
+        except KeyError:
+            raise QgsProcessingException(f"Could not find pressure and opportunity weights for factor file {fileName}.")
+
+    def scenarioMultipliers(self, scenario, fileName):
+        # opportunity and pressure multipliers of the scenario and factor
+        try:
+            return self.multipliers[(scenario, fileName)]
+        except KeyError:
+            raise QgsProcessingException(f"Could not find pressure and opportunity multipliers scenario {scenario} and factor file {fileName}.")
+
+    def missing(self, fileNames):
+        # factors and scenario multipliers the given factor files need but
+        # are not listed
+        problems = [f"Factor weights do not list factor file {f}." for f in fileNames if f not in self.factors]
+        for s in self.scenarios:
+            absent = [f for f in fileNames if (s, f) not in self.multipliers]
+            if absent:
+                problems.append(f"Scenario weights of scenario {s} do not list factor file(s) {', '.join(absent)}.")
+        return problems
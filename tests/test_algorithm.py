@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+core = pytest.importorskip("qgis.core")
+
+from mopst.algorithm import MopstAlgorithm, OUTPUT_FILES
+from mopst.paths import partialPath
+from mopst.profiler import Profiler
+from mopst.scratch import ScratchSpace
+from mopst.checkpoint import Checkpoint
+
+
+def writeRaster(path, values):
+    ds = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((0, 10, 0, 0, 0, -10))
+    ds.GetRasterBand(1).WriteArray(values)
+    ds = None
+    return path
+
+
+def testCubesOfCalculatorOutputs(tmp_path):
+    # the raster calculator engines write separate rasters, which are
+    # stacked into one cube per scenario
+    algorithm = MopstAlgorithm()
+    algorithm.outputDir = str(tmp_path)
+    algorithm.scenarios = ["S1", "BASELINE"]
+    algorithm.blockSize = 16
+    algorithm.memoryBudget = 64 * 1024 * 1024
+    algorithm.threads = 1
+    os.makedirs(tmp_path / "scenario-S1")
+
+    outputs = {}
+    stale = set()
+    for s in algorithm.scenarios:
+        for i, (key, name) in enumerate(OUTPUT_FILES):
+            values = numpy.full((20, 30), i + (10 if s == "S1" else 0), numpy.float32)
+            outputs[f"{s}_{key}"] = writeRaster(str(tmp_path / f"{s}-{name}"), values)
+            stale.add((s, key))
+
+    assert algorithm.writeCubes(stale, outputs, core.QgsProcessingFeedback())
+
+    for s in algorithm.scenarios:
+        ds = gdal.Open(algorithm.cubePath(s))
+        assert ds.RasterCount == len(OUTPUT_FILES)
+        for i in range(len(OUTPUT_FILES)):
+            band = ds.GetRasterBand(i + 1)
+            assert band.GetDescription() == algorithm.cubeBands()[i]
+            assert (band.ReadAsArray() == i + (10 if s == "S1" else 0)).all()
+
+
+def testPartialFilesRemovedWhenRunFails(tmp_path):
+    algorithm = MopstAlgorithm()
+    partials = [partialPath(str(tmp_path / "pressure-summer.tif")),
+                partialPath(str(tmp_path / "summer_landcover.tif"))]
+
+    def runModel(parameters, context, feedback):
+        # fails after the first chain step and rasterization started
+        algorithm.outputDir = str(tmp_path)
+        algorithm.destinations = {"BASELINE_PRESSURE_SUMMER": partials[0]}
+        for path in partials:
+            open(path, "wb").close()
+        raise core.QgsProcessingException("failed")
+
+    algorithm.runModel = runModel
+    with pytest.raises(core.QgsProcessingException):
+        algorithm.processAlgorithm({}, None, core.QgsProcessingFeedback())
+    assert not any(os.path.exists(path) for path in partials)
+
+
+def testCheckpointSavedWhenRunFails(tmp_path):
+    # factors completed since the last checkpoint are saved before the
+    # error is raised
+    algorithm = MopstAlgorithm()
+    dependencies = {"inputs": "digest"}
+
+    def runModel(parameters, context, feedback):
+        algorithm.outputDir = str(tmp_path)
+        algorithm.profiler = Profiler()
+        algorithm.gridSize = (30, 20)
+        algorithm.scratch = ScratchSpace(str(tmp_path))
+        algorithm.checkpoint = Checkpoint(str(tmp_path), dependencies, 3600)
+        outputs = {}
+        for key, name in OUTPUT_FILES:
+            outputs[f"BASELINE_{key}"] = writeRaster(algorithm.scratch.path(), numpy.full((20, 30), 2, numpy.float32))
+        algorithm.keepChainState(2, ["BASELINE"], outputs)
+        raise core.QgsProcessingException("failed")
+
+    algorithm.runModel = runModel
+    with pytest.raises(core.QgsProcessingException):
+        algorithm.processAlgorithm({}, None, core.QgsProcessingFeedback())
+
+    checkpoint = Checkpoint(str(tmp_path), dependencies, 0)
+    assert checkpoint.load()
+    state = checkpoint.stage("chain")
+    assert state["factors"] == 2
+    assert sorted(state["rasters"]) == sorted(f"BASELINE_{key}" for key, name in OUTPUT_FILES)
+    assert all(os.path.isfile(checkpoint.rasterPath(name, state)) for name in state["rasters"].values())
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+from mopst.cache import RasterCache
+
+
+def testRestoreOfEvictedEntryIsAMiss(tmp_path, monkeypatch):
+    # another process evicts the entry after the first file was copied
+    cache = RasterCache(str(tmp_path / "cache"), 1024 * 1024)
+    sources = {}
+    for name in ("a.tif", "b.tif"):
+        sources[name] = str(tmp_path / name)
+        with open(sources[name], "wb") as f:
+            f.write(name.encode())
+    cache.store("key", sources)
+
+    copyfile = shutil.copyfile
+
+    def evictingCopy(source, destination):
+        copyfile(source, destination)
+        shutil.rmtree(cache.entryPath("key"))
+
+    monkeypatch.setattr(shutil, "copyfile", evictingCopy)
+    destinations = {name: str(tmp_path / f"restored-{name}") for name in sources}
+    assert not cache.restore("key", destinations)
+    assert not any(os.path.exists(path) for path in destinations.values())
+
+
+def testLeastRecentlyUsedEntriesAreEvicted(tmp_path):
+    source = tmp_path / "landcover.tif"
+    source.write_bytes(b"x" * 100)
+    cache = RasterCache(str(tmp_path / "cache"), 250)
+
+    for i, key in enumerate(("first", "second")):
+        cache.store(key, {"landcover.tif": str(source)})
+        os.utime(cache.entryPath(key), (i, i))
+
+    # restoring marks the entry as recently used
+    assert cache.restore("first", {"landcover.tif": str(tmp_path / "restored.tif")})
+    cache.store("third", {"landcover.tif": str(source)})
+    assert os.path.isdir(cache.entryPath("first"))
+    assert not os.path.exists(cache.entryPath("second"))
+    assert os.path.isdir(cache.entryPath("third"))
+    assert not cache.restore("second", {"landcover.tif": str(tmp_path / "restored.tif")})
+
+
+def testKeysFollowFileContents(tmp_path):
+    cache = RasterCache(str(tmp_path / "cache"), 0)
+    a = tmp_path / "a.shp"
+    b = tmp_path / "b.shp"
+    a.write_bytes(b"polygons")
+    b.write_bytes(b"polygons")
+    assert cache.key([str(a)], {"field": "score"}) == cache.key([str(b)], {"field": "score"})
+    assert cache.key([str(a)], {"field": "score"}) != cache.key([str(a)], {"field": "other"})
+    b.write_bytes(b"changed polygons")
+    assert cache.key([str(a)], {"field": "score"}) != cache.key([str(b)], {"field": "score"})
+    assert cache.key([str(tmp_path / "missing.shp")], {}) is None
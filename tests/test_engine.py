@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+
+from mopst.engine import BlockEngine, MIN_BLOCK_SIZE
+
+
+class Feedback:
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, progress):
+        pass
+
+    def pushInfo(self, info):
+        pass
+
+
+def writeRaster(path, values):
+    ds = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((0, 10, 0, 0, 0, -10))
+    ds.GetRasterBand(1).WriteArray(values)
+    ds = None
+    return path
+
+
+@pytest.mark.parametrize("blockSize", [560, 1200])
+@pytest.mark.parametrize("memoryBudget", [16 * 1024 * 1024 + 50000, 20 * 1024 * 1024, 64 * 1024 * 1024])
+def testWindowsNestWithinTiles(blockSize, memoryBudget):
+    engine = BlockEngine(blockSize, memoryBudget, 4)
+    engine.addSource("SUMMER", "summer.tif")
+    for i in range(20):
+        engine.addOperation("SUMMER", 1.0, [f"{i}.tif"])
+    size = engine.windowSize()
+    assert size >= MIN_BLOCK_SIZE
+    assert engine.blockSize % size == 0
+
+
+def testWindowsCoverTilesOneAfterTheOther():
+    engine = BlockEngine(64, 16 * 1024 * 1024 + 50000, 4)
+    engine.addSource("SUMMER", "summer.tif")
+    for i in range(20):
+        engine.addOperation("SUMMER", 1.0, [f"{i}.tif"])
+    assert engine.windowSize() < engine.blockSize
+
+    covered = numpy.zeros((150, 200), numpy.int32)
+    tiles = []
+    for xOff, yOff, xSize, ySize in engine.windows(200, 150):
+        covered[yOff:yOff + ySize, xOff:xOff + xSize] += 1
+        tile = (xOff // engine.blockSize, yOff // engine.blockSize)
+        assert ((xOff + xSize - 1) // engine.blockSize, (yOff + ySize - 1) // engine.blockSize) == tile
+        if not tiles or tiles[-1] != tile:
+            tiles.append(tile)
+    assert (covered == 1).all()
+    assert tiles == list(engine.tileIndexes(200, 150))
+
+
+def testSparseScoresPixelsNextToTileBorders(tmp_path):
+    # a block size which is not a power of two with a small budget, the
+    # only pixel to score lies in the second tile close to its left border
+    width, height = 1300, 40
+    landcover = numpy.full((height, width), 2, numpy.float32)
+    mask = numpy.zeros((height, width), numpy.float32)
+    mask[5, 1210] = 1
+
+    engine = BlockEngine(1200, 16 * 1024 * 1024 + 50000, 1)
+    engine.addSource("SUMMER", writeRaster(str(tmp_path / "summer.tif"), landcover))
+    engine.addMask(writeRaster(str(tmp_path / "mask.tif"), mask))
+    engine.addOperation("SUMMER", 3.0, [str(tmp_path / "out.tif")])
+    engine.occupied = engine.occupancy()
+    assert engine.occupied == {(1, 0)}
+    assert engine.run(Feedback())
+
+    result = gdal.Open(str(tmp_path / "out.tif")).GetRasterBand(1).ReadAsArray()
+    assert result[5, 1210] == 6
+    assert (result[mask == 0] != 6).all()
+
+
+def testSparseValidityPerSource(tmp_path):
+    # a pixel scored only in winter is nodata in the summer output and
+    # scored in the winter output, and the reverse
+    summer = numpy.full((20, 30), 2, numpy.float32)
+    winter = numpy.full((20, 30), 5, numpy.float32)
+    summer[3, 4] = 0
+    winter[6, 7] = 0
+    mask = numpy.ones((20, 30), numpy.float32)
+    mask[0, 0] = 0
+
+    engine = BlockEngine(16, 64 * 1024 * 1024, 1)
+    engine.addSource("SUMMER", writeRaster(str(tmp_path / "summer.tif"), summer))
+    engine.addSource("WINTER", writeRaster(str(tmp_path / "winter.tif"), winter))
+    engine.addMask(writeRaster(str(tmp_path / "mask.tif"), mask))
+    engine.addOperation("SUMMER", 3.0, [str(tmp_path / "summer-out.tif")])
+    engine.addOperation("WINTER", 3.0, [str(tmp_path / "winter-out.tif")])
+    engine.occupied = engine.occupancy()
+    assert engine.run(Feedback())
+
+    for name, scores in (("summer", summer), ("winter", winter)):
+        result = gdal.Open(str(tmp_path / f"{name}-out.tif")).GetRasterBand(1).ReadAsArray()
+        valid = (scores != 0) & (mask != 0)
+        assert (result[valid] == 3 * scores[valid]).all()
+        assert (result[~valid] == engine.nodata).all()
+
+
+def testOccupancyReadsMasksAndSourcesUntilFirstScoredWindow(tmp_path):
+    landcover = numpy.full((64, 64), 2, numpy.float32)
+    mask = numpy.zeros((64, 64), numpy.float32)
+    mask[0, 0] = 1
+
+    class CountingEngine(BlockEngine):
+
+        def read(self, datasets, window):
+            reads.append((window, sorted(map(str, datasets))))
+            return super().read(datasets, window)
+
+    reads = []
+    engine = CountingEngine(64, 16 * 1024 * 1024 + 50000, 1)
+    engine.addSource("SUMMER", writeRaster(str(tmp_path / "summer.tif"), landcover))
+    engine.addMask(writeRaster(str(tmp_path / "mask.tif"), mask))
+    engine.addFactor(str(tmp_path / "missing-factor.tif"))
+    for i in range(20):
+        engine.addOperation("SUMMER", (1.0,), [str(tmp_path / f"{i}.tif")])
+    size = engine.windowSize()
+    assert size < 64
+
+    assert engine.occupancy() == {(0, 0)}
+    assert reads == [((0, 0, size, size), sorted(["('MASK', 0)", "SUMMER"]))]
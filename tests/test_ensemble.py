@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+core = pytest.importorskip("qgis.core")
+
+from mopst.ensemble import EnsembleEngine, drawCoefficients, statisticNames, BYTES_PER_DRAW
+from mopst.planner import ScoringPlan
+from mopst.weights import WeightModel
+
+FILE_NAMES = ["roads.tif", "rivers.tif"]
+
+
+class Feedback:
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, progress):
+        pass
+
+
+def weights():
+    return WeightModel(["roads.tif", 2, 0.5, "rivers.tif", -1, 3],
+                       ["S1", "roads.tif", 1, 2, "S1", "rivers.tif", 0.5, 1])
+
+
+def writeRaster(path, values):
+    ds = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((0, 10, 0, 0, 0, -10))
+    ds.GetRasterBand(1).WriteArray(values)
+    ds = None
+    return path
+
+
+@pytest.mark.parametrize("perFactor", [False, True])
+def testDrawsWithoutSpreadAreTheFoldedCoefficients(perFactor):
+    model = weights()
+    terms = {("BASELINE", "PRESSURE"): [(2,), (-1,)], ("BASELINE", "OPPORTUNITY"): [(0.5,), (3,)],
+             ("S1", "PRESSURE"): [(2, 2), (-1, 1)], ("S1", "OPPORTUNITY"): [(0.5, 1), (3, 0.5)]}
+    plan = ScoringPlan(terms, 2, perFactor)
+
+    draws = drawCoefficients(model, FILE_NAMES, ["S1"], 5, 0.0, "normal", 0, perFactor)
+    for key, coefficient in plan.coefficients.items():
+        expected = numpy.array(coefficient if perFactor else [coefficient], numpy.float32)
+        assert draws[key].shape == (len(expected), 5)
+        assert (draws[key] == expected[:, None]).all()
+
+
+def testDrawsVaryAroundTheWeights():
+    model = weights()
+    draws = drawCoefficients(model, FILE_NAMES, ["S1"], 2000, 0.1, "uniform", 0, True)
+    again = drawCoefficients(model, FILE_NAMES, ["S1"], 2000, 0.1, "uniform", 0, True)
+    assert all((draws[key] == again[key]).all() for key in draws)
+
+    baseline = draws[("BASELINE", "PRESSURE")]
+    assert (numpy.abs(baseline[0] - 2) <= 0.2 + 1e-6).all()
+    assert abs(baseline[0].mean() - 2) < 0.02
+    # factor weights are shared by the baseline and the scenarios
+    scenario = draws[("S1", "PRESSURE")][0]
+    assert (numpy.abs(scenario / baseline[0] - 2) <= 0.2 + 1e-5).all()
+
+
+def testStatisticsInChunksMatchAllDrawsAtOnce():
+    random = numpy.random.default_rng(5)
+    patterns = random.integers(0, 2, (50, 3)).astype(numpy.float32)
+    draws = random.normal(1, 0.2, (3, 101)).astype(numpy.float32)
+
+    engine = EnsembleEngine(16, 4 * 1024 * 1024, 1, (5, 50, 95))
+    # a quarter of the budget holds 7 patterns of 101 draws
+    small = EnsembleEngine(16, 4 * 7 * 101 * BYTES_PER_DRAW, 1, (5, 50, 95))
+    assert small.chunkSize(101) == 7
+    stats = engine.statistics(patterns, draws)
+    assert numpy.array_equal(small.statistics(patterns, draws), stats)
+
+    values = patterns.astype(numpy.float64) @ draws
+    q = numpy.array([5, 50, 95])
+    assert numpy.allclose(stats[:, 0], values.mean(axis=1), rtol=1e-5)
+    assert numpy.allclose(stats[:, 1], values.std(axis=1), rtol=1e-4, atol=1e-6)
+    assert numpy.allclose(stats[:, 2:5], numpy.percentile(values, q, axis=1).T, rtol=1e-5)
+    assert numpy.allclose(stats[:, 5:8], numpy.percentile(values, 100 - q, axis=1).T, rtol=1e-5)
+
+
+def testEnsembleRasterOfNegativeAndPositiveLandcover(tmp_path):
+    landcover = numpy.array([[-2, -1, 0], [1, 3, 0.5]], numpy.float32)
+    draws = numpy.random.default_rng(6).normal(2, 0.5, (1, 301)).astype(numpy.float32)
+    percentiles = (10, 50, 90)
+    names = statisticNames(percentiles)
+    path = str(tmp_path / "pressure-summer-ensemble.tif")
+
+    engine = EnsembleEngine(16, 64 * 1024 * 1024, 1, percentiles)
+    engine.addSource("SUMMER", writeRaster(str(tmp_path / "summer.tif"), landcover))
+    engine.addDraws(("BASELINE", "PRESSURE"), draws)
+    engine.addCube(path, names)
+    for i in range(len(names)):
+        engine.addOperation("SUMMER", (("BASELINE", "PRESSURE"), i), [(path, i + 1)])
+    assert engine.run(Feedback())
+
+    ds = gdal.Open(path)
+    values = landcover.astype(numpy.float64)[..., None] * draws[0].astype(numpy.float64)
+    expected = [values.mean(axis=2), values.std(axis=2)] + [numpy.percentile(values, q, axis=2) for q in percentiles]
+    for i, statistic in enumerate(expected):
+        assert numpy.allclose(ds.GetRasterBand(i + 1).ReadAsArray(), statistic, rtol=1e-4, atol=1e-5), names[i]
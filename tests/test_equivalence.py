@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+gdal = pytest.importorskip("osgeo.gdal")
+core = pytest.importorskip("qgis.core")
+
+from mopst.algorithm import MopstAlgorithm, OUTPUT_FILES
+from mopst.planner import ScoringPlan
+from mopst.profiler import Profiler
+from mopst.scratch import ScratchSpace
+from mopst.weights import WeightModel
+
+WIDTH, HEIGHT = 45, 37
+
+FACTORS = ["factors/roads.tif", "factors/rivers.tif", "factors/lakes.tif"]
+
+FACTOR_WEIGHTS = ["roads.tif", 2, 0.5,
+                  "rivers.tif", -1.25, 3,
+                  "lakes.tif", 0.1, 0.3]
+
+# S2 repeats the multipliers of S1, so the folded plan shares operations
+SCENARIO_WEIGHTS = ["S1", "roads.tif", 1, 2, "S1", "rivers.tif", 0, 1, "S1", "lakes.tif", 1.5, 1.5,
+                    "S2", "roads.tif", 1, 2, "S2", "rivers.tif", 0, 1, "S2", "lakes.tif", 1.5, 1.5,
+                    "S3", "roads.tif", 0.5, 0, "S3", "rivers.tif", 2, 2, "S3", "lakes.tif", 0, 1]
+
+
+class Feedback:
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, progress):
+        pass
+
+    def setCurrentStep(self, step):
+        pass
+
+    def pushInfo(self, info):
+        pass
+
+    def pushWarning(self, warning):
+        pass
+
+
+def writeRaster(path, values):
+    ds = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((0, 10, 0, 0, 0, -10))
+    ds.GetRasterBand(1).WriteArray(values)
+    ds = None
+    return path
+
+
+def readRaster(path):
+    return gdal.Open(path).GetRasterBand(1).ReadAsArray()
+
+
+@pytest.fixture
+def landcover(tmp_path):
+    # seasonal scores like those burnt by gdal:rasterize, 0 outside the
+    # landcover polygons
+    random = numpy.random.default_rng(1)
+    rasters = {}
+    for season in ("SUMMER", "WINTER"):
+        values = random.integers(0, 6, (HEIGHT, WIDTH)).astype(numpy.float32)
+        values[:5, :] = 0
+        rasters[f"LANDCOVER_{season}"] = {"OUTPUT": writeRaster(str(tmp_path / f"{season.lower()}.tif"), values)}
+    return rasters
+
+
+def runAlgorithm(tmp_path, name, landcover, inMemory=False):
+    algorithm = MopstAlgorithm()
+    algorithm.outputDir = str(tmp_path / name)
+    algorithm.scenarios = ["S1", "S2", "S3"]
+    for s in algorithm.scenarios:
+        os.makedirs(os.path.join(algorithm.outputDir, f"scenario-{s}"))
+    os.makedirs(tmp_path / f"{name}-scratch")
+    algorithm.scratch = ScratchSpace(str(tmp_path / f"{name}-scratch"), memoryBudget=64 * 1024 * 1024 if inMemory else 0)
+    algorithm.inMemory = inMemory
+    algorithm.calculator = None
+    algorithm.destinations = {}
+    algorithm.checkpoint = None
+    algorithm.chainState = None
+    algorithm.profiler = Profiler()
+    algorithm.gridSize = (WIDTH, HEIGHT)
+    algorithm.gridTemplate = landcover["LANDCOVER_SUMMER"]["OUTPUT"]
+    algorithm.blockSize = 16
+    algorithm.memoryBudget = 64 * 1024 * 1024
+    algorithm.workers = 1
+    algorithm.threads = 1
+    return algorithm
+
+
+def results(outputs, scenarios):
+    return {f"{s}_{key}": readRaster(outputs[f"{s}_{key}"]) for s in scenarios for key, name in OUTPUT_FILES}
+
+
+def calculatorChain(tmp_path, landcover, inMemory):
+    algorithm = runAlgorithm(tmp_path, "chain", landcover, inMemory)
+    outputs = dict(landcover)
+    weights = WeightModel(FACTOR_WEIGHTS, SCENARIO_WEIGHTS)
+    assert algorithm.runCalculatorChain(FACTORS, weights, algorithm.scenarios, outputs, None,
+                                        Feedback(), Feedback(), 0) is not None
+    return results(outputs, ["BASELINE"] + algorithm.scenarios)
+
+
+def plan(algorithm):
+    weights = WeightModel(FACTOR_WEIGHTS, SCENARIO_WEIGHTS)
+    return ScoringPlan(algorithm.scoringTerms(FACTORS, weights), len(FACTORS))
+
+
+@pytest.mark.parametrize("inMemory", [False, True])
+def testEnginesMatchCalculatorChain(tmp_path, landcover, monkeypatch, inMemory):
+    if not inMemory:
+        # gdal:rastercalculator steps run gdal_calc.py
+        gdal_calc = pytest.importorskip("osgeo_utils.gdal_calc")
+
+        def runChild(self, algorithm, params, context, feedback):
+            assert algorithm == "gdal:rastercalculator" and params["RTYPE"] == 5
+            inputs = {name: params[f"INPUT_{name}"] for name in "AB" if f"INPUT_{name}" in params}
+            gdal_calc.Calc(params["FORMULA"], params["OUTPUT"], type="Float32", quiet=True, **inputs)
+            return {"OUTPUT": params["OUTPUT"]}
+
+        monkeypatch.setattr(MopstAlgorithm, "runChild", runChild)
+
+    chain = calculatorChain(tmp_path, landcover, inMemory)
+    assert all(values.any() for values in chain.values())
+
+    block = runAlgorithm(tmp_path, "block", landcover)
+    blockOutputs = dict(landcover)
+    assert block.runBlockEngine(plan(block), False, [], [], None, blockOutputs, Feedback())
+
+    folded = runAlgorithm(tmp_path, "folded", landcover, inMemory)
+    foldedPlan = plan(folded)
+    assert len(foldedPlan.operations) < foldedPlan.chainPasses()
+    foldedOutputs = dict(landcover)
+    assert folded.runPlannedCalculator(foldedPlan, foldedOutputs, None, Feedback(), Feedback(), 0) is not None
+
+    # sums of the same terms in a different order
+    scenarios = ["BASELINE"] + block.scenarios
+    for engine in (results(blockOutputs, scenarios), results(foldedOutputs, scenarios)):
+        for name, expected in chain.items():
+            assert numpy.allclose(engine[name], expected, rtol=1e-6, atol=1e-5), name
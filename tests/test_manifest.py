@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from mopst.manifest import RunManifest, MANIFEST_FILE
+
+
+def writeOutput(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"raster")
+    return str(path)
+
+
+def testRecordedOutputsAreCurrentInALaterRun(tmp_path):
+    path = writeOutput(tmp_path / "scenario-S1" / "pressure-summer.tif")
+    dependencies = {"landcover": "digest", "terms": [(2.0, 1.5)], "engine": 1}
+
+    manifest = RunManifest(str(tmp_path))
+    assert not manifest.isCurrent(path, dependencies)
+    manifest.record(path, dependencies)
+    manifest.save()
+
+    manifest = RunManifest(str(tmp_path))
+    assert manifest.name(path) == "scenario-S1/pressure-summer.tif"
+    # tuples are stored as lists
+    assert manifest.isCurrent(path, dependencies)
+    assert not manifest.isCurrent(path, dict(dependencies, terms=[(2.0, 1.0)]))
+    assert not manifest.isCurrent(path, dict(dependencies, masks="digest"))
+
+
+def testMissingOrForgottenOutputsAreStale(tmp_path):
+    path = writeOutput(tmp_path / "pressure-summer.tif")
+    manifest = RunManifest(str(tmp_path))
+    manifest.record(path, {"landcover": "digest"})
+    manifest.record(str(tmp_path / "never-written.tif"), {"landcover": "digest"})
+    assert not manifest.isCurrent(str(tmp_path / "never-written.tif"), {"landcover": "digest"})
+
+    manifest.forget(path)
+    manifest.save()
+    assert not RunManifest(str(tmp_path)).isCurrent(path, {"landcover": "digest"})
+
+
+def testManifestOfAnotherVersionIsIgnored(tmp_path):
+    path = writeOutput(tmp_path / "pressure-summer.tif")
+    manifest = RunManifest(str(tmp_path))
+    manifest.record(path, {"landcover": "digest"})
+    manifest.save()
+
+    with open(tmp_path / MANIFEST_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] = -1
+    with open(tmp_path / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert not RunManifest(str(tmp_path)).isCurrent(path, {"landcover": "digest"})
+
+    (tmp_path / MANIFEST_FILE).write_text("{not json", encoding="utf-8")
+    assert RunManifest(str(tmp_path)).outputs == {}
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from mopst.planner import ScoringPlan
+
+
+def terms():
+    # two factors, S2 has the same multipliers as S1
+    return {("BASELINE", "PRESSURE"): [(2,), (0.5,)],
+            ("BASELINE", "OPPORTUNITY"): [(1,), (-3,)],
+            ("S1", "PRESSURE"): [(2, 1.5), (0.5, 2)],
+            ("S1", "OPPORTUNITY"): [(1, 0), (-3, 1)],
+            ("S2", "PRESSURE"): [(2, 1.5), (0.5, 2)],
+            ("S2", "OPPORTUNITY"): [(1, 0), (-3, 1)],
+           }
+
+
+def testTermsFoldIntoOneCoefficientPerOutput():
+    plan = ScoringPlan(terms(), 2)
+    assert plan.coefficients == {("BASELINE", "PRESSURE"): 2.5,
+                                 ("BASELINE", "OPPORTUNITY"): -2.0,
+                                 ("S1", "PRESSURE"): 4.0,
+                                 ("S1", "OPPORTUNITY"): -3.0,
+                                 ("S2", "PRESSURE"): 4.0,
+                                 ("S2", "OPPORTUNITY"): -3.0}
+
+
+def testOutputsWithTheSameCoefficientShareAnOperation():
+    plan = ScoringPlan(terms(), 2)
+    # four distinct coefficients in each season
+    assert len(plan.operations) == 8
+    operations = {(season, coefficient): targets for season, coefficient, targets in plan.operations}
+    assert operations[("WINTER", 4.0)] == [("S1", "PRESSURE_WINTER"), ("S2", "PRESSURE_WINTER")]
+    assert operations[("SUMMER", -2.0)] == [("BASELINE", "OPPORTUNITY_SUMMER")]
+    # every output is written by exactly one operation
+    written = [t for season, coefficient, targets in plan.operations for t in targets]
+    assert len(written) == len(set(written)) == 12
+    # 4 + 8 steps per factor for the baseline and each scenario
+    assert plan.chainPasses() == 36
+
+
+def testPerFactorCoefficients():
+    plan = ScoringPlan(terms(), 2, True)
+    assert plan.coefficients[("S1", "PRESSURE")] == (3.0, 1.0)
+    assert plan.coefficients[("S1", "OPPORTUNITY")] == (0.0, -3.0)
+    assert ("SUMMER", (3.0, 1.0), [("S1", "PRESSURE_SUMMER"), ("S2", "PRESSURE_SUMMER")]) in plan.operations
+
+
+def testRestrictKeepsOperationsOfTheGivenOutputs():
+    plan = ScoringPlan(terms(), 2)
+    plan.restrict({("S2", "PRESSURE_WINTER"), ("BASELINE", "PRESSURE_SUMMER")})
+    assert plan.operations == [("SUMMER", 2.5, [("BASELINE", "PRESSURE_SUMMER")]),
+                               ("WINTER", 4.0, [("S2", "PRESSURE_WINTER")])]
+    assert "Planned raster passes: 2" in plan.describe()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from mopst.summary import Histogram, OutputSummary, RunSummary, HISTOGRAM_BINS
+
+
+def blocks(values, zone, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size], zone[start:start + size]
+
+
+def testMergedBlocksMatchStatisticsOfAllValues():
+    random = numpy.random.default_rng(3)
+    values = random.normal(10, 4, 1000).astype(numpy.float32)
+    zone = random.integers(0, 3, 1000).astype(numpy.float32)
+    zone[::7] = 255
+
+    summary = OutputSummary()
+    for block, zoneBlock in blocks(values, zone, 64):
+        summary.merge(OutputSummary.ofBlock(block, {"areas": (zoneBlock, 255)}))
+    summary.merge(OutputSummary.ofBlock(values[:0], {}))
+
+    result = summary.toDict({"areas": {1: "inside"}})
+    expected = values.astype(numpy.float64)
+    assert result["pixels"] == 1000
+    assert result["min"] == expected.min() and result["max"] == expected.max()
+    assert math.isclose(result["mean"], expected.mean())
+    assert math.isclose(result["std"], expected.std())
+    assert math.isclose(result["sum"], expected.sum())
+
+    rows = {row["value"]: row for row in result["zones"]["areas"]}
+    assert sorted(rows) == [0, 1, 2]
+    assert rows[1]["name"] == "inside"
+    for key, row in rows.items():
+        inZone = expected[zone == key]
+        assert row["pixels"] == len(inZone)
+        assert math.isclose(row["sum"], inZone.sum())
+
+
+def testHistogramOfBlocksCountsEveryValueInItsBin():
+    random = numpy.random.default_rng(4)
+    values = numpy.concatenate([random.uniform(0, 1, 500), random.uniform(-300, 900, 500), [1e-3, 5.0]])
+
+    histogram = Histogram()
+    for start in range(0, len(values), 100):
+        other = Histogram()
+        other.add(values[start:start + 100])
+        histogram.merge(other.width, other.counts)
+
+    rows = histogram.rows()
+    assert len(rows) <= HISTOGRAM_BINS
+    assert sum(count for lo, hi, count in rows) == len(values)
+    assert math.log2(histogram.width).is_integer()
+    for lo, hi, count in rows:
+        assert count == ((values >= lo) & (values < hi)).sum()
+
+
+def testRunSummaryKeepsEarlierOutputs(tmp_path):
+    summary = RunSummary(str(tmp_path))
+    summary.update("pressure-summer.tif", OutputSummary.ofBlock(numpy.array([1.0, 3.0]), {}), {})
+    summary.update("pressure-winter.tif", OutputSummary.ofBlock(numpy.array([2.0]), {}), {})
+    summary.write()
+
+    summary = RunSummary(str(tmp_path))
+    summary.update("pressure-winter.tif", OutputSummary.ofBlock(numpy.array([4.0]), {}), {})
+    summary.restrict(["pressure-summer.tif", "pressure-winter.tif"])
+    assert summary.outputs["pressure-summer.tif"]["mean"] == 2.0
+    assert summary.outputs["pressure-winter.tif"]["mean"] == 4.0
+    summary.restrict(["pressure-winter.tif"])
+    assert list(summary.outputs) == ["pressure-winter.tif"]
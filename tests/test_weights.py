@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+core = pytest.importorskip("qgis.core")
+
+from mopst.weights import WeightModel, readFactorWeights, readScenarioWeights
+
+
+def writeCsv(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def testWeightsFilesIndexedByFactorAndScenario(tmp_path):
+    factors = writeCsv(tmp_path / "factors.csv",
+                       "Factor-File, Pressure-Weight, Opportunity-Weight\n"
+                       "roads.tif, 2, 0.5\n"
+                       ",,\n"
+                       "rivers.tif, -1, 3\n")
+    scenarios = writeCsv(tmp_path / "scenarios.csv",
+                         "scenario,factor-file,opportunity-multiplier,pressure-multiplier\n"
+                         "S1,roads.tif,1,2\n"
+                         "S1,rivers.tif,0,1\n")
+    assert readFactorWeights(factors) == ["roads.tif", "2", "0.5", "rivers.tif", "-1", "3"]
+
+    weights = WeightModel.fromFiles(factors, scenarios)
+    assert weights.problems == []
+    assert weights.factorWeights("rivers.tif") == (-1.0, 3.0)
+    assert weights.scenarioMultipliers("S1", "roads.tif") == (1.0, 2.0)
+    assert weights.scenarios == ["S1"]
+    assert weights.missing(["roads.tif", "lakes.tif"]) == [
+        "Factor weights do not list factor file lakes.tif.",
+        "Scenario weights of scenario S1 do not list factor file(s) lakes.tif."]
+
+
+def testEveryNonNumericCellIsAProblem(tmp_path):
+    factors = writeCsv(tmp_path / "factors.csv",
+                       "factor-file,pressure-weight,opportunity-weight\n"
+                       "roads.tif,high,low\n"
+                       "rivers.tif,1,\n"
+                       "roads.tif,1,1\n")
+    scenarios = writeCsv(tmp_path / "scenarios.csv",
+                         "scenario,factor-file,opportunity-multiplier,pressure-multiplier\n"
+                         "S1,roads.tif,one,2\n")
+
+    weights = WeightModel(readFactorWeights(factors), readScenarioWeights(scenarios))
+    assert weights.problems == [
+        "Factor weights for factor file roads.tif have a non-numeric pressure-weight 'high'.",
+        "Factor weights for factor file roads.tif have a non-numeric opportunity-weight 'low'.",
+        "Factor weights for factor file rivers.tif have a non-numeric opportunity-weight ''.",
+        "Scenario weights for scenario S1 and factor file roads.tif have a non-numeric opportunity-multiplier 'one'."]
+    assert weights.factorWeights("roads.tif") == (1.0, 1.0)
+
+
+def testMissingColumnRaises(tmp_path):
+    factors = writeCsv(tmp_path / "factors.csv", "factor-file,pressure-weight\nroads.tif,1\n")
+    with pytest.raises(core.QgsProcessingException):
+        readFactorWeights(factors)
+
+
+def testMatrixRowsWithAnIncompleteLastRow():
+    weights = WeightModel(["roads.tif", 1, 2, "rivers.tif", 3], ["S1", "roads.tif", 1, 1, "S1", "roads.tif", 2, 2])
+    assert weights.factors == {"roads.tif": (1.0, 2.0)}
+    assert weights.multipliers == {("S1", "roads.tif"): (1.0, 1.0)}
+    assert weights.problems == [
+        "Factor weights have an incomplete last row, every row needs 3 values.",
+        "Scenario weights list scenario S1 and factor file roads.tif more than once."]